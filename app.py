@@ -1,4 +1,5 @@
 import os
+import sys
 import requests
 import json
 import re
@@ -6,7 +7,20 @@ import logging
 import time
 import datetime
 import threading
-from slack_bolt import App
+import sqlite3
+import zlib
+import bisect
+import heapq
+import math
+import mmap
+import random
+import functools
+from array import array
+from collections import OrderedDict, Counter, deque
+from typing import Optional
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from slack_bolt import App, BoltResponse
 from slack_bolt.adapter.aws_lambda import SlackRequestHandler
 
 g_logger = logging.getLogger()
@@ -26,23 +40,141 @@ SPOONACULAR_HEADERS = {
     "Content-Type": 'application/json'
 }
 SPOON_BOT_CONVO_CONTEXT_ID = "112233445566778899"
-USER_INFO = {
+# Seconds to wait on Spoonacular (connect and read) before giving up on a request
+SPOONACULAR_TIMEOUT = float(os.environ.get("SPOONACULAR_TIMEOUT", 8))
+
+# Circuit breaker Configs (one breaker per Spoonacular endpoint)
+# Trips once at least MIN_CALLS of the last WINDOW calls were made and the failure or slow call share reaches its rate
+CIRCUIT_BREAKER_WINDOW = int(os.environ.get("CIRCUIT_BREAKER_WINDOW", 20))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.environ.get("CIRCUIT_BREAKER_MIN_CALLS", 5))
+CIRCUIT_BREAKER_ERROR_RATE = float(os.environ.get("CIRCUIT_BREAKER_ERROR_RATE", 0.5))
+CIRCUIT_BREAKER_SLOW_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_SLOW_SECONDS", 4))
+CIRCUIT_BREAKER_SLOW_RATE = float(os.environ.get("CIRCUIT_BREAKER_SLOW_RATE", 0.5))
+# How long an open breaker fails fast before letting a half-open probe through
+CIRCUIT_BREAKER_OPEN_SECONDS = int(os.environ.get("CIRCUIT_BREAKER_OPEN_SECONDS", 30))
+# Last good response, served (marked "stale") while an endpoint is failing. GETs without a cache of their own keep
+# raw copies in a store capped by count and bytes; the shopping list and meal plan caches hold on to expired
+# entries instead. Either way nothing older than SPOONACULAR_STALE_TTL seconds (past its expiry) is served
+SPOONACULAR_STALE_MAX_SIZE = int(os.environ.get("SPOONACULAR_STALE_MAX_SIZE", 2000))
+SPOONACULAR_STALE_MAX_BYTES = int(os.environ.get("SPOONACULAR_STALE_MAX_BYTES", 8 * 1024 * 1024))
+SPOONACULAR_STALE_TTL = int(os.environ.get("SPOONACULAR_STALE_TTL", 6 * 60 * 60))
+
+# Spoonacular accounts - one per Slack user. Lambda's /tmp belongs to a single container, so the mapping only holds
+# across containers and cold starts in the ACCOUNT_TABLE_NAME DynamoDB table (partition key "user_id"). Without the
+# table accounts go to a local SQLite file, which only suits a single long-running process. The USER_NAME / USER_HASH
+# account every user shared before is only used with SHARED_SPOONACULAR_ACCOUNT=1 (and no table)
+ACCOUNT_TABLE_NAME = os.environ.get("ACCOUNT_TABLE_NAME")
+ACCOUNT_DB_PATH = os.environ.get("ACCOUNT_DB_PATH", "/tmp/spoonacular_accounts.db")
+ACCOUNT_CACHE_SIZE = int(os.environ.get("ACCOUNT_CACHE_SIZE", 1000))
+SHARED_SPOONACULAR_ACCOUNT = os.environ.get("SHARED_SPOONACULAR_ACCOUNT", "0") == "1"
+SHARED_ACCOUNT = {
     "username": os.environ.get("USER_NAME"),
     "hash": os.environ.get("USER_HASH")
 }
 
-# Default Configs
-GENERATE_MEAL_PLAN_OPTIONS = {
+# Default Configs (never mutated - per-user selections live in INTERACTION_STATE)
+DEFAULT_MEAL_PLAN_OPTIONS = {
     "timeFrame": "Day",
     "targetCalories": 1000,
     "diet": ""
 }
 
-RANDOM_RECIPE = {}
+# Meal plan select action ids -> generate option they set
+MEAL_PLAN_OPTION_ACTIONS = {
+    "static_select_day_week-action": "timeFrame",
+    "static_select_diet-action": "diet",
+    "static_select_calorie-action": "targetCalories"
+}
+
+# Generated meal plan cache Configs - presets are "timeFrame:targetCalories:diet" separated by ";"
+MEAL_PLAN_CACHE_MAX_AGE = int(os.environ.get("MEAL_PLAN_CACHE_MAX_AGE", 6 * 3600))
+MEAL_PLAN_CACHE_MAX_SIZE = int(os.environ.get("MEAL_PLAN_CACHE_MAX_SIZE", 500))
+MEAL_PLAN_PRESETS = os.environ.get("MEAL_PLAN_PRESETS", "Day:1000:;Day:2000:;Week:2000:")
+# Build meal plans from cached recipes when there are enough of them, before asking /mealplanner/generate
+MEAL_PLAN_LOCAL_GENERATOR = os.environ.get("MEAL_PLAN_LOCAL_GENERATOR", "true").lower() == "true"
+# Share of daily calories for breakfast:lunch:dinner and of calories from protein:fat:carbs
+MEAL_PLAN_SLOT_SPLIT = [float(share) for share in os.environ.get("MEAL_PLAN_SLOT_SPLIT", "25:35:40").split(":")]
+MEAL_PLAN_MACRO_SPLIT = [float(share) for share in os.environ.get("MEAL_PLAN_MACRO_SPLIT", "20:30:50").split(":")]
+# Closest-calorie recipes kept per meal slot for the local search
+MEAL_PLAN_LOCAL_POOL_SIZE = int(os.environ.get("MEAL_PLAN_LOCAL_POOL_SIZE", 60))
+
+# Spoonacular response cache Configs (seconds)
+SHOPPING_LIST_CACHE_TTL = int(os.environ.get("SHOPPING_LIST_CACHE_TTL", 300))
+MEAL_PLAN_VIEW_CACHE_TTL = int(os.environ.get("MEAL_PLAN_VIEW_CACHE_TTL", 900))
+RECIPE_CACHE_TTL = int(os.environ.get("RECIPE_CACHE_TTL", 24 * 3600))
+RECIPE_CACHE_MAX_SIZE = int(os.environ.get("RECIPE_CACHE_MAX_SIZE", 2000))
+INGREDIENT_INFO_CACHE_TTL = int(os.environ.get("INGREDIENT_INFO_CACHE_TTL", 86400))
+INGREDIENT_INFO_CACHE_MAX_SIZE = int(os.environ.get("INGREDIENT_INFO_CACHE_MAX_SIZE", 5000))
+# Recipe images are served from a fixed pattern: {base}/{id}-{size}.{imageType}
+RECIPE_IMAGE_BASE_URL = os.environ.get("RECIPE_IMAGE_BASE_URL", "https://spoonacular.com/recipeImages")
+RECIPE_IMAGE_SIZE = os.environ.get("RECIPE_IMAGE_SIZE", "556x370")
+# Ingredient info persisted across cold starts, refetched once older than this
+INGREDIENT_INFO_DB_PATH = os.environ.get("INGREDIENT_INFO_DB_PATH", "/tmp/ingredient_info.db")
+INGREDIENT_INFO_MAX_AGE = int(os.environ.get("INGREDIENT_INFO_MAX_AGE", 30 * 86400))
+# Ingredients held side by side in the /nutrients comparison modal
+NUTRIENT_COMPARE_MAX_INGREDIENTS = int(os.environ.get("NUTRIENT_COMPARE_MAX_INGREDIENTS", 4))
+
+# Prefetch Configs - the graph maps a view to the views users usually open next from it
+PREFETCH_NAVIGATION_GRAPH = json.loads(os.environ.get("PREFETCH_NAVIGATION_GRAPH", json.dumps({
+    "home": ["shopping_list", "meal_plan_week"],
+    "meal_plan_week": ["meal_plan_recipes", "meal_plan_today"]
+})))
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", 30))  # API calls per user per window
+PREFETCH_BUDGET_WINDOW = int(os.environ.get("PREFETCH_BUDGET_WINDOW", 3600))
+# Prefetching runs right after a view is published, in the same invocation - the caches it warms are in-process, so
+# it only pays off when Lambda sends the user's next click to this container. Capped so the request still answers
+# inside Slack's 3 second window
+PREFETCH_MAX_SECONDS = float(os.environ.get("PREFETCH_MAX_SECONDS", 1.5))
+
+# Recipe search Configs
+RECIPE_SEARCH_PAGE_SIZE = int(os.environ.get("RECIPE_SEARCH_PAGE_SIZE", 10))
+RECIPE_SEARCH_CACHE_TTL = int(os.environ.get("RECIPE_SEARCH_CACHE_TTL", 3600))
+# Local full-text search - answered from cached recipes when enough results clear the confidence threshold
+RECIPE_TEXT_INDEX_PATH = os.environ.get("RECIPE_TEXT_INDEX_PATH", "/tmp/recipe_text_index.bin")
+RECIPE_SEARCH_LOCAL_MIN_SCORE = float(os.environ.get("RECIPE_SEARCH_LOCAL_MIN_SCORE", 0.5))
+RECIPE_SEARCH_LOCAL_MIN_RESULTS = int(os.environ.get("RECIPE_SEARCH_LOCAL_MIN_RESULTS", 3))
+RECIPE_SEARCH_LOCAL_MAX_RESULTS = int(os.environ.get("RECIPE_SEARCH_LOCAL_MAX_RESULTS", 50))
+
+# Ingredient -> recipe index Configs
+INGREDIENT_INDEX_PATH = os.environ.get("INGREDIENT_INDEX_PATH", "/tmp/ingredient_index.bin")
+INGREDIENT_INDEX_SAVE_INTERVAL = int(os.environ.get("INGREDIENT_INDEX_SAVE_INTERVAL", 60))
+INGREDIENT_SEARCH_NUMBER = int(os.environ.get("INGREDIENT_SEARCH_NUMBER", 5))
+# Ingredients one search can select - they ride along in each result's "Add missing" button value (2000 chars max)
+INGREDIENT_SEARCH_MAX_SELECTED = int(os.environ.get("INGREDIENT_SEARCH_MAX_SELECTED", 10))
+# Fewer local matches than this and Spoonacular fills the gap
+INGREDIENT_INDEX_MIN_LOCAL_RESULTS = int(os.environ.get("INGREDIENT_INDEX_MIN_LOCAL_RESULTS", INGREDIENT_SEARCH_NUMBER))
+# Share of the selected ingredients a cached recipe has to use to count as a local match
+INGREDIENT_INDEX_MIN_COVERAGE = float(os.environ.get("INGREDIENT_INDEX_MIN_COVERAGE", 0.5))
+
+# Shopping list Configs
+# Parse free-text items locally and send Spoonacular the structured line instead of asking it to parse
+SHOPPING_LIST_LOCAL_PARSE = os.environ.get("SHOPPING_LIST_LOCAL_PARSE", "true").lower() == "true"
+
+# Pantry Configs - like accounts, pantries only hold across Lambda containers in the PANTRY_TABLE_NAME DynamoDB table
+# (partition key "user_id"). Without it each container keeps its own SQLite file
+PANTRY_TABLE_NAME = os.environ.get("PANTRY_TABLE_NAME")
+PANTRY_DB_PATH = os.environ.get("PANTRY_DB_PATH", "/tmp/pantry.db")
+PANTRY_CACHE_SIZE = int(os.environ.get("PANTRY_CACHE_SIZE", 1000))
+# Seconds a container trusts its in-memory copy of a pantry, so edits made through other containers show up
+PANTRY_CACHE_TTL = int(os.environ.get("PANTRY_CACHE_TTL", 60))
+
+# Random recipe pool Configs
+RANDOM_RECIPE_BATCH_SIZE = int(os.environ.get("RANDOM_RECIPE_BATCH_SIZE", 10))
+RANDOM_RECIPE_LOW_WATER = int(os.environ.get("RANDOM_RECIPE_LOW_WATER", 3))
+# Seconds a top-up after serving a recipe may take - it runs before /recipe is acked, inside Slack's 3s window
+RANDOM_RECIPE_REFILL_TIMEOUT = float(os.environ.get("RANDOM_RECIPE_REFILL_TIMEOUT", 1.5))
+
+# Interaction state Configs
+INTERACTION_STATE_TTL = int(os.environ.get("INTERACTION_STATE_TTL", 3600))
+INTERACTION_STATE_MAX_SIZE = int(os.environ.get("INTERACTION_STATE_MAX_SIZE", 5000))
+INTERACTION_STATE_STRIPES = int(os.environ.get("INTERACTION_STATE_STRIPES", 16))
 
 # Canned responses
 SAY_INVALID_CMD = "Sorry, I didn't recognize that command.  Please use `/nickbot guide` to see available commands."
 SAY_SHOP_LIST_EMPTY = "Uh oh!  Your shopping list is currently *empty*.  Better start adding items..."
+SAY_SHOP_LIST_BUILD_FAILED = "Uh oh!  I couldn't build a shopping list for that week...  Please try again in a bit."
+SAY_STALE_RESPONSE = ":warning: Spoonacular isn't responding right now, this is the last copy I have and may be out of date."
+SAY_ACCOUNT_UNAVAILABLE = "Uh oh!  I couldn't reach your meal planner account right now...  Please try again in a bit."
 
 # Original images
 EMPTY_DINNER_PLATE_IMG = os.environ.get("EMPTY_DINNER_PLATE_IMG")
@@ -50,10 +182,1527 @@ EMPTY_SHOPPING_CART_IMG = os.environ.get("EMPTY_SHOPPING_CART_IMG")
 SALAD_PLATE_IMG = os.environ.get("SALAD_PLATE_IMG")
 SALAD_BOWL_IMG = os.environ.get("SALAD_BOWL_IMG")
 
+# Idempotency Configs (Slack retries any request not answered within 3 seconds)
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "memory")  # "memory" or "sqlite"
+IDEMPOTENCY_DB_PATH = os.environ.get("IDEMPOTENCY_DB_PATH", "/tmp/idempotency.db")
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", 5000))
+IDEMPOTENCY_IN_FLIGHT_TTL = int(os.environ.get("IDEMPOTENCY_IN_FLIGHT_TTL", 120))
+IDEMPOTENCY_COMPLETED_TTL = int(os.environ.get("IDEMPOTENCY_COMPLETED_TTL", 3600))
+
+# # # # # # # # # # # # # # # # # #
+# #      CACHES / METRICS       # #
+# # # # # # # # # # # # # # # # # #
+
+
+# Thread-safe counters and timings, logged on demand
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+        self._gauges = {}
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    # Keeps count / total / max per timing name (seconds)
+    def observe(self, name: str, value: float):
+        with self._lock:
+            count, total, maximum = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + value, max(maximum, value))
+
+    # Latest value wins, for state like circuit breaker positions
+    def set_gauge(self, name: str, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {}
+            for name, (count, total, maximum) in self._timings.items():
+                timings[name] = {"count": count, "avg": total / count, "max": maximum}
+            return {"counters": dict(self._counters), "timings": timings, "gauges": dict(self._gauges)}
+
+
+APP_METRICS = Metrics()
+
+
+# Bounded LRU cache with optional per-entry TTL (seconds), safe to share between listener threads
+# With stale_ttl, expired entries stay readable through get_stale for that much longer. With max_bytes, values are
+# sized with len() and the oldest entries go once the total passes it
+class TTLCache:
+    def __init__(self, max_size: int, ttl: Optional[float] = None, stale_ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is None or (entry[0] is not None and entry[0] <= now):
+                if entry is not None and not self._is_stale_locked(entry, now):
+                    self._drop_locked(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # Value for key even when it has expired, as long as it's within stale_ttl of expiring - not counted as a hit
+    def get_stale(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is None or (entry[0] is not None and entry[0] <= now and not self._is_stale_locked(entry, now)):
+                return default
+            return entry[1]
+
+    def _is_stale_locked(self, entry: tuple, now: float) -> bool:
+        return self.stale_ttl is not None and entry[0] is not None and entry[0] + self.stale_ttl > now
+
+    def _drop_locked(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    # Insert only if the key is missing or expired - returns the existing value otherwise
+    def set_if_absent(self, key, value, ttl: Optional[float] = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                return entry[1]
+            self._set_locked(key, value, ttl)
+            return None
+
+    def _set_locked(self, key, value, ttl: Optional[float]):
+        ttl = self.ttl if ttl is None else ttl
+        size = len(value) if self.max_bytes is not None else 0
+        if key in self._entries:
+            self._drop_locked(key)
+        self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_size or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    # Membership check that does not count as a hit / miss
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[0] is None or entry[0] > time.monotonic())
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[2]
+            return entry[1]
+
+    def pop_matching(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._drop_locked(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio()}
+
+
+# Closed -> open when the recent failure or slow call rate crosses its threshold, open -> half-open after
+# open_seconds (one probe request at a time), half-open -> closed on a good probe or back to open on a bad one
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window: int, min_calls: int, error_rate: float, slow_seconds: float,
+                 slow_rate: float, open_seconds: float):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # (failed, slow) per recent call
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        APP_METRICS.set_gauge(f"circuit_breaker.{name}.state", self._state)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set_state(self, state: str):
+        self._state = state
+        APP_METRICS.set_gauge(f"circuit_breaker.{self.name}.state", state)
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            APP_METRICS.incr(f"circuit_breaker.{self.name}.opened")
+            g_logger.warning(f"Circuit breaker for {self.name} opened")
+
+    # Whether a request may go out now - False means fail fast
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+            return self._state == self.CLOSED
+
+    def record(self, failed: bool, elapsed: float):
+        slow = elapsed >= self.slow_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+                self._outcomes.clear()
+                self._set_state(self.OPEN if failed or slow else self.CLOSED)
+                return
+            self._outcomes.append((failed, slow))
+            total = len(self._outcomes)
+            if self._state == self.CLOSED and total >= self.min_calls and (
+                    sum(outcome[0] for outcome in self._outcomes) / total >= self.error_rate or
+                    sum(outcome[1] for outcome in self._outcomes) / total >= self.slow_rate):
+                self._outcomes.clear()
+                self._set_state(self.OPEN)
+
+
+# In-memory idempotency store - bounded and TTL'd, local to this Lambda container
+class MemoryIdempotencyStore:
+    def __init__(self, max_keys: int):
+        self._cache = TTLCache(max_keys)
+
+    # Returns None if the key was claimed by this call, otherwise the state of the earlier claim
+    def claim(self, key: str, ttl: float) -> Optional[str]:
+        return self._cache.set_if_absent(key, "in_flight", ttl)
+
+    def complete(self, key: str, ttl: float):
+        self._cache.set(key, "completed", ttl)
+
+    def release(self, key: str):
+        self._cache.pop(key)
+
+
+# SQLite idempotency store - survives handler re-imports and is shared by every thread in the container
+class SqliteIdempotencyStore:
+    def __init__(self, db_path: str, max_keys: int):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys "
+                           "(key TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at)")
+
+    def claim(self, key: str, ttl: float) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = self._conn.execute("INSERT OR IGNORE INTO idempotency_keys (key, state, expires_at) "
+                                        "VALUES (?, 'in_flight', ?)", (key, now + ttl))
+            if cursor.rowcount == 1:
+                self._evict(now)
+                return None
+            row = self._conn.execute("SELECT state FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def complete(self, key: str, ttl: float):
+        with self._lock:
+            self._conn.execute("UPDATE idempotency_keys SET state = 'completed', expires_at = ? WHERE key = ?",
+                               (time.time() + ttl, key))
+
+    def release(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    # Drop expired keys, then the oldest ones if still over the bound
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+        self._conn.execute("DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys "
+                           "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_keys,))
+
+
+# Lowercase, collapse whitespace and strip simple plurals ("tomatoes" -> "tomato")
+def normalize_ingredient_name(name: str) -> str:
+    name = " ".join(name.lower().split())
+    if name.endswith("oes") or name.endswith("ches") or name.endswith("shes"):
+        return name[:-2]
+    if name.endswith("ies") and len(name) > 4:
+        return f"{name[:-3]}y"
+    if name.endswith("s") and not name.endswith("ss") and len(name) > 3:
+        return name[:-1]
+    return name
+
+
+# Inverted index of normalized ingredient -> sorted array of recipe ids, fed by every recipe entering RECIPE_CACHE
+# Persisted as: magic, header length, JSON header (vocabulary, recipes, posting lengths), uint32 postings
+class IngredientIndex:
+    FILE_MAGIC = b"IIX1"
+
+    def __init__(self, path: str, save_interval: float):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._vocab = {}  # ingredient name -> ingredient id
+        self._names = []  # ingredient id -> ingredient name
+        self._postings = []  # ingredient id -> array('I') of sorted recipe ids
+        self._recipes = {}  # recipe id -> [title, image, [[ingredient id, original text], ...]]
+        self._recipe_bits = {}  # recipe id -> ingredient bitset, the recipe x ingredient matrix used for ranking
+        self._aisles = {}  # ingredient name -> Spoonacular aisle
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def ingredient_id(self, name: str) -> Optional[int]:
+        return self._vocab.get(normalize_ingredient_name(name))
+
+    def _ingredient_id_for_insert(self, name: str) -> int:
+        ingredient_id = self._vocab.get(name)
+        if ingredient_id is None:
+            ingredient_id = len(self._names)
+            self._vocab[name] = ingredient_id
+            self._names.append(name)
+            self._postings.append(array('I'))
+        return ingredient_id
+
+    def add_recipe(self, recipe: dict):
+        ingredients = recipe.get("extendedIngredients")
+        if not ingredients or recipe.get("id") is None:
+            return
+        recipe_id = int(recipe.get("id"))
+        with self._lock:
+            if recipe_id in self._recipes:
+                return
+            entries = []
+            bits = 0
+            for ingred in ingredients:
+                name = normalize_ingredient_name(ingred.get("nameClean") or ingred.get("name") or "")
+                if not name:
+                    continue
+                ingredient_id = self._ingredient_id_for_insert(name)
+                if ingred.get("aisle"):
+                    self._aisles[name] = ingred.get("aisle")
+                entries.append([ingredient_id, ingred.get("original") or name])
+                bits |= 1 << ingredient_id
+                postings = self._postings[ingredient_id]
+                position = bisect.bisect_left(postings, recipe_id)
+                if position == len(postings) or postings[position] != recipe_id:
+                    postings.insert(position, recipe_id)
+            self._recipes[recipe_id] = [recipe.get("title"), recipe.get("image"), entries]
+            self._recipe_bits[recipe_id] = bits
+            self._dirty = True
+        if time.monotonic() - self._last_save > self.save_interval:
+            self.save()
+
+    # Bitset over the shared ingredient vocabulary - optionally adding names the index hasn't seen yet
+    def ingredient_bits(self, ingredient_names: list, create: bool = False) -> int:
+        bits = 0
+        with self._lock:
+            for name in ingredient_names:
+                name = normalize_ingredient_name(name)
+                if not name:
+                    continue
+                ingredient_id = self._ingredient_id_for_insert(name) if create else self._vocab.get(name)
+                if ingredient_id is not None:
+                    bits |= 1 << ingredient_id
+        return bits
+
+    def aisle(self, name: str) -> Optional[str]:
+        return self._aisles.get(name)
+
+    def recipe_ids_with(self, ingredient_names: list) -> set:
+        recipe_ids = set()
+        with self._lock:
+            for name in ingredient_names:
+                ingredient_id = self._vocab.get(normalize_ingredient_name(name))
+                if ingredient_id is not None:
+                    recipe_ids.update(self._postings[ingredient_id])
+        return recipe_ids
+
+    def ingredient_names(self, bits: int) -> list:
+        with self._lock:
+            return [name for ingredient_id, name in enumerate(self._names) if bits >> ingredient_id & 1]
+
+    # Rank candidate recipes by how many of their ingredients are outside `have_bits` (popcount of recipe & ~have)
+    def rank_by_missing(self, have_bits: int, number: int, candidates=None) -> list:
+        started = time.perf_counter()
+        with self._lock:
+            recipe_bits = self._recipe_bits
+            candidates = recipe_bits.keys() if candidates is None else candidates
+            not_have = ~have_bits
+            ranked = heapq.nsmallest(number, (
+                (bin(recipe_bits[recipe_id] & not_have).count("1"), recipe_id) for recipe_id in candidates))
+        APP_METRICS.observe("ingredient_index.rank_seconds", time.perf_counter() - started)
+        return ranked
+
+    # Recipes using at least min_used of the given ingredients, fewest missing first (pantry items count as on hand),
+    # shaped like /recipes/findByIngredients
+    def find(self, ingredient_names: list, number: int, pantry_bits: int = 0, min_used: int = 1) -> list:
+        started = time.perf_counter()
+        query_bits = self.ingredient_bits(ingredient_names)
+        have_bits = query_bits | pantry_bits
+        with self._lock:
+            # Merge the sorted posting arrays of the selected ingredients into one candidate set
+            used_counts = Counter()
+            for ingredient_id in range(query_bits.bit_length()):
+                if query_bits >> ingredient_id & 1:
+                    used_counts.update(self._postings[ingredient_id])
+        candidates = [recipe_id for recipe_id, used in used_counts.items() if used >= min_used]
+        ranked = self.rank_by_missing(have_bits, number, candidates)
+
+        results = []
+        with self._lock:
+            for _, recipe_id in sorted(ranked, key=lambda item: (item[0], -used_counts[item[1]], item[1])):
+                title, image, entries = self._recipes[recipe_id]
+                used, missed = [], []
+                for ingredient_id, original in entries:
+                    ingredient = {"name": self._names[ingredient_id], "original": original}
+                    (used if have_bits >> ingredient_id & 1 else missed).append(ingredient)
+                results.append({
+                    "id": recipe_id,
+                    "title": title,
+                    "image": image,
+                    "usedIngredientCount": len(used),
+                    "missedIngredientCount": len(missed),
+                    "usedIngredients": used,
+                    "missedIngredients": missed
+                })
+        APP_METRICS.observe("ingredient_index.find_seconds", time.perf_counter() - started)
+        return results
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            header = json.dumps({
+                "names": self._names,
+                "recipes": self._recipes,
+                "aisles": self._aisles,
+                "lengths": [len(postings) for postings in self._postings]
+            }).encode()
+            payload = b"".join(postings.tobytes() for postings in self._postings)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as index_file:
+                index_file.write(self.FILE_MAGIC + len(header).to_bytes(4, "little") + header + payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            g_logger.error(f"Error saving ingredient index to {self.path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as index_file:
+                data = index_file.read()
+            if data[:4] != self.FILE_MAGIC:
+                raise ValueError("unknown file format")
+            header_length = int.from_bytes(data[4:8], "little")
+            header = json.loads(data[8:8 + header_length])
+            offset = 8 + header_length
+            for name, length in zip(header.get("names"), header.get("lengths")):
+                postings = array('I')
+                postings.frombytes(data[offset:offset + length * postings.itemsize])
+                offset += length * postings.itemsize
+                self._vocab[name] = len(self._names)
+                self._names.append(name)
+                self._postings.append(postings)
+            self._recipes = {int(recipe_id): entry for recipe_id, entry in header.get("recipes").items()}
+            self._aisles = header.get("aisles", {})
+            for recipe_id, (_, _, entries) in self._recipes.items():
+                self._recipe_bits[recipe_id] = sum(1 << ingredient_id for ingredient_id in set(
+                    ingredient_id for ingredient_id, _ in entries))
+            g_logger.debug(f"Loaded ingredient index with {len(self._recipes)} recipes from {self.path}")
+        except (OSError, ValueError) as e:
+            g_logger.error(f"Error loading ingredient index from {self.path}: {e}")
+            self._vocab, self._names, self._postings, self._recipes, self._recipe_bits = {}, [], [], {}, {}
+            self._aisles = {}
+
+
+INGREDIENT_INDEX = IngredientIndex(INGREDIENT_INDEX_PATH, INGREDIENT_INDEX_SAVE_INTERVAL)
+
+
+RECIPE_TEXT_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# BM25 index over title, summary and ingredient text of cached recipes
+# Postings loaded at startup stay memory-mapped in the index file; recipes added since go into delta arrays
+# File layout: magic, header length, JSON header (terms, counts), then uint32 arrays - doc ids, doc lengths,
+# per-term posting offsets, posting doc ids, posting term frequencies
+class RecipeTextIndex:
+    FILE_MAGIC = b"RTX1"
+    K1 = 1.2
+    B = 0.75
+    TITLE_WEIGHT = 3
+    STOPWORDS = frozenset(["a", "an", "and", "the", "with", "of", "in", "for", "to", "on", "or", "my", "some"])
+
+    def __init__(self, path: str, save_interval: float):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._vocab = {}  # term -> term id
+        self._terms = []  # term id -> term
+        self._base_offsets = array('I', [0])  # term id -> start of its postings in the mapped arrays
+        self._base_docs = memoryview(b"").cast('I')
+        self._base_tfs = memoryview(b"").cast('I')
+        self._delta_docs = {}  # term id -> array('I') of recipe ids added since load
+        self._delta_tfs = {}  # term id -> array('I') of matching term frequencies
+        self._doc_lengths = {}  # recipe id -> weighted token count
+        self._total_length = 0
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    @classmethod
+    def tokenize(cls, text: str) -> list:
+        return [normalize_ingredient_name(token) for token in RECIPE_TEXT_TOKEN_PATTERN.findall(text.lower())
+                if token not in cls.STOPWORDS]
+
+    def _recipe_terms(self, recipe: dict) -> Counter:
+        terms = Counter(self.tokenize(recipe.get("title") or "") * self.TITLE_WEIGHT)
+        terms.update(self.tokenize(RECIPE_SUMMARY_TAG_PATTERN.sub("", recipe.get("summary") or "")))
+        for ingred in recipe.get("extendedIngredients") or []:
+            terms.update(self.tokenize(ingred.get("nameClean") or ingred.get("name") or ""))
+        return terms
+
+    def add_recipe(self, recipe: dict):
+        if recipe.get("id") is None:
+            return
+        recipe_id = int(recipe.get("id"))
+        if recipe_id in self._doc_lengths:
+            return
+        terms = self._recipe_terms(recipe)
+        with self._lock:
+            if recipe_id in self._doc_lengths:
+                return
+            for term, term_freq in terms.items():
+                term_id = self._vocab.get(term)
+                if term_id is None:
+                    term_id = len(self._terms)
+                    self._vocab[term] = term_id
+                    self._terms.append(term)
+                self._delta_docs.setdefault(term_id, array('I')).append(recipe_id)
+                self._delta_tfs.setdefault(term_id, array('I')).append(term_freq)
+            self._doc_lengths[recipe_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[recipe_id]
+            self._dirty = True
+        if time.monotonic() - self._last_save > self.save_interval:
+            self.save()
+
+    # Mapped + delta (doc ids, term frequencies) pairs for a term
+    def _postings(self, term_id: int) -> list:
+        parts = []
+        if term_id + 1 < len(self._base_offsets):
+            start, end = self._base_offsets[term_id], self._base_offsets[term_id + 1]
+            parts.append((self._base_docs[start:end], self._base_tfs[start:end]))
+        if term_id in self._delta_docs:
+            parts.append((self._delta_docs[term_id], self._delta_tfs[term_id]))
+        return parts
+
+    # Best matches first as (recipe id, confidence) - confidence is the BM25 score over its upper bound for
+    # the query, so an unknown or barely matched term drags it towards 0
+    def search(self, query: str, number: int) -> list:
+        started = time.perf_counter()
+        query_terms = set(self.tokenize(query))
+        with self._lock:
+            total_docs = len(self._doc_lengths)
+            if not query_terms or total_docs == 0:
+                return []
+            avg_length = self._total_length / total_docs
+            scores = {}
+            max_score = 0.0
+            for term in query_terms:
+                term_id = self._vocab.get(term)
+                parts = self._postings(term_id) if term_id is not None else []
+                doc_freq = sum(len(docs) for docs, _ in parts)
+                idf = math.log(1 + (total_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                max_score += idf * (self.K1 + 1)
+                for docs, term_freqs in parts:
+                    for recipe_id, term_freq in zip(docs, term_freqs):
+                        length_norm = self.K1 * (1 - self.B + self.B * self._doc_lengths[recipe_id] / avg_length)
+                        scores[recipe_id] = scores.get(recipe_id, 0.0) + \
+                            idf * term_freq * (self.K1 + 1) / (term_freq + length_norm)
+            ranked = heapq.nlargest(number, scores.items(), key=lambda item: (item[1], -item[0]))
+        APP_METRICS.observe("recipe_text_index.search_seconds", time.perf_counter() - started)
+        return [(recipe_id, score / max_score) for recipe_id, score in ranked]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            doc_ids = array('I', self._doc_lengths.keys())
+            doc_lengths = array('I', self._doc_lengths.values())
+            offsets, docs, term_freqs = array('I', [0]), array('I'), array('I')
+            for term_id in range(len(self._terms)):
+                for part_docs, part_term_freqs in self._postings(term_id):
+                    docs.extend(part_docs)
+                    term_freqs.extend(part_term_freqs)
+                offsets.append(len(docs))
+            header = json.dumps({"terms": self._terms, "docs": len(doc_ids), "postings": len(docs)}).encode()
+            # Pad so the arrays that follow stay 4-byte aligned when mapped
+            header += b" " * (-len(header) % 4)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as index_file:
+                index_file.write(self.FILE_MAGIC + len(header).to_bytes(4, "little") + header)
+                for values in (doc_ids, doc_lengths, offsets, docs, term_freqs):
+                    index_file.write(values.tobytes())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            g_logger.error(f"Error saving recipe text index to {self.path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as index_file:
+                mapped = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:4] != self.FILE_MAGIC:
+                raise ValueError("unknown file format")
+            header_length = int.from_bytes(mapped[4:8], "little")
+            header = json.loads(mapped[8:8 + header_length])
+            values = memoryview(mapped)[8 + header_length:].cast('I')
+            total_docs, total_postings, total_terms = header.get("docs"), header.get("postings"), len(header["terms"])
+
+            doc_ids, values = values[:total_docs], values[total_docs:]
+            doc_lengths, values = values[:total_docs], values[total_docs:]
+            self._doc_lengths = dict(zip(doc_ids, doc_lengths))
+            self._total_length = sum(doc_lengths)
+            self._base_offsets = array('I', values[:total_terms + 1])
+            values = values[total_terms + 1:]
+            self._base_docs, self._base_tfs = values[:total_postings], values[total_postings:2 * total_postings]
+            self._terms = header.get("terms")
+            self._vocab = {term: term_id for term_id, term in enumerate(self._terms)}
+            g_logger.debug(f"Mapped recipe text index with {len(self._doc_lengths)} recipes from {self.path}")
+        except (OSError, ValueError, TypeError) as e:
+            g_logger.error(f"Error loading recipe text index from {self.path}: {e}")
+            self._vocab, self._terms, self._doc_lengths, self._total_length = {}, [], {}, 0
+            self._base_offsets = array('I', [0])
+            self._base_docs, self._base_tfs = memoryview(b"").cast('I'), memoryview(b"").cast('I')
+
+
+RECIPE_TEXT_INDEX = RecipeTextIndex(RECIPE_TEXT_INDEX_PATH, INGREDIENT_INDEX_SAVE_INTERVAL)
+
+
+# Diet, intolerance ("X free") and dish type flags - the bit for each is its position in RECIPE_FLAGS
+RECIPE_DIET_FLAGS = ["vegan", "vegetarian", "gluten free", "dairy free", "ketogenic", "paleo", "primal", "whole30",
+                     "pescetarian", "low fodmap", "very healthy"]
+RECIPE_INTOLERANCE_FLAGS = ["egg free", "peanut free", "tree nut free", "shellfish free", "seafood free", "soy free",
+                            "sesame free", "wheat free", "grain free"]
+RECIPE_DISH_TYPE_FLAGS = ["breakfast", "lunch", "dinner", "main course", "side dish", "dessert", "appetizer",
+                          "salad", "soup", "snack", "beverage", "sauce", "bread"]
+RECIPE_FLAGS = RECIPE_DIET_FLAGS + RECIPE_INTOLERANCE_FLAGS + RECIPE_DISH_TYPE_FLAGS
+RECIPE_FLAG_BITS = {flag: 1 << position for position, flag in enumerate(RECIPE_FLAGS)}
+
+# Spoonacular diet / dish type names and everyday spellings -> flag
+RECIPE_FLAG_ALIASES = dict({flag: flag for flag in RECIPE_FLAGS}, **{
+    "keto": "ketogenic", "paleolithic": "paleo", "whole 30": "whole30", "pescatarian": "pescetarian",
+    "lacto ovo vegetarian": "vegetarian", "fodmap friendly": "low fodmap", "healthy": "very healthy",
+    "main dish": "main course", "morning meal": "breakfast", "brunch": "breakfast", "starter": "appetizer",
+    "drink": "beverage", "dip": "sauce", "condiment": "sauce", "fingerfood": "snack", "antipasti": "appetizer"
+})
+
+# Ingredient name fragments that rule out an intolerance flag
+RECIPE_INTOLERANCE_KEYWORDS = {
+    "egg free": ["egg", "mayonnaise"],
+    "peanut free": ["peanut"],
+    "tree nut free": ["almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia"],
+    "shellfish free": ["shrimp", "prawn", "crab", "lobster", "clam", "mussel", "oyster", "scallop"],
+    "seafood free": ["shrimp", "prawn", "crab", "lobster", "clam", "mussel", "oyster", "scallop", "fish", "salmon",
+                     "tuna", "cod", "anchov", "sardine", "tilapia", "halibut"],
+    "soy free": ["soy", "tofu", "edamame", "miso", "tempeh"],
+    "sesame free": ["sesame", "tahini"],
+    "wheat free": ["wheat", "flour", "bread", "pasta", "couscous", "noodle", "tortilla"],
+    "grain free": ["wheat", "flour", "bread", "pasta", "couscous", "noodle", "tortilla", "rice", "oat", "corn",
+                   "barley", "quinoa"]
+}
+
+RECIPE_FILTER_MINUTES_PATTERN = re.compile(r"\b(?:under|in|within|less than)\s+(\d+)\s*(?:min|mins|minutes)\b")
+
+
+# Packed flag mask for a recipe, computed from its diet booleans, diets, dish types and ingredients
+def get_recipe_flag_mask(recipe: dict) -> int:
+    mask = 0
+    for key, flag in (("vegan", "vegan"), ("vegetarian", "vegetarian"), ("glutenFree", "gluten free"),
+                      ("dairyFree", "dairy free"), ("ketogenic", "ketogenic"), ("lowFodmap", "low fodmap"),
+                      ("veryHealthy", "very healthy")):
+        if recipe.get(key):
+            mask |= RECIPE_FLAG_BITS[flag]
+    for name in (recipe.get("diets") or []) + (recipe.get("dishTypes") or []):
+        flag = RECIPE_FLAG_ALIASES.get(name.lower())
+        if flag:
+            mask |= RECIPE_FLAG_BITS[flag]
+
+    ingredient_names = [(ingred.get("nameClean") or ingred.get("name") or "").lower()
+                        for ingred in recipe.get("extendedIngredients") or []]
+    if ingredient_names:
+        for flag, keywords in RECIPE_INTOLERANCE_KEYWORDS.items():
+            if not any(keyword in name for name in ingredient_names for keyword in keywords):
+                mask |= RECIPE_FLAG_BITS[flag]
+        if recipe.get("glutenFree"):
+            mask |= RECIPE_FLAG_BITS["wheat free"]
+    return mask
+
+
+# Split a search phrase into free text, required flag mask and max ready time,
+# ex: "vegan AND gluten-free dinners under 30 minutes" -> ("", vegan|gluten free|dinner, 30)
+def parse_recipe_filter(query: str) -> tuple:
+    query = query.lower().replace("-", " ")
+    max_ready_minutes = None
+    minutes_match = RECIPE_FILTER_MINUTES_PATTERN.search(query)
+    if minutes_match:
+        max_ready_minutes = int(minutes_match.group(1))
+        query = query[:minutes_match.start()] + query[minutes_match.end():]
+
+    words = [word for word in query.split() if word != "and"]
+    mask, text_words, position = 0, [], 0
+    while position < len(words):
+        # Longest alias first, so "lacto ovo vegetarian" beats "vegetarian"
+        for length in (3, 2, 1):
+            phrase = " ".join(words[position:position + length])
+            flag = RECIPE_FLAG_ALIASES.get(phrase) or RECIPE_FLAG_ALIASES.get(normalize_ingredient_name(phrase))
+            if len(words) - position >= length and flag:
+                mask |= RECIPE_FLAG_BITS[flag]
+                position += length
+                break
+        else:
+            text_words.append(words[position])
+            position += 1
+    return " ".join(text_words), mask, max_ready_minutes
+
+
+# Per-recipe flag masks plus one bitset column per flag (bit i = i-th recipe added), so filters are a handful of
+# big-int AND / AND NOT operations instead of a pass over every recipe
+class RecipeFlagIndex:
+    READY_BUCKETS = (10, 15, 20, 30, 45, 60, 90, 120)
+    UNKNOWN_READY_MINUTES = 0xFFFF
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}  # recipe id -> column position
+        self._recipe_ids = array('I')
+        self._masks = array('Q')
+        self._ready_minutes = array('H')
+        self._columns = [0] * len(RECIPE_FLAGS)
+        self._ready_columns = [0] * len(self.READY_BUCKETS)
+
+    def __len__(self):
+        return len(self._recipe_ids)
+
+    def mask(self, recipe_id) -> Optional[int]:
+        position = self._positions.get(int(recipe_id))
+        return self._masks[position] if position is not None else None
+
+    def add_recipe(self, recipe: dict):
+        if recipe.get("id") is None:
+            return
+        recipe_id = int(recipe.get("id"))
+        mask = get_recipe_flag_mask(recipe)
+        ready_minutes = min(int(recipe.get("readyInMinutes") or self.UNKNOWN_READY_MINUTES),
+                            self.UNKNOWN_READY_MINUTES)
+        with self._lock:
+            position = self._positions.get(recipe_id)
+            if position is None:
+                position = len(self._recipe_ids)
+                self._positions[recipe_id] = position
+                self._recipe_ids.append(recipe_id)
+                self._masks.append(0)
+                self._ready_minutes.append(ready_minutes)
+            elif self._masks[position] == mask and self._ready_minutes[position] == ready_minutes:
+                return
+
+            bit = 1 << position
+            for flag_position in range(len(RECIPE_FLAGS)):
+                if mask >> flag_position & 1:
+                    self._columns[flag_position] |= bit
+                else:
+                    self._columns[flag_position] &= ~bit
+            for bucket_position, bucket in enumerate(self.READY_BUCKETS):
+                if ready_minutes <= bucket:
+                    self._ready_columns[bucket_position] |= bit
+                else:
+                    self._ready_columns[bucket_position] &= ~bit
+            self._masks[position] = mask
+            self._ready_minutes[position] = ready_minutes
+
+    # Recipe ids with every flag in `require`, none in `exclude` and ready within max_ready_minutes
+    def filter(self, require: int = 0, exclude: int = 0, max_ready_minutes: Optional[int] = None) -> list:
+        started = time.perf_counter()
+        with self._lock:
+            selected = (1 << len(self._recipe_ids)) - 1
+            for flag_position in range(len(RECIPE_FLAGS)):
+                if require >> flag_position & 1:
+                    selected &= self._columns[flag_position]
+                elif exclude >> flag_position & 1:
+                    selected &= ~self._columns[flag_position]
+
+            exact_ready_check = False
+            if max_ready_minutes is not None:
+                bucket_position = bisect.bisect_left(self.READY_BUCKETS, max_ready_minutes)
+                if bucket_position < len(self.READY_BUCKETS):
+                    selected &= self._ready_columns[bucket_position]
+                exact_ready_check = bucket_position == len(self.READY_BUCKETS) or \
+                    self.READY_BUCKETS[bucket_position] != max_ready_minutes
+
+            # Walk the set bits of the result
+            bits = bin(selected)[:1:-1]
+            recipe_ids = []
+            position = bits.find("1")
+            while position != -1:
+                if not exact_ready_check or self._ready_minutes[position] <= max_ready_minutes:
+                    recipe_ids.append(self._recipe_ids[position])
+                position = bits.find("1", position + 1)
+        APP_METRICS.observe("recipe_flag_index.filter_seconds", time.perf_counter() - started)
+        return recipe_ids
+
+
+RECIPE_FLAG_INDEX = RecipeFlagIndex()
+
+
+# Shared (name, unit) vocabulary for compact nutrient storage - ids are small ints stored in array('H')
+class NutrientVocabulary:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}  # (name, unit) -> nutrient id
+        self._entries = []  # nutrient id -> (name, unit)
+        self._layouts = {}  # id array bytes -> shared id array
+
+    def __len__(self):
+        return len(self._entries)
+
+    def id_for(self, name: str, unit: str) -> int:
+        key = (name, unit)
+        nutrient_id = self._ids.get(key)
+        if nutrient_id is None:
+            with self._lock:
+                nutrient_id = self._ids.get(key)
+                if nutrient_id is None:
+                    nutrient_id = len(self._entries)
+                    self._entries.append(key)
+                    self._ids[key] = nutrient_id
+        return nutrient_id
+
+    def entry(self, nutrient_id: int) -> tuple:
+        return self._entries[nutrient_id]
+
+    # Payloads of one kind list the same nutrients in the same order, so their id arrays are shared
+    def shared_layout(self, nutrient_ids: array) -> array:
+        key = nutrient_ids.tobytes()
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = self._layouts.setdefault(key, nutrient_ids)
+        return layout
+
+
+NUTRIENT_VOCABULARY = NutrientVocabulary()
+
+
+# A Spoonacular nutrient list ({name, amount, unit, percentOfDailyNeeds} dicts) packed into parallel arrays
+# over NUTRIENT_VOCABULARY - ~10 bytes per nutrient instead of a dict, two floats and two strings
+# Iterating yields the original dicts back, so existing readers keep working
+class CompactNutrients:
+    __slots__ = ("_ids", "_values")
+
+    def __init__(self, nutrients: list = None):
+        nutrients = nutrients or []
+        self._ids = NUTRIENT_VOCABULARY.shared_layout(array('H', [
+            NUTRIENT_VOCABULARY.id_for(nutrient.get("name"), nutrient.get("unit")) for nutrient in nutrients]))
+        # Amounts followed by percents of daily needs
+        self._values = array('f', [float(nutrient.get("amount") or 0) for nutrient in nutrients] + [
+            float(nutrient.get("percentOfDailyNeeds")) if nutrient.get("percentOfDailyNeeds") is not None
+            else math.nan for nutrient in nutrients])
+
+    # Compact form of a nutrient list, passing through anything already compact
+    @classmethod
+    def of(cls, nutrients) -> "CompactNutrients":
+        return nutrients if isinstance(nutrients, cls) else cls(nutrients)
+
+    def __len__(self):
+        return len(self._ids)
+
+    # (name, amount, unit, percent of daily needs) with the float32 noise trimmed off
+    def rows(self):
+        total = len(self._ids)
+        for nutrient_id, amount, percent in zip(self._ids, self._values[:total], self._values[total:]):
+            name, unit = NUTRIENT_VOCABULARY.entry(nutrient_id)
+            yield name, float(f"{amount:.6g}"), unit, None if math.isnan(percent) else float(f"{percent:.6g}")
+
+    def __iter__(self):
+        for name, amount, unit, percent in self.rows():
+            yield {"name": name, "amount": amount, "unit": unit, "percentOfDailyNeeds": percent}
+
+    def amount(self, name: str) -> Optional[float]:
+        for nutrient_id, amount in zip(self._ids, self._values):
+            if NUTRIENT_VOCABULARY.entry(nutrient_id)[0] == name:
+                return amount
+        return None
+
+    def scaled(self, factor: float) -> "CompactNutrients":
+        scaled = CompactNutrients()
+        scaled._ids = self._ids
+        scaled._values = array('f', (value * factor for value in self._values))
+        return scaled
+
+
+# Swap the nutrient lists in a recipe / ingredient "nutrition" payload for their compact form (in place)
+def compact_nutrition(nutrition: dict) -> dict:
+    for key in ("nutrients", "properties", "flavonoids"):
+        if isinstance(nutrition.get(key), list):
+            nutrition[key] = CompactNutrients(nutrition.get(key))
+    for ingred in nutrition.get("ingredients") or []:
+        if isinstance(ingred.get("nutrients"), list):
+            ingred["nutrients"] = CompactNutrients(ingred.get("nutrients"))
+    return nutrition
+
+
+# Ingredient info fields the app reads - the rest of the payload (cost, meta, category path...) isn't kept
+INGREDIENT_INFO_FIELDS = ["id", "name", "amount", "unit", "unitShort", "aisle", "image", "possibleUnits", "consistency"]
+
+
+# Cacheable ingredient info: only the fields in use, with nutrient lists in compact form
+def compact_ingredient_info(ingredient: dict) -> dict:
+    # Names, units and aisles repeat across thousands of ingredients - intern them so each is stored once
+    compact = {field: sys.intern(value) if isinstance(value, str) else value
+               for field, value in ((field, ingredient.get(field)) for field in INGREDIENT_INFO_FIELDS)
+               if field in ingredient}
+    if "possibleUnits" in compact:
+        compact["possibleUnits"] = tuple(sys.intern(unit) for unit in compact.get("possibleUnits"))
+    if ingredient.get("nutrition"):
+        compact["nutrition"] = compact_nutrition(ingredient.get("nutrition"))
+    return compact
+
+
+# Fixed order of the per-recipe nutrient vectors (macros first), with units and FDA daily values
+NUTRIENT_VECTOR_NAMES = ["Calories", "Protein", "Fat", "Carbohydrates", "Fiber", "Sugar", "Sodium", "Saturated Fat",
+                         "Cholesterol"]
+NUTRIENT_VECTOR_UNITS = ["kcal", "g", "g", "g", "g", "g", "mg", "g", "mg"]
+NUTRIENT_DAILY_VALUES = [2000, 50, 78, 275, 28, 50, 2300, 20, 300]
+
+
+# Per-serving nutrient vectors of cached recipes, one float array per nutrient in NUTRIENT_VECTOR_NAMES
+class RecipeNutrientTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}  # recipe id -> position in the macro arrays
+        self._recipe_ids = array('I')
+        self._columns = [array('f') for _ in NUTRIENT_VECTOR_NAMES]
+
+    def __len__(self):
+        return len(self._recipe_ids)
+
+    def add_recipe(self, recipe: dict):
+        nutrients = (recipe.get("nutrition") or {}).get("nutrients")
+        if not nutrients or recipe.get("id") is None:
+            return
+        amounts = {name: amount for name, amount, _, _ in CompactNutrients.of(nutrients).rows()}
+        if amounts.get("Calories") is None:
+            return
+        recipe_id = int(recipe.get("id"))
+        with self._lock:
+            position = self._positions.get(recipe_id)
+            if position is None:
+                self._positions[recipe_id] = len(self._recipe_ids)
+                self._recipe_ids.append(recipe_id)
+                for name, column in zip(NUTRIENT_VECTOR_NAMES, self._columns):
+                    column.append(float(amounts.get(name) or 0))
+            else:
+                for name, column in zip(NUTRIENT_VECTOR_NAMES, self._columns):
+                    column[position] = float(amounts.get(name) or 0)
+
+    def vector(self, recipe_id) -> Optional[list]:
+        with self._lock:
+            position = self._positions.get(int(recipe_id))
+            return [column[position] for column in self._columns] if position is not None else None
+
+    # (recipe id, calories, protein, fat, carbs, ...) for every given recipe that has nutrition info
+    def rows(self, recipe_ids) -> list:
+        with self._lock:
+            positions = [self._positions[recipe_id] for recipe_id in recipe_ids if recipe_id in self._positions]
+            return [(self._recipe_ids[position],) + tuple(column[position] for column in self._columns)
+                    for position in positions]
+
+
+RECIPE_NUTRIENT_TABLE = RecipeNutrientTable()
+
+
+# Pantry rows in a local SQLite file - only visible to this process / Lambda container
+class SqlitePantryBackend:
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pantry_items "
+                           "(user_id TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (user_id, name))")
+
+    def names(self, user_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT name FROM pantry_items WHERE user_id = ? ORDER BY name",
+                                      (user_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, user_id: str, names: list):
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO pantry_items (user_id, name) VALUES (?, ?)",
+                                   [(user_id, name) for name in names])
+
+    def remove(self, user_id: str, names: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM pantry_items WHERE user_id = ? AND name = ?",
+                                   [(user_id, name) for name in names])
+
+
+# One item per user in a DynamoDB table shared by every Lambda container, the names kept as a string set
+class DynamoPantryBackend:
+    def __init__(self, table_name: str):
+        self._table = boto3.resource("dynamodb").Table(table_name)
+
+    def names(self, user_id: str) -> list:
+        item = self._table.get_item(Key={"user_id": user_id}, ConsistentRead=True).get("Item") or {}
+        return sorted(item.get("names") or [])
+
+    # ADD / DELETE on the set are atomic, so concurrent edits from different containers don't overwrite each other
+    def _update(self, user_id: str, action: str, names: list):
+        if names:
+            self._table.update_item(Key={"user_id": user_id}, UpdateExpression=f"{action} #names :names",
+                                    ExpressionAttributeNames={"#names": "names"},
+                                    ExpressionAttributeValues={":names": set(names)})
+
+    def add(self, user_id: str, names: list):
+        self._update(user_id, "ADD", names)
+
+    def remove(self, user_id: str, names: list):
+        self._update(user_id, "DELETE", names)
+
+
+# Per-user pantry - ingredients on hand, persisted by name in a pantry backend and held in memory as a bitset over
+# the ingredient index vocabulary so recipes can be ranked against it directly
+class PantryStore:
+    def __init__(self, backend, cache_size: int, cache_ttl: float, index: IngredientIndex):
+        self._backend = backend
+        self._index = index
+        self._cache = TTLCache(cache_size, cache_ttl)
+
+    def bits(self, user_id: str) -> int:
+        bits = self._cache.get(user_id)
+        if bits is None:
+            bits = self._index.ingredient_bits(self.names(user_id), create=True)
+            self._cache.set(user_id, bits)
+        return bits
+
+    def names(self, user_id: str) -> list:
+        return self._backend.names(user_id)
+
+    # Blank names are dropped on the way in and out - DynamoDB rejects empty strings in a string set
+    def add(self, user_id: str, names: list):
+        self._backend.add(user_id, list(filter(None, (normalize_ingredient_name(name) for name in names))))
+        self._cache.pop(user_id)
+
+    def remove(self, user_id: str, names: list):
+        self._backend.remove(user_id, list(filter(None, (normalize_ingredient_name(name) for name in names))))
+        self._cache.pop(user_id)
+
+    def contains(self, user_id: str, name: str) -> bool:
+        return bool(self.bits(user_id) & self._index.ingredient_bits([name]))
+
+
+if PANTRY_TABLE_NAME:
+    PANTRY_BACKEND = DynamoPantryBackend(PANTRY_TABLE_NAME)
+else:
+    PANTRY_BACKEND = SqlitePantryBackend(PANTRY_DB_PATH)
+    if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        g_logger.warning("PANTRY_TABLE_NAME is not set - pantries are only kept by this container")
+PANTRY = PantryStore(PANTRY_BACKEND, PANTRY_CACHE_SIZE, PANTRY_CACHE_TTL, INGREDIENT_INDEX)
+
+
+# Pool of random recipes per diet, pulled from Spoonacular in batches - fallback_func only serves when a refill fails
+# Refills run synchronously - the /recipe lazy listener tops the pool up after a random recipe was served
+class RandomRecipePool:
+    def __init__(self, fetch_func, low_water: int, wait_seconds: float, fallback_func=None):
+        self.low_water = low_water
+        self.wait_seconds = wait_seconds
+        self._fetch_func = fetch_func
+        self._fallback_func = fallback_func
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._refills = {}  # diet -> Event set when the refill in flight for it finishes
+
+    def pop(self, diet: str = "") -> Optional[dict]:
+        recipe = self._pop(diet)
+        if recipe is not None:
+            APP_METRICS.incr("random_recipe_pool.hits")
+            return recipe
+
+        # Empty pool - the user has to wait for this batch (or the one already loading)
+        APP_METRICS.incr("random_recipe_pool.misses")
+        self.refill(diet)
+        recipe = self._pop(diet)
+        if recipe is None and self._fallback_func:
+            # Spoonacular couldn't refill it - serve a matching recipe we already hold rather than nothing
+            recipe = self._fallback_func(diet)
+            if recipe is not None:
+                APP_METRICS.incr("random_recipe_pool.cached_fallbacks")
+        return recipe
+
+    def _pop(self, diet: str) -> Optional[dict]:
+        with self._lock:
+            pool = self._pools.setdefault(diet, deque())
+            return pool.popleft() if pool else None
+
+    def needs_refill(self, diet: str) -> bool:
+        with self._lock:
+            return len(self._pools.get(diet) or ()) < self.low_water
+
+    # Fetch a batch into the pool - when a refill for the diet is already in flight, wait for that one instead
+    # timeout (wait_seconds by default) bounds both the wait and the fetch's Spoonacular request
+    def refill(self, diet: str, timeout: Optional[float] = None):
+        timeout = self.wait_seconds if timeout is None else timeout
+        with self._lock:
+            in_flight = self._refills.get(diet)
+            if in_flight is None:
+                done = self._refills[diet] = threading.Event()
+        if in_flight is not None:
+            in_flight.wait(timeout)
+            return
+        try:
+            recipes = self._fetch_func(diet, timeout)
+            with self._lock:
+                self._pools.setdefault(diet, deque()).extend(recipes)
+        except Exception as e:
+            g_logger.error(f"Error refilling random recipe pool for diet '{diet}': {e}")
+        finally:
+            with self._lock:
+                self._refills.pop(diet, None)
+            done.set()
+
+
+# Raised when a Slack user's Spoonacular account can't be loaded or connected - requests for the user can't be made
+class SpoonacularAccountError(Exception):
+    pass
+
+
+# Account rows in a local SQLite file - only visible to this process / Lambda container
+class SqliteAccountBackend:
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS spoonacular_accounts "
+                           "(user_id TEXT PRIMARY KEY, username TEXT NOT NULL, hash TEXT NOT NULL)")
+
+    def load(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT username, hash FROM spoonacular_accounts WHERE user_id = ?",
+                                     (user_id,)).fetchone()
+        return {"username": row[0], "hash": row[1]} if row else None
+
+    # Keeps the first account saved for a user - returns whichever account is stored
+    def save_if_absent(self, user_id: str, account: dict) -> dict:
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO spoonacular_accounts (user_id, username, hash) "
+                               "VALUES (?, ?, ?)", (user_id, account["username"], account["hash"]))
+        return self.load(user_id)
+
+
+# Account items in a DynamoDB table shared by every Lambda container
+class DynamoAccountBackend:
+    def __init__(self, table_name: str):
+        self._table = boto3.resource("dynamodb").Table(table_name)
+
+    def load(self, user_id: str) -> Optional[dict]:
+        item = self._table.get_item(Key={"user_id": user_id}, ConsistentRead=True).get("Item")
+        return {"username": item["username"], "hash": item["hash"]} if item else None
+
+    # Conditional put, so containers connecting the same user at once all end up on the first account saved
+    def save_if_absent(self, user_id: str, account: dict) -> dict:
+        try:
+            self._table.put_item(Item={"user_id": user_id, "username": account["username"], "hash": account["hash"]},
+                                 ConditionExpression="attribute_not_exists(user_id)")
+            return account
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+            return self.load(user_id)
+
+
+# Slack user id -> Spoonacular account, LRU in front of an account backend
+# With a shared account every user maps to it and nothing is stored or connected
+class SpoonacularAccountStore:
+    def __init__(self, backend, cache_size: int, connect_func, shared_account: Optional[dict] = None):
+        self._backend = backend
+        self._cache = TTLCache(cache_size)
+        self._connect_func = connect_func
+        self._shared_account = shared_account
+        self._lock = threading.Lock()
+        self._connect_locks = {}
+
+    # Raises SpoonacularAccountError instead of handing back an account without a username / hash
+    def get(self, user_id: str) -> dict:
+        if self._shared_account is not None:
+            return self._shared_account
+        account = self._cache.get(user_id)
+        if account is not None:
+            return account
+
+        # Single-flight - concurrent first requests for a user wait on one connect call
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(user_id, threading.Lock())
+        with connect_lock:
+            try:
+                account = self._cache.get(user_id) or self._backend.load(user_id)
+                if account is None:
+                    APP_METRICS.incr("accounts.connects")
+                    account = self._connect_func(user_id)
+                    if not account.get("username") or not account.get("hash"):
+                        APP_METRICS.incr("accounts.connect_failures")
+                        raise SpoonacularAccountError(f"Could not connect a Spoonacular account for user {user_id}")
+                    account = self._backend.save_if_absent(user_id, account)
+                self._cache.set(user_id, account)
+                return account
+            except (sqlite3.Error, BotoCoreError, ClientError) as e:
+                raise SpoonacularAccountError(f"Could not load the Spoonacular account for user {user_id}: {e}")
+            finally:
+                with self._lock:
+                    self._connect_locks.pop(user_id, None)
+
+
+# Grams per mass unit - anything else is learned per ingredient from Spoonacular's weightPerServing
+MASS_UNIT_GRAMS = {"g": 1.0, "gram": 1.0, "grams": 1.0, "kg": 1000.0, "kilogram": 1000.0, "kilograms": 1000.0,
+                   "mg": 0.001, "oz": 28.3495, "ounce": 28.3495, "ounces": 28.3495, "lb": 453.592, "lbs": 453.592,
+                   "pound": 453.592, "pounds": 453.592}
+
+
+# Ingredient id -> ingredient info for amount=1 (compact), LRU in front of a local SQLite file
+# Also remembers how many grams one of each unit weighs for an ingredient, so any amount / unit is scaled locally
+class IngredientInfoStore:
+    def __init__(self, db_path: str, cache: TTLCache, fetch_func, max_age: float):
+        self._cache = cache
+        self._fetch_func = fetch_func
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ingredient_info "
+                           "(ingredient_id INTEGER PRIMARY KEY, payload BLOB NOT NULL, fetched_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ingredient_unit_grams "
+                           "(ingredient_id INTEGER NOT NULL, unit TEXT NOT NULL, grams REAL NOT NULL, "
+                           "PRIMARY KEY (ingredient_id, unit))")
+
+    def get(self, ingred_id) -> dict:
+        ingred_id = int(ingred_id)
+        ingredient = read_cache(self._cache, "ingredient_info", ingred_id)
+        if ingredient is not None:
+            return ingredient
+
+        payload = self._load(ingred_id)
+        if payload is None:
+            APP_METRICS.incr("ingredient_info.fetches")
+            payload = self._fetch_func(ingred_id, 1, "")
+            if not payload.get("nutrition"):
+                return payload
+            self._save(ingred_id, payload)
+        ingredient = compact_ingredient_info(payload)
+        self._cache.set(ingred_id, ingredient)
+        return ingredient
+
+    # Grams in one `unit` of the ingredient - mass units are fixed, others cost one request the first time
+    def unit_grams(self, ingred_id, unit: str) -> Optional[float]:
+        ingred_id, unit = int(ingred_id), normalize_ingredient_name(unit)
+        if unit in MASS_UNIT_GRAMS:
+            return MASS_UNIT_GRAMS[unit]
+        with self._lock:
+            row = self._conn.execute("SELECT grams FROM ingredient_unit_grams WHERE ingredient_id = ? AND unit = ?",
+                                     (ingred_id, unit)).fetchone()
+        if row:
+            return row[0]
+
+        APP_METRICS.incr("ingredient_info.unit_fetches")
+        payload = self._fetch_func(ingred_id, 1, unit)
+        weight = (payload.get("nutrition") or {}).get("weightPerServing") or {}
+        if weight.get("unit") != "g" or not weight.get("amount"):
+            return None
+        self.remember_unit_grams(ingred_id, unit, weight.get("amount"))
+        return float(weight.get("amount"))
+
+    def remember_unit_grams(self, ingred_id: int, unit: str, grams: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ingredient_unit_grams (ingredient_id, unit, grams) "
+                               "VALUES (?, ?, ?)", (int(ingred_id), normalize_ingredient_name(unit), float(grams)))
+
+    def _load(self, ingred_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload, fetched_at FROM ingredient_info WHERE ingredient_id = ?",
+                                     (ingred_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def _save(self, ingred_id: int, payload: dict):
+        weight = (payload.get("nutrition") or {}).get("weightPerServing") or {}
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ingredient_info (ingredient_id, payload, fetched_at) "
+                               "VALUES (?, ?, ?)", (ingred_id, zlib.compress(json.dumps(payload).encode()), time.time()))
+        if payload.get("unit") and weight.get("unit") == "g" and weight.get("amount"):
+            self.remember_unit_grams(ingred_id, payload.get("unit"), weight.get("amount"))
+
+
+# Per-user / per-message interaction state with TTL eviction
+# Lock striping keeps read-modify-write updates atomic per key without serializing every user
+class InteractionStateStore:
+    def __init__(self, max_size: int, ttl: float, stripes: int):
+        self._cache = TTLCache(max_size, ttl)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _lock_for(self, key) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def get(self, key) -> dict:
+        return dict(self._cache.get(key) or {})
+
+    def update(self, key, **values) -> dict:
+        with self._lock_for(key):
+            state = dict(self._cache.get(key) or {})
+            state.update(values)
+            self._cache.set(key, state)
+            return state
+
+    def pop(self, key) -> dict:
+        with self._lock_for(key):
+            return self._cache.pop(key) or {}
+
+
+# Read-through caches for Spoonacular GET responses
+SHOPPING_LIST_CACHE = TTLCache(5000, SHOPPING_LIST_CACHE_TTL, SPOONACULAR_STALE_TTL)  # user_id -> shopping list
+MEAL_PLAN_WEEK_CACHE = TTLCache(5000, MEAL_PLAN_VIEW_CACHE_TTL, SPOONACULAR_STALE_TTL)  # (user_id, start_date) -> week
+MEAL_PLAN_DAY_CACHE = TTLCache(5000, MEAL_PLAN_VIEW_CACHE_TTL, SPOONACULAR_STALE_TTL)  # (user_id, date) -> day
+RECIPE_CACHE = TTLCache(RECIPE_CACHE_MAX_SIZE, RECIPE_CACHE_TTL)  # recipe id -> full recipe
+RECIPE_LIGHT_CACHE = TTLCache(RECIPE_CACHE_MAX_SIZE, RECIPE_CACHE_TTL)  # recipe id -> projected recipe, no nutrition
+RECIPE_SEARCH_CACHE = TTLCache(1000, RECIPE_SEARCH_CACHE_TTL)  # (normalized query, offset) -> result page
+# ingredient id -> ingredient info with compact nutrition
+INGREDIENT_INFO_CACHE = TTLCache(INGREDIENT_INFO_CACHE_MAX_SIZE, INGREDIENT_INFO_CACHE_TTL)
+# (ingredient id, basis) -> rendered comparison column (nutrient name -> cell text)
+NUTRIENT_COLUMN_CACHE = TTLCache(INGREDIENT_INFO_CACHE_MAX_SIZE, INGREDIENT_INFO_CACHE_TTL)
+
+
+# Speculative prefetcher - warms the caches for the views a user is likely to open next
+class Prefetcher:
+    def __init__(self, graph: dict, budget: int, budget_window: float, max_seconds: float):
+        self.graph = graph
+        self.budget = budget
+        self.max_seconds = max_seconds
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._budgets = TTLCache(10000, budget_window)  # user_id -> remaining API calls
+        self._prefetched = TTLCache(20000, max(SHOPPING_LIST_CACHE_TTL, RECIPE_CACHE_TTL))  # (cache, key) -> user
+
+    def register(self, name: str, func):
+        self._targets[name] = func
+
+    # Take one API call from the user's budget - users who never use prefetched data run dry
+    def spend(self, user_id: str) -> bool:
+        with self._lock:
+            remaining = self._budgets.get(user_id, self.budget)
+            if remaining <= 0:
+                APP_METRICS.incr("prefetch.skipped_budget")
+                return False
+            self._budgets.set(user_id, remaining - 1)
+            return True
+
+    def mark(self, cache_name: str, key, user_id: str):
+        APP_METRICS.incr("prefetch.issued")
+        self._prefetched.set((cache_name, key), user_id)
+
+    # Called on every cache hit - a hit on prefetched data refunds the call it cost
+    def record_hit(self, cache_name: str, key):
+        user_id = self._prefetched.pop((cache_name, key))
+        if user_id is None:
+            return
+        APP_METRICS.incr("prefetch.used")
+        with self._lock:
+            remaining = self._budgets.get(user_id, self.budget)
+            self._budgets.set(user_id, min(self.budget, remaining + 1))
+
+    # Walk the navigation graph breadth first from the view that was just published, for at most max_seconds
+    def run(self, user_id: str, view: str):
+        started = time.monotonic()
+        queue = list(self.graph.get(view, []))
+        visited = set()
+        while queue:
+            target = queue.pop(0)
+            if target in visited or target not in self._targets:
+                continue
+            if time.monotonic() - started >= self.max_seconds:
+                APP_METRICS.incr("prefetch.skipped_time")
+                break
+            visited.add(target)
+            try:
+                self._targets[target](user_id)
+            except Exception as e:
+                g_logger.error(f"Error prefetching {target} for {user_id}: {e}")
+            queue.extend(self.graph.get(target, []))
+        g_logger.debug(f"Prefetch stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        issued = APP_METRICS.get("prefetch.issued")
+        used = APP_METRICS.get("prefetch.used")
+        return {
+            "issued": issued,
+            "used": used,
+            "used_ratio": used / issued if issued else 0.0,
+            "skipped_budget": APP_METRICS.get("prefetch.skipped_budget")
+        }
+
+
+PREFETCHER = Prefetcher(PREFETCH_NAVIGATION_GRAPH, PREFETCH_BUDGET, PREFETCH_BUDGET_WINDOW, PREFETCH_MAX_SECONDS)
+
+
+# Cache lookup that also credits the prefetcher when it served the hit
+def read_cache(cache: TTLCache, cache_name: str, key):
+    value = cache.get(key)
+    if value is not None:
+        APP_METRICS.incr(f"cache.{cache_name}.hits")
+        PREFETCHER.record_hit(cache_name, key)
+    else:
+        APP_METRICS.incr(f"cache.{cache_name}.misses")
+    return value
+
+
+# Expired copy of a response from a cache built with stale_ttl, marked "stale", for when Spoonacular is failing
+def read_stale_cache(cache: TTLCache, cache_name: str, key) -> Optional[dict]:
+    value = cache.get_stale(key)
+    if value is None:
+        return None
+    APP_METRICS.incr(f"cache.{cache_name}.stale_served")
+    return dict(value, stale=True)
+
+
+# Store a Spoonacular response unless it is an error payload or a stale fallback
+def write_cache(cache: TTLCache, key, value):
+    if isinstance(value, dict) and (value.get("status") == "failure" or value.get("stale")):
+        return
+    cache.set(key, value)
+
+
+# Store a full recipe in RECIPE_CACHE and feed it to the local recipe indexes
+def cache_recipe(recipe: dict):
+    if recipe.get("id") is None:
+        return
+    if recipe.get("nutrition"):
+        compact_nutrition(recipe.get("nutrition"))
+    write_cache(RECIPE_CACHE, int(recipe.get("id")), recipe)
+    INGREDIENT_INDEX.add_recipe(recipe)
+    RECIPE_TEXT_INDEX.add_recipe(recipe)
+    RECIPE_FLAG_INDEX.add_recipe(recipe)
+    RECIPE_NUTRIENT_TABLE.add_recipe(recipe)
+
+
+# Field groups get_recipe_by_id callers ask for. Only "nutrition" needs the full payload (includeNutrition=true),
+# the rest come back in the light one, which is projected down to these fields before it's cached
+RECIPE_FIELD_GROUPS = {
+    "card": ("id", "title", "image", "imageType", "summary", "sourceUrl", "readyInMinutes", "servings", "vegan",
+             "vegetarian", "glutenFree", "dairyFree", "ketogenic", "lowFodmap", "veryHealthy", "diets", "dishTypes"),
+    "ingredients": ("id", "title", "servings", "extendedIngredients"),
+    "instructions": ("id", "title", "analyzedInstructions", "instructions"),
+    "nutrition": ("id", "nutrition")
+}
+RECIPE_ALL_FIELD_GROUPS = tuple(RECIPE_FIELD_GROUPS)
+RECIPE_LIGHT_FIELDS = tuple(dict.fromkeys(field for group, fields in RECIPE_FIELD_GROUPS.items()
+                                          if group != "nutrition" for field in fields))
+RANDOM_RECIPE_FIELDS = ("card", "ingredients")
+# The meal plan day view shows each meal's card plus the day's %DV line, which needs every recipe's nutrition
+MEAL_PLAN_DETAIL_RECIPE_FIELDS = ("card", "ingredients", "nutrition")
+
+
+# Store a light (no nutrition) recipe in RECIPE_LIGHT_CACHE, keeping only the fields light callers can ask for
+def cache_light_recipe(recipe: dict) -> dict:
+    recipe = {field: recipe[field] for field in RECIPE_LIGHT_FIELDS if field in recipe}
+    if recipe.get("id") is not None:
+        write_cache(RECIPE_LIGHT_CACHE, int(recipe.get("id")), recipe)
+        INGREDIENT_INDEX.add_recipe(recipe)
+        RECIPE_TEXT_INDEX.add_recipe(recipe)
+        RECIPE_FLAG_INDEX.add_recipe(recipe)
+    return recipe
+
+
+# Cached recipe holding the RECIPE_FIELD_GROUPS in `fields`, or None - full recipes cover every group, light ones
+# everything but "nutrition"
+def get_cached_recipe(recipe_id, fields: tuple = RECIPE_ALL_FIELD_GROUPS) -> Optional[dict]:
+    recipe = RECIPE_CACHE.get(int(recipe_id))
+    if recipe is None and "nutrition" not in fields:
+        recipe = RECIPE_LIGHT_CACHE.get(int(recipe_id))
+    return recipe
+
+
+# Drop every cached meal plan week / day for a user after their calendar changes
+def invalidate_meal_plan_caches(user_id: str):
+    MEAL_PLAN_WEEK_CACHE.pop_matching(lambda key: key[0] == user_id)
+    MEAL_PLAN_DAY_CACHE.pop_matching(lambda key: key[0] == user_id)
+
+
+# Responses of /mealplanner/generate keyed by (timeFrame, targetCalories, diet, exclude)
+MEAL_PLAN_CACHE = TTLCache(MEAL_PLAN_CACHE_MAX_SIZE, MEAL_PLAN_CACHE_MAX_AGE)
+
+INTERACTION_STATE = InteractionStateStore(INTERACTION_STATE_MAX_SIZE, INTERACTION_STATE_TTL, INTERACTION_STATE_STRIPES)
+
+
+if IDEMPOTENCY_BACKEND == "sqlite":
+    IDEMPOTENCY_STORE = SqliteIdempotencyStore(IDEMPOTENCY_DB_PATH, IDEMPOTENCY_MAX_KEYS)
+else:
+    IDEMPOTENCY_STORE = MemoryIdempotencyStore(IDEMPOTENCY_MAX_KEYS)
+
+# Key claimed by the request currently being dispatched on this thread
+IDEMPOTENCY_CURRENT = threading.local()
+
 # # # # # # # # # # # # # # # # # #
 # #    DISPLAY / FORMATTING     # #
 # # # # # # # # # # # # # # # # # #
 
+# Only option offered while Spoonacular's ingredient search is failing - the select handlers ignore it
+INGREDIENT_SEARCH_UNAVAILABLE_OPTION = {
+    "text": {
+        "type": "plain_text",
+        "text": "Spoonacular is unavailable, try again in a bit"
+    },
+    "value": "spoonacular_unavailable"
+}
+
+
 block_divider = {
     "type": "divider"
 }
@@ -109,6 +1758,206 @@ home_view_main_nav_buttons = {
 }
 
 
+# HTML tags left in Spoonacular recipe summaries (bold is converted to mrkdwn first)
+RECIPE_SUMMARY_TAG_PATTERN = re.compile(r'<[^>]*>')
+
+# Text layout for each place a recipe card is posted
+RECIPE_CARD_VARIANTS = {
+    "random": {
+        "text": "Random recipe",
+        "summary": "    {summary}",
+        "ingredients": "*Ingredients*: \n{ingredients}\n\n*Ready in*: {ready_in_mins} mins",
+        "actions_block_id": "random_recipe_action"
+    },
+    "search": {
+        "text": "Top Recipe Found",
+        "summary": "*Summary*: {summary}",
+        "ingredients": "*Ingredients*: {ingredients}\n\n*Ready in*: {ready_in_mins} mins",
+        "actions_block_id": "random_recipe_action"
+    },
+    "ingredients": {
+        "text": "Random recipe",
+        "summary": "    {summary}",
+        "ingredients": "*Ingredients*: \n{ingredients}\n\n*Ready in*: {ready_in_mins} mins",
+        "actions_block_id": "ingred_recipe_action"
+    }
+}
+
+# Rendered recipe card parts keyed by (recipe id, recipe version)
+RECIPE_CARD_CACHE = TTLCache(int(os.environ.get("RECIPE_CARD_CACHE_MAX_SIZE", 2000)))
+
+
+# Convert a recipe's HTML summary to mrkdwn
+def clean_recipe_summary(summary: str) -> str:
+    summary = summary.replace('<b>', '*').replace('</b>', '*')
+    return RECIPE_SUMMARY_TAG_PATTERN.sub('', summary)
+
+
+DIET_BADGES = [("vegan", "*V*"), ("vegetarian", "*Veg*"), ("gluten free", "*GF*"), ("dairy free", "*DF*")]
+
+
+# Short diet badge string for a recipe, ex: "*V* *Veg* *GF* *DF*"
+def create_diet_badges(recipe: dict) -> str:
+    mask = RECIPE_FLAG_INDEX.mask(recipe.get("id")) if recipe.get("id") is not None else None
+    if mask is None:
+        mask = get_recipe_flag_mask(recipe)
+    badges = [badge if mask & RECIPE_FLAG_BITS[flag] else "" for flag, badge in DIET_BADGES]
+
+    return "None Found" if not any(badges) else " ".join(badges)
+
+
+# Cleaned summary, ingredient text and diet badges for a recipe - built once per recipe id and version
+def get_recipe_card_parts(recipe: dict) -> dict:
+    version = hash((recipe.get("title"), recipe.get("image"), recipe.get("summary"), recipe.get("sourceUrl"),
+                    recipe.get("readyInMinutes"), recipe.get("servings"), len(recipe.get("extendedIngredients") or [])))
+    cache_key = (recipe.get("id"), version)
+    parts = RECIPE_CARD_CACHE.get(cache_key)
+    if parts is None:
+        extended_ingred_list = []
+        for ingred in recipe.get("extendedIngredients") or []:
+            extended_ingred_list.append(ingred.get("original"))
+        parts = {
+            "summary": clean_recipe_summary(recipe.get("summary")) if recipe.get("summary") else None,
+            "ingredients": ", ".join(extended_ingred_list),
+            "diet_badges": create_diet_badges(recipe),
+            "cards": {}
+        }
+        RECIPE_CARD_CACHE.set(cache_key, parts)
+    return parts
+
+
+# Summary cut to a display length
+def get_recipe_summary(recipe: dict, length: int) -> str:
+    summary = get_recipe_card_parts(recipe).get("summary")
+    return f"{summary[:length]}..." if summary else "No summary found..."
+
+
+# Create message with a full recipe card - blocks are cached, each post gets its own copy of the list
+# Per-post buttons (extra_elements) are appended to a copy of the actions block
+def render_recipe_card(recipe: dict, variant: str, extra_elements: Optional[list] = None) -> dict:
+    parts = get_recipe_card_parts(recipe)
+    blocks = parts.get("cards").get(variant)
+    if blocks is None:
+        layout = RECIPE_CARD_VARIANTS[variant]
+        title = recipe.get("title")
+        recipe_id = recipe.get("id")
+        blocks = [
+            block_divider,
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"{title}"
+                }
+            },
+            block_divider,
+            {
+                "type": "image",
+                "title": {
+                    "type": "plain_text",
+                    "text": f"Image of {title}"
+                },
+                "image_url": recipe.get("image", "No image found"),
+                "alt_text": f"Image of {title}"
+            },
+            block_divider,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": layout["summary"].format(summary=get_recipe_summary(recipe, 350))
+                }
+            },
+            block_divider,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": layout["ingredients"].format(ingredients=parts.get("ingredients"),
+                                                         ready_in_mins=recipe.get("readyInMinutes"))
+                }
+            },
+            {
+                "type": "actions",
+                "block_id": layout["actions_block_id"],
+                "elements": [
+                    {
+                        "type": "button",
+                        "text": {
+                            "type": "plain_text",
+                            "text": "Add all to shopping list"
+                        },
+                        "value": str(recipe_id),
+                        "action_id": "random_recipe_add_all_to_shop_list"
+                    },
+                    {
+                        "type": "button",
+                        "text": {
+                            "type": "plain_text",
+                            "text": "Show instructions"
+                        },
+                        "value": str(recipe_id),
+                        "action_id": "recipe_show_instructions"
+                    },
+                    {
+                        "type": "button",
+                        "text": {
+                            "type": "plain_text",
+                            "text": "View Source"
+                        },
+                        "value": str(recipe_id),
+                        "action_id": "random_recipe_view_source",
+                        "url": recipe.get("sourceUrl")
+                    }
+                ]
+            },
+            block_divider
+        ]
+        parts.get("cards")[variant] = blocks
+
+    blocks = list(blocks)
+    if extra_elements:
+        actions_index = len(blocks) - 2
+        actions_block = blocks[actions_index]
+        blocks[actions_index] = {**actions_block, "elements": actions_block.get("elements") + extra_elements}
+
+    return {
+        "text": RECIPE_CARD_VARIANTS[variant]["text"],
+        "blocks": blocks
+    }
+
+
+# Next result / next page buttons for a '/recipe search' card
+def create_recipe_search_buttons(query: str, index: int, total_results: int) -> list:
+    buttons = []
+    next_page_index = index - index % RECIPE_SEARCH_PAGE_SIZE + RECIPE_SEARCH_PAGE_SIZE
+    if index + 1 < total_results:
+        buttons.append(
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Next result"
+                },
+                "value": json.dumps({"query": query, "index": index + 1}),
+                "action_id": "recipe_search_next_result"
+            }
+        )
+    if index + 1 < next_page_index < total_results:
+        buttons.append(
+            {
+                "type": "button",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Next page"
+                },
+                "value": json.dumps({"query": query, "index": next_page_index}),
+                "action_id": "recipe_search_next_page"
+            }
+        )
+    return buttons
+
+
 # Create block to display nutrient info
 def create_nutrient_display_block(nutrients: dict) -> dict:
     block_json = {
@@ -128,6 +1977,34 @@ def create_nutrient_display_block(nutrients: dict) -> dict:
     return block_json
 
 
+# Shopping list items as "name (amount unit)" lines, quantities of the same ingredient normalized and summed
+def format_shopping_list_items(items: list) -> list:
+    parsed_lines = []
+    for item in items:
+        original = (item.get("measures") or {}).get("original") or {}
+        parsed_lines.append(parse_spoonacular_ingredient(item.get("name"), original.get("amount"),
+                                                         original.get("unit")))
+    return [f"{parsed.get('name')} ({parsed.get('amount'):g} {parsed.get('unit')})".replace(" )", ")")
+            if parsed.get("amount") is not None else parsed.get("name") for parsed in merge_ingredient_lines(parsed_lines)]
+
+
+# Context line shown on views built from a stale copy of a Spoonacular response
+def create_stale_notice_blocks(response: dict) -> list:
+    if not response.get("stale"):
+        return []
+    return [
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": SAY_STALE_RESPONSE
+                }
+            ]
+        }
+    ]
+
+
 # Create block to display aisle info
 def create_sorted_aisles_display_block(aisles: dict) -> dict:
     total_items = 0
@@ -147,11 +2024,7 @@ def create_sorted_aisles_display_block(aisles: dict) -> dict:
         }
     )
     for aisle in aisles:
-        items_list = []
-        for item in aisle.get("items"):
-            items_list.append(f"{item.get('name')} ({item.get('measures').get('original').get('amount')}"
-                              f" {item.get('measures').get('original').get('unit')})")
-        items_joined = ", ".join(items_list)
+        items_joined = ", ".join(format_shopping_list_items(aisle.get("items")))
         block_json.get("blocks").append(
             {
                 "type": "section",
@@ -186,23 +2059,11 @@ def display_daily_meal_plan_and_nutrients(daily_plan_info: dict) -> dict:
     for meal in daily_plan_info.get("meals"):
         meal_id = meal.get('id')
         meal_ids.append(str(meal_id))
-        full_recipe = get_recipe_by_id(meal_id)
+        full_recipe = get_recipe_by_id(meal_id, ("card", "ingredients"))
         meal_img = full_recipe.get('image')
 
-        if full_recipe.get("summary"):
-            summary = full_recipe.get("summary").replace('<b>', '*').replace('</b>', '*')
-            summary = re.sub(r'<.*?', '', summary)
-            summary = f"{summary[:180]}..."
-        else:
-            summary = "No summary found..."
-
-        vegan = "*V*" if full_recipe.get('vegan') else ""
-        vegetarian = "*Veg*" if full_recipe.get('vegetarian') else ""
-        gluten_free = "*GF*" if full_recipe.get('glutenFree') else ""
-        dairy_free = "*DF*" if full_recipe.get('dairyFree') else ""
-
-        category_str = "None Found" if not vegan and not vegetarian and not gluten_free and not dairy_free else\
-            f"{vegan} {vegetarian} {gluten_free} {dairy_free}"
+        summary = get_recipe_summary(full_recipe, 180)
+        category_str = get_recipe_card_parts(full_recipe).get("diet_badges")
 
         block_json.get("blocks").append(block_divider)
         block_json.get("blocks").append(
@@ -284,6 +2145,12 @@ def display_daily_meal_plan_and_nutrients(daily_plan_info: dict) -> dict:
     return block_json
 
 
+# Single nutrient line, ex: "Protein - 12.5 g | 25% DV"
+def format_nutrient_line(name: str, amount: float, unit: str, percent: Optional[float]) -> str:
+    percent_text = f"{percent:g}% DV" if percent is not None else "no DV"
+    return f"{name} - {amount:g} {unit} | {percent_text}"
+
+
 # Create blocks to display detailed nutrient info for an ingredient
 def display_nutrition_details_for_ingredient(ingredient: dict) -> dict:
     block_json = {"blocks": []}
@@ -305,14 +2172,13 @@ def display_nutrition_details_for_ingredient(ingredient: dict) -> dict:
             }
         )
 
-        for nutrient in nutrients:
+        for nutrient_name, amount, unit, percent in CompactNutrients.of(nutrients).rows():
             block_json.get("blocks").append(
                 {
                     "type": "section",
                     "text": {
                         "type": "mrkdwn",
-                        "text": f"{nutrient.get('name')} - {nutrient.get('amount')} {nutrient.get('unit')} |"
-                                f" {nutrient.get('percentOfDailyNeeds')}% DV"
+                        "text": format_nutrient_line(nutrient_name, amount, unit, percent)
                     }
                 }
             )
@@ -341,14 +2207,13 @@ def append_nutrient_info_to_block_list(blocks: list, ingredient: dict) -> list:
             }
         )
 
-        for nutrient in nutrients:
+        for nutrient_name, amount, unit, percent in CompactNutrients.of(nutrients).rows():
             block_list.append(
                 {
                     "type": "section",
                     "text": {
                         "type": "mrkdwn",
-                        "text": f"{nutrient.get('name')} - {nutrient.get('amount')} {nutrient.get('unit')} |"
-                                f" {nutrient.get('percentOfDailyNeeds')}% DV"
+                        "text": format_nutrient_line(nutrient_name, amount, unit, percent)
                     }
                 }
             )
@@ -356,6 +2221,149 @@ def append_nutrient_info_to_block_list(blocks: list, ingredient: dict) -> list:
         return block_list
 
 
+# Nutrient search select shown at the top of the /nutrients modal
+nutrient_select_block = {
+    "type": "section",
+    "block_id": "ingred_nutrient_select",
+    "text": {
+        "type": "mrkdwn",
+        "text": "Find an ingredient to get nutrient info:"
+    },
+    "accessory": {
+        "action_id": "ingred_nutrient_select",
+        "type": "external_select",
+        "placeholder": {
+            "type": "plain_text",
+            "text": "Search ingredients"
+        },
+        "min_query_length": 1
+    }
+}
+
+
+# Amount / unit each /nutrients comparison basis scales ingredients to
+NUTRIENT_COMPARE_BASES = OrderedDict([("serving", ("1 serving", 1, "")), ("100g", ("100 g", 100, "g"))])
+
+
+# One comparison column per ingredient and basis, rendered once and reused whenever it is shown again
+def get_nutrient_column(ingred_id: str, basis: str = "serving") -> dict:
+    column = read_cache(NUTRIENT_COLUMN_CACHE, "nutrient_column", (int(ingred_id), basis))
+    if column is None:
+        _, amount, unit = NUTRIENT_COMPARE_BASES.get(basis)
+        ingredient = get_ingredient_info_for_amount(ingred_id, amount, unit)
+        nutrients = (ingredient.get("nutrition") or {}).get("nutrients") or []
+        cells = OrderedDict()
+        for nutrient_name, amount, unit, percent in CompactNutrients.of(nutrients).rows():
+            cells[nutrient_name] = f"{amount:.4g}{unit}" + (f" {percent:.0f}%" if percent is not None else "")
+        column = {"name": ingredient.get("name") or str(ingred_id), "cells": cells}
+        if cells:
+            write_cache(NUTRIENT_COLUMN_CACHE, (int(ingred_id), basis), column)
+    return column
+
+
+# Side by side nutrient table for the selected ingredients, as monospace sections (split to fit Slack's limits)
+def create_nutrient_comparison_blocks(columns: list) -> list:
+    row_names = list(OrderedDict.fromkeys(name for column in columns for name in column.get("cells")))
+    name_width = min(max([len(name) for name in row_names] + [8]), 20)
+    column_width = min(max([len(cell) for column in columns for cell in column.get("cells").values()] + [10]), 16) + 2
+
+    lines = ["Nutrient".ljust(name_width) + "".join(
+        column.get("name")[:column_width - 2].title().rjust(column_width) for column in columns)]
+    for name in row_names:
+        lines.append(name[:name_width].ljust(name_width) + "".join(
+            column.get("cells").get(name, "-").rjust(column_width) for column in columns))
+
+    blocks, chunk = [], []
+    for line in lines:
+        if sum(len(chunk_line) + 1 for chunk_line in chunk) + len(line) > 2900:
+            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": "```" + "\n".join(chunk) + "```"}})
+            chunk = [lines[0]]
+        chunk.append(line)
+    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": "```" + "\n".join(chunk) + "```"}})
+    return blocks
+
+
+# /nutrients modal for the selected ingredients - selection ([id, name] pairs) and basis ride along in
+# private_metadata
+def create_nutrients_modal_view(selected: list, basis: str = "serving") -> dict:
+    blocks = [block_divider, nutrient_select_block]
+    if selected:
+        columns = [get_nutrient_column(ingred_id, basis) for ingred_id, _ in selected]
+        blocks.append(block_divider)
+        blocks.append(
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Nutrition Comparison" if len(selected) > 1 else f"Nutrition Info - {columns[0].get('name').capitalize()}"
+                }
+            }
+        )
+        blocks.append(
+            {
+                "type": "section",
+                "block_id": "nutrient_compare_basis",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "Compare per:"
+                },
+                "accessory": {
+                    "action_id": "nutrient_compare_basis",
+                    "type": "static_select",
+                    "initial_option": {
+                        "text": {"type": "plain_text", "text": NUTRIENT_COMPARE_BASES.get(basis)[0]},
+                        "value": basis
+                    },
+                    "options": [
+                        {
+                            "text": {"type": "plain_text", "text": label},
+                            "value": basis_name
+                        } for basis_name, (label, _, _) in NUTRIENT_COMPARE_BASES.items()
+                    ]
+                }
+            }
+        )
+        blocks.extend(create_nutrient_comparison_blocks(columns))
+        blocks.append(
+            {
+                "type": "actions",
+                "block_id": "nutrient_compare_actions",
+                "elements": [
+                    {
+                        "type": "button",
+                        "text": {
+                            "type": "plain_text",
+                            "text": f"Remove {name}"[:75]
+                        },
+                        "value": str(ingred_id),
+                        "action_id": f"nutrient_compare_remove_{position}"
+                    } for position, (ingred_id, name) in enumerate(selected)
+                ]
+            }
+        )
+        blocks.append(
+            {
+                "type": "context",
+                "elements": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Amounts per {NUTRIENT_COMPARE_BASES.get(basis)[0]} with % daily value - compare up to "
+                                f"{NUTRIENT_COMPARE_MAX_INGREDIENTS} ingredients"
+                    }
+                ]
+            }
+        )
+
+    return {
+        "type": "modal",
+        # View identifier
+        "callback_id": "modal_nutrients" if not selected else "view_show_nutrient_info",
+        "title": {"type": "plain_text", "text": "Search Nutrient Info"},
+        "private_metadata": json.dumps({"selected": selected, "basis": basis}),
+        "blocks": blocks
+    }
+
+
 # Combine duplicates items in list and update amounts - needed?
 def combine_duplicate_items(items: list):
     new_list = []
@@ -368,46 +2376,402 @@ def lazy_listener_ack(body, ack):
     ack()
 
 
+# Current time adjusted from UTC to the app's timezone
+def get_adjusted_now() -> datetime.datetime:
+    return datetime.datetime.now() - datetime.timedelta(hours=7)
+
+
+# Monday of the week containing the given day
+def get_start_of_week(day: datetime.datetime) -> datetime.datetime:
+    return day - datetime.timedelta(days=day.weekday())
+
+
+# Path tree for select_json_paths: ["days[*].items[*].value", "days[*].day"]
+# -> {"days": {"*": {"items": {"*": {"value": True}}, "day": True}}}. "a/b/c" in the last part selects several keys
+def compile_json_paths(paths: list) -> dict:
+    tree = {}
+    for path in paths:
+        parts = path.split(".")
+        node = tree
+        for part in parts[:-1]:
+            key, _, index = part.partition("[")
+            if key:
+                node = node.setdefault(key, {})
+            if index:
+                node = node.setdefault("*", {})
+        for leaf in parts[-1].split("/"):
+            node[leaf.partition("[")[0]] = True
+    return tree
+
+
+# Only the requested paths of a decoded JSON document, ex: ["image"], ["days[*].items[*].value"] or
+# ["aisles[*].items[*].name/id/measures"], keeping the document's shape. Cached responses then hold just what the
+# app reads. Values that don't have the expected shape (an error payload's string where a list was wanted) are kept
+def select_json_paths(value, paths):
+    return _select_json_value(value, paths if isinstance(paths, dict) else compile_json_paths(paths))
+
+
+def _select_json_value(value, node):
+    if node is True:
+        return value
+    if isinstance(value, list) and "*" in node:
+        return [_select_json_value(element, node["*"]) for element in value]
+    if isinstance(value, dict):
+        return {key: _select_json_value(child, node[key]) for key, child in value.items() if key in node}
+    return value
+
+
+# The parts of list / week responses the app reads (plus error payload fields) - the rest isn't cached
+SHOPPING_LIST_RESPONSE_PATHS = compile_json_paths(["status/code/message/stale", "aisles[*].aisle",
+                                                   "aisles[*].items[*].id/name/aisle/measures"])
+MEAL_PLAN_WEEK_RESPONSE_PATHS = compile_json_paths(["status/code/message/stale", "days[*].day/date/items"])
+
+
+# Canonical unit -> spellings seen in recipe lines and typed items, matched case-insensitively
+# Single letters ("c", "t", "l") are left out since they collide with ingredient words
+INGREDIENT_UNIT_LEXICON = {
+    "cup": ["cup", "cups"],
+    "tbsp": ["tablespoon", "tablespoons", "tbsp", "tbsps", "tbs", "tbl"],
+    "tsp": ["teaspoon", "teaspoons", "tsp", "tsps"],
+    "fl oz": ["fluid ounce", "fluid ounces", "fl oz", "fl. oz"],
+    "oz": ["ounce", "ounces", "oz"],
+    "lb": ["pound", "pounds", "lb", "lbs"],
+    "g": ["gram", "grams", "g", "gr"],
+    "kg": ["kilogram", "kilograms", "kilo", "kilos", "kg"],
+    "mg": ["milligram", "milligrams", "mg"],
+    "ml": ["milliliter", "milliliters", "millilitre", "millilitres", "ml"],
+    "l": ["liter", "liters", "litre", "litres"],
+    "pint": ["pint", "pints", "pt"],
+    "quart": ["quart", "quarts", "qt"],
+    "gallon": ["gallon", "gallons", "gal"],
+    "pinch": ["pinch", "pinches"],
+    "dash": ["dash", "dashes"],
+    "clove": ["clove", "cloves"],
+    "can": ["can", "cans"],
+    "jar": ["jar", "jars"],
+    "bottle": ["bottle", "bottles"],
+    "package": ["package", "packages", "pkg", "packet", "packets"],
+    "bag": ["bag", "bags"],
+    "box": ["box", "boxes"],
+    "slice": ["slice", "slices"],
+    "piece": ["piece", "pieces"],
+    "bunch": ["bunch", "bunches"],
+    "sprig": ["sprig", "sprigs"],
+    "stick": ["stick", "sticks"],
+    "head": ["head", "heads"],
+    "handful": ["handful", "handfuls"],
+    "serving": ["serving", "servings"],
+    "small": ["small"],
+    "medium": ["medium"],
+    "large": ["large"]
+}
+INGREDIENT_UNIT_ALIASES = {alias: unit for unit, aliases in INGREDIENT_UNIT_LEXICON.items() for alias in aliases}
+INGREDIENT_FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75, "⅛": 0.125, "⅜": 0.375,
+                        "⅝": 0.625, "⅞": 0.875}
+_INGREDIENT_QUANTITY = (r"(?:\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+\s*[½⅓⅔¼¾⅛⅜⅝⅞]|\d+|[½⅓⅔¼¾⅛⅜⅝⅞]|an?(?=\s))")
+# One pass over the line: quantity or range, optional unit (longest spelling first), optional "of", the rest is the name
+INGREDIENT_LINE_PATTERN = re.compile(
+    rf"^\s*(?:(?P<quantity>{_INGREDIENT_QUANTITY})(?:\s*(?:-|–|to|or)\s*(?P<quantity_max>{_INGREDIENT_QUANTITY}))?)?"
+    rf"\s*(?:(?P<unit>{'|'.join(re.escape(alias) for alias in sorted(INGREDIENT_UNIT_ALIASES, key=len, reverse=True))})"
+    r"\.?(?=\s|$))?\s*(?:of\s+)?(?P<name>.*?)\s*$", re.IGNORECASE)
+# Preparation notes and package sizes that aren't part of the ingredient ("onion, diced", "tomatoes (14 oz)")
+INGREDIENT_NOTE_PATTERN = re.compile(r"\s*\([^)]*\)|,.*$")
+
+
+def parse_ingredient_quantity(text: str) -> float:
+    if text[-1] in INGREDIENT_FRACTIONS:
+        whole = text[:-1].strip()
+        return (float(whole) if whole else 0.0) + INGREDIENT_FRACTIONS[text[-1]]
+    if "/" in text:
+        whole, _, fraction = text.rpartition(" ")
+        numerator, denominator = fraction.split("/")
+        return (float(whole) if whole else 0.0) + (int(numerator) / int(denominator) if int(denominator) else 0.0)
+    if text[0] in "aA":
+        return 1.0
+    return float(text)
+
+
+# Preparation, size and state words that don't change which ingredient a line is about ("2 finely chopped onions")
+INGREDIENT_PREP_WORDS = {
+    "chopped", "diced", "minced", "sliced", "grated", "shredded", "crushed", "peeled", "seeded", "cubed", "halved",
+    "quartered", "julienned", "trimmed", "rinsed", "drained", "softened", "melted", "beaten", "packed", "cooked",
+    "finely", "roughly", "coarsely", "thinly", "freshly", "lightly", "fresh", "ripe", "raw", "large", "medium",
+    "small", "extra", "and"
+}
+
+
+# Display name and match key for ingredient text. Leading prep words are dropped ("finely chopped red onions" ->
+# "red onions"), the rest is the ingredient as a whole - "coconut milk" never matches "milk". The name keeps the
+# words as written, the key is the normalized form ("red onion") that's only ever compared, never shown
+def resolve_ingredient_name(text: str) -> tuple:
+    words = text.split()
+    start = 0
+    while start < len(words) - 1 and words[start].lower() in INGREDIENT_PREP_WORDS:
+        start += 1
+    name = " ".join(words[start:])
+    return name, normalize_ingredient_name(name)
+
+
+# Split a free-text ingredient line ("1 1/2 cups chopped tomatoes, drained") into amount, unit and name
+# Ranges ("2-3 cloves garlic") keep the upper bound, that's what needs buying
+def parse_ingredient_line(line: str) -> dict:
+    match = INGREDIENT_LINE_PATTERN.match(INGREDIENT_NOTE_PATTERN.sub("", line) or line)
+    quantity, quantity_max, unit, text = match.group("quantity", "quantity_max", "unit", "name")
+    amount = parse_ingredient_quantity(quantity_max or quantity) if quantity else None
+    name, key = resolve_ingredient_name(text)
+    return {
+        "amount": amount,
+        "unit": INGREDIENT_UNIT_ALIASES.get(unit.lower(), "") if unit else "",
+        "name": name,
+        "key": key,
+        "aisle": INGREDIENT_INDEX.aisle(key),
+        "original": line
+    }
+
+
+def format_ingredient_line(parsed: dict) -> str:
+    amount = parsed.get("amount")
+    parts = [f"{round(amount, 2):g}" if amount is not None else "", parsed.get("unit"), parsed.get("name")]
+    return " ".join(part for part in parts if part)
+
+
+# Volume units -> millilitres (mass units go through MASS_UNIT_GRAMS)
+VOLUME_UNIT_ML = {"tsp": 4.92892, "tbsp": 14.7868, "fl oz": 29.5735, "cup": 236.588, "pint": 473.176,
+                  "quart": 946.353, "gallon": 3785.41, "ml": 1.0, "l": 1000.0}
+# Grams per millilitre, so volume and mass lines for the same ingredient can be summed
+INGREDIENT_DENSITY = {
+    "water": 1.0, "milk": 1.03, "buttermilk": 1.03, "heavy cream": 0.99, "cream": 0.99, "sour cream": 1.0,
+    "yogurt": 1.03, "greek yogurt": 1.05, "butter": 0.96, "oil": 0.92, "olive oil": 0.91, "vegetable oil": 0.92,
+    "coconut oil": 0.92, "flour": 0.53, "all purpose flour": 0.53, "whole wheat flour": 0.51, "sugar": 0.85,
+    "granulated sugar": 0.85, "brown sugar": 0.93, "powdered sugar": 0.51, "honey": 1.42, "maple syrup": 1.32,
+    "salt": 1.22, "kosher salt": 0.65, "baking soda": 0.92, "baking powder": 0.81, "cornstarch": 0.54,
+    "cocoa powder": 0.42, "rice": 0.85, "rolled oat": 0.34, "oat": 0.34, "peanut butter": 1.08,
+    "soy sauce": 1.15, "vinegar": 1.01, "lemon juice": 1.03, "lime juice": 1.03, "chicken broth": 1.0,
+    "vegetable broth": 1.0, "broth": 1.0, "stock": 1.0, "wine": 0.99, "parmesan": 0.42, "cheddar": 0.47
+}
+
+
+# Quantity in its base unit: grams for mass, millilitres for volume, otherwise the unit itself (clove, can, "")
+def normalize_ingredient_quantity(amount: float, unit: str) -> tuple:
+    if unit in MASS_UNIT_GRAMS:
+        return amount * MASS_UNIT_GRAMS[unit], "g"
+    if unit in VOLUME_UNIT_ML:
+        return amount * VOLUME_UNIT_ML[unit], "ml"
+    return amount, unit
+
+
+# Base quantity back to the unit a person would write - kg over 1000 g, cups down to teaspoons for volumes
+def format_ingredient_quantity(amount: float, base_unit: str) -> tuple:
+    if base_unit == "g":
+        return (amount / 1000, "kg") if amount >= 1000 else (amount, "g")
+    if base_unit == "ml":
+        if amount >= 1000:
+            return amount / 1000, "l"
+        for unit in ("cup", "tbsp", "tsp"):
+            if amount >= VOLUME_UNIT_ML[unit] or unit == "tsp":
+                return amount / VOLUME_UNIT_ML[unit], unit
+    return amount, base_unit
+
+
+# Sum parsed lines per ingredient ("1 cup milk" + "250 ml milk" + "2 tbsp milk" -> "2.2 cup milk"), one line per
+# ingredient and unit family in first-seen order. Volume folds into mass when both appear and the density is known.
+# Lines that all share a unit keep it ("1 lb" + "1 lb" -> "2 lb")
+def merge_ingredient_lines(parsed_lines: list) -> list:
+    totals = OrderedDict()  # key -> OrderedDict(base unit -> amount)
+    units = {}  # (key, base unit) -> unit every line used, or None once they differ
+    names = {}  # key -> first-seen display name
+    aisles = {}
+    for parsed in parsed_lines:
+        key = parsed.get("key")
+        if not key:
+            continue
+        amounts = totals.setdefault(key, OrderedDict())
+        names.setdefault(key, parsed.get("name"))
+        aisles.setdefault(key, parsed.get("aisle"))
+        if parsed.get("amount") is not None:
+            amount, base_unit = normalize_ingredient_quantity(parsed.get("amount"), parsed.get("unit"))
+            amounts[base_unit] = amounts.get(base_unit, 0.0) + amount
+            unit = units.setdefault((key, base_unit), parsed.get("unit"))
+            if unit != parsed.get("unit"):
+                units[(key, base_unit)] = None
+
+    merged = []
+    for key, amounts in totals.items():
+        line = {"name": names[key], "key": key, "aisle": aisles[key]}
+        if "g" in amounts and "ml" in amounts and key in INGREDIENT_DENSITY:
+            amounts["g"] += amounts.pop("ml") * INGREDIENT_DENSITY[key]
+            units[(key, "g")] = None
+        if not amounts:
+            merged.append(dict(line, amount=None, unit=""))
+        for base_unit, amount in amounts.items():
+            unit = units[(key, base_unit)]
+            if unit is not None and unit != base_unit:
+                amount = amount / (MASS_UNIT_GRAMS.get(unit) or VOLUME_UNIT_ML[unit])
+            elif unit is None:
+                amount, unit = format_ingredient_quantity(amount, base_unit)
+            merged.append(dict(line, amount=round(amount, 2), unit=unit))
+    return merged
+
+
+# Parsed line for a Spoonacular ingredient (recipe extendedIngredients, shopping list items)
+def parse_spoonacular_ingredient(name: str, amount, unit: str) -> dict:
+    if not amount:
+        # Items added with parse=false keep the whole line as their name
+        return parse_ingredient_line(name)
+    display_name, key = resolve_ingredient_name(name)
+    return {
+        "amount": float(amount),
+        "unit": INGREDIENT_UNIT_ALIASES.get((unit or "").lower(), (unit or "").lower()),
+        "name": display_name,
+        "key": key,
+        "aisle": INGREDIENT_INDEX.aisle(key),
+        "original": name
+    }
+
+
 # # # # # # # # # # # # # # # # # #
 # #    SPOONACULAR REQUESTS     # #
 # # # # # # # # # # # # # # # # # #
 
 
-# Get user info
-def load_user_info(username: str):
-    global USER_INFO
+# URL parts that vary per call, so every user / recipe / date shares one breaker per endpoint
+SPOONACULAR_ENDPOINT_PATTERNS = [
+    (re.compile(r"/mealplanner/(?!generate(?:/|$))[^/]+"), "/mealplanner/{username}"),
+    (re.compile(r"/\d{4}-\d{2}-\d{2}(?=/|$)"), "/{date}"),
+    (re.compile(r"/\d+-\d+x\d+\.\w+$"), "/{id}-{size}.{type}"),  # recipe images
+    (re.compile(r"/\d+(?=/|$)"), "/{id}")
+]
+SPOONACULAR_BREAKERS = {}  # "METHOD /path/{id}" -> CircuitBreaker
+SPOONACULAR_BREAKERS_LOCK = threading.Lock()
+# (url, params) -> last good content, for GETs that opt in with stale_fallback
+SPOONACULAR_STALE_RESPONSES = TTLCache(SPOONACULAR_STALE_MAX_SIZE, SPOONACULAR_STALE_TTL,
+                                       max_bytes=SPOONACULAR_STALE_MAX_BYTES)
+
+
+# Stand-in for a requests response when Spoonacular wasn't (successfully) reached
+class SpoonacularFallbackResponse:
+    def __init__(self, content: bytes, status_code: int, stale: bool):
+        self.content = content
+        self.status_code = status_code
+        self.stale = stale
+
+
+def get_spoonacular_breaker(method: str, url: str) -> CircuitBreaker:
+    endpoint = url[len(SPOONACULAR_BASE_URL):] if SPOONACULAR_BASE_URL and url.startswith(SPOONACULAR_BASE_URL) else url
+    for pattern, replacement in SPOONACULAR_ENDPOINT_PATTERNS:
+        endpoint = pattern.sub(replacement, endpoint)
+    endpoint = f"{method} {endpoint}"
+    with SPOONACULAR_BREAKERS_LOCK:
+        breaker = SPOONACULAR_BREAKERS.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_MIN_CALLS,
+                                     CIRCUIT_BREAKER_ERROR_RATE, CIRCUIT_BREAKER_SLOW_SECONDS,
+                                     CIRCUIT_BREAKER_SLOW_RATE, CIRCUIT_BREAKER_OPEN_SECONDS)
+            SPOONACULAR_BREAKERS[endpoint] = breaker
+    return breaker
+
+
+# Last good response for this request with "stale": true added, or a failure payload when there is none
+def get_spoonacular_fallback_response(breaker: CircuitBreaker, stale_key) -> SpoonacularFallbackResponse:
+    content = SPOONACULAR_STALE_RESPONSES.get(stale_key) if stale_key else None
+    if content is not None:
+        payload = json.loads(content)
+        if isinstance(payload, dict):
+            payload["stale"] = True
+        APP_METRICS.incr(f"circuit_breaker.{breaker.name}.stale_served")
+        return SpoonacularFallbackResponse(json.dumps(payload).encode(), 200, True)
+    return SpoonacularFallbackResponse(json.dumps({
+        "status": "failure",
+        "code": 503,
+        "message": "Spoonacular is unavailable right now, please try again in a bit"
+    }).encode(), 503, False)
+
+
+# Send a Spoonacular request with a timeout through the endpoint's circuit breaker
+# 5xx, timeouts and connection errors count against the breaker and, like calls made while it's open, get a failure
+# payload back instead of raising. GETs with no cache of their own can pass stale_fallback to get the last good
+# response (marked stale) instead
+def spoonacular_request(method: str, url: str, stale_fallback: bool = False, timeout: float = SPOONACULAR_TIMEOUT,
+                        **kwargs):
+    breaker = get_spoonacular_breaker(method, url)
+    params = kwargs.get("params") or {}
+    stale_key = (url, tuple(sorted((key, str(value)) for key, value in params.items() if key != "apiKey"))) \
+        if stale_fallback and method == "GET" else None
+    if not breaker.allow():
+        APP_METRICS.incr(f"circuit_breaker.{breaker.name}.rejected")
+        return get_spoonacular_fallback_response(breaker, stale_key)
+
+    started = time.perf_counter()
+    try:
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+    except requests.RequestException as e:
+        g_logger.error(f"Spoonacular request {breaker.name} failed: {e}")
+        breaker.record(True, time.perf_counter() - started)
+        return get_spoonacular_fallback_response(breaker, stale_key)
+
+    failed = response.status_code >= 500
+    breaker.record(failed, time.perf_counter() - started)
+    if failed:
+        g_logger.error(f"Spoonacular request {breaker.name} returned {response.status_code}")
+        return get_spoonacular_fallback_response(breaker, stale_key)
+    if stale_key and response.status_code < 400:
+        SPOONACULAR_STALE_RESPONSES.set(stale_key, response.content)
+    return response
 
-    if USER_INFO["hash"] in ["hash"]:
 
-        url_path = "/users/connect"
-        url = f"{SPOONACULAR_BASE_URL}{url_path}"
-        params = {
-            'apiKey': SPOONACULAR_API_KEY,
-        }
-        payload = {
-            "username": username
-        }
+# Connect a Slack user to a new Spoonacular account (username + hash)
+def connect_spoonacular_user(user_id: str) -> dict:
+    url_path = "/users/connect"
+    url = f"{SPOONACULAR_BASE_URL}{url_path}"
+    params = {
+        'apiKey': SPOONACULAR_API_KEY,
+    }
+    payload = {
+        "username": f"slack-{user_id}"
+    }
 
-        response = requests.post(url=url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
-        response_json = json.loads(response.content)
+    response = spoonacular_request("POST", url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
 
-        g_logger.debug(f"Response from POST user connect: {response_json}")
+    g_logger.debug(f"Response from POST user connect for {user_id}: {response_json}")
 
-        USER_INFO['username'] = response_json.get("username")
-        USER_INFO['hash'] = response_json.get("hash")
+    if response.status_code >= 400 or not isinstance(response_json, dict):
+        return {"username": None, "hash": None}
+    return {
+        "username": response_json.get("username"),
+        "hash": response_json.get("hash")
+    }
 
-    else:
-        g_logger.debug("User info has already been loaded...")
 
-    return
+# The shared account only stands in when opted into and there's no table ("hash" is the old placeholder value)
+if ACCOUNT_TABLE_NAME or not SHARED_SPOONACULAR_ACCOUNT or SHARED_ACCOUNT.get("hash") in (None, "", "hash"):
+    if SHARED_SPOONACULAR_ACCOUNT:
+        g_logger.warning("SHARED_SPOONACULAR_ACCOUNT is set without a usable USER_NAME / USER_HASH or with "
+                         "ACCOUNT_TABLE_NAME - using per-user Spoonacular accounts")
+    elif SHARED_ACCOUNT.get("hash") not in (None, "", "hash"):
+        g_logger.warning("USER_NAME / USER_HASH are ignored - every Slack user now gets their own Spoonacular "
+                         "account. Set SHARED_SPOONACULAR_ACCOUNT=1 to keep sharing one")
+    SHARED_ACCOUNT = None
+else:
+    g_logger.warning("SHARED_SPOONACULAR_ACCOUNT=1 - every Slack user shares the USER_NAME Spoonacular account")
+if ACCOUNT_TABLE_NAME:
+    ACCOUNT_BACKEND = DynamoAccountBackend(ACCOUNT_TABLE_NAME)
+else:
+    ACCOUNT_BACKEND = SqliteAccountBackend(ACCOUNT_DB_PATH)
+    if SHARED_ACCOUNT is None and os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        g_logger.warning("ACCOUNT_TABLE_NAME is not set - Spoonacular accounts are only kept by this container")
+ACCOUNT_STORE = SpoonacularAccountStore(ACCOUNT_BACKEND, ACCOUNT_CACHE_SIZE, connect_spoonacular_user, SHARED_ACCOUNT)
 
 
 # List all items in shopping list
-def list_items_in_shopping_list() -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def list_items_in_shopping_list(user_id: str) -> dict:
+    cached_list = read_cache(SHOPPING_LIST_CACHE, "shopping_list", user_id)
+    if cached_list is not None:
+        return cached_list
+
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/shopping-list"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -415,112 +2779,283 @@ def list_items_in_shopping_list() -> dict:
         'hash': user_hash
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = select_json_paths(json.loads(response.content), SHOPPING_LIST_RESPONSE_PATHS)
+    if response.status_code >= 500:
+        response_json = read_stale_cache(SHOPPING_LIST_CACHE, "shopping_list", user_id) or response_json
+    response_json.setdefault("aisles", [])  # error payloads render as an empty list
 
-    g_logger.debug(f"Response from GET items in shopping list: {json.loads(response.content)}")
+    g_logger.debug(f"Response from GET items in shopping list: {response_json}")
 
-    return json.loads(response.content)
+    write_cache(SHOPPING_LIST_CACHE, user_id, response_json)
+    return response_json
 
 
 # Add item to shopping list
-def add_item_to_shopping_list(item: str, parse: bool) -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def add_item_to_shopping_list(user_id: str, item: str, parse: bool) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/shopping-list/items"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
         'apiKey': SPOONACULAR_API_KEY,
         'hash': user_hash
     }
-    payload = {
-        "item": item,
-        "parse": parse  # Will attempt to parse and analyze item or not
-    }
+    parsed = parse_ingredient_line(item) if parse and SHOPPING_LIST_LOCAL_PARSE else {}
+    if parsed.get("aisle"):
+        # Parsed here rather than by Spoonacular, the structured line goes up as-is under the aisle the index
+        # knows. Anything the index hasn't seen is left for Spoonacular to parse and place
+        payload = {
+            "item": format_ingredient_line(parsed),
+            "aisle": parsed.get("aisle"),
+            "parse": False
+        }
+    else:
+        payload = {
+            "item": item,
+            "parse": parse  # Will attempt to parse and analyze item or not
+        }
 
-    response = requests.post(url=url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("POST", url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
     response_json = json.loads(response.content)
+    SHOPPING_LIST_CACHE.pop(user_id)
 
     g_logger.debug(f"Response from POST add to shopping list: {response_json}")
 
     return response_json
 
 
-# Delete item from shopping list by name
-def delete_item_from_shopping_list(item_name: str) -> dict:
-    g_logger.debug(f"Starting to delete {item_name} from shopping list.")
-    item_id = get_list_item_id_by_name(item_name)
+# Add several ingredient lines at once - duplicates are merged locally first so each ingredient is one POST
+def add_items_to_shopping_list(user_id: str, items: list) -> list:
+    if not SHOPPING_LIST_LOCAL_PARSE:
+        for item in items:
+            add_item_to_shopping_list(user_id, item, True)
+        return items
+
+    merged_lines = [format_ingredient_line(parsed) for parsed in merge_ingredient_lines(
+        [parse_ingredient_line(item) for item in items])]
+    APP_METRICS.incr("shopping_list.merged_lines", len(items) - len(merged_lines))
+    for line in merged_lines:
+        add_item_to_shopping_list(user_id, line, True)
+    return merged_lines
+
+
+# Ingredient lines for every meal in a GET meal plan week response, scaled to the planned servings
+# Reads the recipe caches only - returns the lines plus how many planned recipes weren't cached
+def aggregate_meal_plan_week_ingredients(meal_plan_week: dict) -> tuple:
+    lines = []
+    missing = 0
+    for day in meal_plan_week.get("days") or []:
+        for item in day.get("items") or []:
+            value = item.get("value") or {}
+            recipe = get_cached_recipe(value.get("id"), ("ingredients",)) if value.get("id") else None
+            if not recipe or not recipe.get("extendedIngredients"):
+                missing += 1
+                continue
+            scale = (value.get("servings") or recipe.get("servings") or 1) / (recipe.get("servings") or 1)
+            for ingred in recipe.get("extendedIngredients"):
+                name = ingred.get("nameClean") if ingred.get("nameClean") else ingred.get("name")
+                lines.append(f"{(ingred.get('amount') or 0) * scale:g} {ingred.get('unit')} {name}")
+    return lines, missing
+
+
+# Build the shopping list for every meal planned between two dates (yyyy-mm-dd) with one call to Spoonacular's
+# list generation endpoint, which merges the ingredients and returns the whole list for SHOPPING_LIST_CACHE.
+# If that call fails and the week's recipes are all cached, the lines are aggregated and merged locally instead.
+# Either way pantry items stay off the list - Spoonacular adds them, so the ones it added are deleted again
+def build_shopping_list_for_dates(user_id: str, start_date: str, end_date: str) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
+    url_path = f"/mealplanner/{username}/shopping-list/{start_date}/{end_date}"
+    url = f"{SPOONACULAR_BASE_URL}{url_path}"
+    params = {
+        'apiKey': SPOONACULAR_API_KEY,
+        'hash': user_hash
+    }
 
-    if item_id != "":
-        global USER_INFO
-        # load_user_info("nick_test")
-        username = USER_INFO["username"]
-        user_hash = USER_INFO["hash"]
-        url_path = f"/mealplanner/{username}/shopping-list/items/{item_id}"
-        url = f"{SPOONACULAR_BASE_URL}{url_path}"
-        params = {
-            'apiKey': SPOONACULAR_API_KEY,
-            'hash': user_hash
-        }
+    # Items already on the list were put there on purpose, pantry or not
+    listed_ids = set()
+    if PANTRY.bits(user_id):
+        listed_ids = {item.get("id") for aisle in list_items_in_shopping_list(user_id).get("aisles")
+                      for item in aisle.get("items")}
 
-        response = requests.delete(url=url, headers=SPOONACULAR_HEADERS, params=params)
-        response_json = json.loads(response.content)
+    response = spoonacular_request("POST", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
+    g_logger.debug(f"Response from POST generate shopping list {start_date} - {end_date}: {response_json}")
+
+    if response.status_code < 400 and "aisles" in response_json:
+        APP_METRICS.incr("shopping_list.generated_weeks")
+        items = [item for aisle in response_json.get("aisles") for item in aisle.get("items")]
+        pantry_ids = [item.get("id") for item in items if item.get("id") not in listed_ids and
+                      PANTRY.contains(user_id, parse_ingredient_line(item.get("name") or "").get("key"))]
+        if pantry_ids:
+            delete_shopping_list_items(user_id, pantry_ids)
+        else:
+            write_cache(SHOPPING_LIST_CACHE, user_id, response_json)
+        return {"items_added": len(items) - len(pantry_ids)}
+
+    SHOPPING_LIST_CACHE.pop(user_id)
+    lines, missing = aggregate_meal_plan_week_ingredients(get_meal_plan_for_week(user_id, start_date))
+    if missing or not lines:
+        return {"error": response_json.get("message", "Could not generate the shopping list")}
+    APP_METRICS.incr("shopping_list.local_weeks")
+    lines = [line for line in lines if not PANTRY.contains(user_id, parse_ingredient_line(line).get("key"))]
+    return {"items_added": len(add_items_to_shopping_list(user_id, lines))}
 
-        g_logger.debug(f"Response from DEL remove item from shopping list: {response_json}")
 
-        return response_json
+# Delete item from shopping list by name - every stored line merged into that name goes
+def delete_item_from_shopping_list(user_id: str, item_name: str) -> dict:
+    g_logger.debug(f"Starting to delete {item_name} from shopping list.")
+    item_ids = get_list_item_ids_by_name(user_id, item_name)
+
+    if item_ids:
+        return delete_shopping_list_items(user_id, item_ids)
     else:
         return {
             "not_found": item_name
         }
 
 
+# Delete shopping list items by id, returning the last response
+def delete_shopping_list_items(user_id: str, item_ids: list) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
+    params = {
+        'apiKey': SPOONACULAR_API_KEY,
+        'hash': user_hash
+    }
+
+    response_json = {}
+    for item_id in item_ids:
+        url_path = f"/mealplanner/{username}/shopping-list/items/{item_id}"
+        url = f"{SPOONACULAR_BASE_URL}{url_path}"
+        response = spoonacular_request("DELETE", url, headers=SPOONACULAR_HEADERS, params=params)
+        response_json = json.loads(response.content)
+        g_logger.debug(f"Response from DEL remove item from shopping list: {response_json}")
+    SHOPPING_LIST_CACHE.pop(user_id)
+
+    return response_json
+
+
 # Empty shopping list
-def empty_shopping_list() -> dict:
+def empty_shopping_list(user_id: str) -> dict:
     g_logger.debug("Starting to empty shopping list")
     total_deleted = 0
-    list_response = list_items_in_shopping_list()
+    list_response = list_items_in_shopping_list(user_id)
     if len(list_response) > 0:
         for aisle in list_response.get("aisles"):
             for item in aisle.get("items"):
-                delete_item_from_shopping_list(item.get("name"))
+                delete_item_from_shopping_list(user_id, item.get("name"))
                 total_deleted += total_deleted
     return {
         "total_deleted": total_deleted
     }
 
 
-# Get shopping list item id from name
-def get_list_item_id_by_name(item_name: str) -> dict:
-    item_id = ""
-    current_list = list_items_in_shopping_list()
+# Get shopping list item ids from name. The list shows merged ingredient names, so every stored line of the
+# same ingredient matches
+def get_list_item_ids_by_name(user_id: str, item_name: str) -> list:
+    item_ids = []
+    ingredient_key = parse_ingredient_line(item_name).get("key")
+    current_list = list_items_in_shopping_list(user_id)
     for aisle in current_list.get("aisles"):
         for item in aisle.get("items"):
-            if item.get("name").lower() == item_name.lower():
-                item_id = item.get("id")
-                break
-    return item_id
+            if item.get("name").lower() == item_name.lower() or \
+                    ingredient_key and parse_ingredient_line(item.get("name")).get("key") == ingredient_key:
+                item_ids.append(item.get("id"))
+    return item_ids
+
+
+# Lowercase and collapse whitespace so equivalent queries share a cached page
+def normalize_search_query(query: str) -> str:
+    return " ".join(query.lower().split())
 
 
 # Search all recipes using natural language search query
-def search_all_recipes(query: str) -> dict:
+# Full recipe info comes back inline - the whole page is cached and each result goes into RECIPE_CACHE
+def search_all_recipes(query: str, offset: int = 0) -> dict:
+    cache_key = (normalize_search_query(query), offset)
+    cached_page = read_cache(RECIPE_SEARCH_CACHE, "recipe_search", cache_key)
+    if cached_page is not None:
+        return cached_page
+
     url_path = "/recipes/complexSearch"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
         'apiKey': SPOONACULAR_API_KEY,
-        'query': query
+        'query': cache_key[0],
+        'offset': offset,
+        'number': RECIPE_SEARCH_PAGE_SIZE,
+        'addRecipeInformation': True,
+        'addRecipeNutrition': True,
+        'fillIngredients': True
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
 
-    g_logger.debug(f"Response from GET recipes search: {json.loads(response.content)}")
+    g_logger.debug(f"Response from GET recipes search: {response_json}")
 
-    return json.loads(response.content)
+    for result in response_json.get("results") or []:
+        # Search results list ingredients as used + missed instead of extendedIngredients
+        if "extendedIngredients" not in result:
+            result["extendedIngredients"] = (result.get("usedIngredients") or []) + \
+                                            (result.get("missedIngredients") or [])
+        if int(result.get("id")) not in RECIPE_CACHE:
+            cache_recipe(result)
+
+    write_cache(RECIPE_SEARCH_CACHE, cache_key, response_json)
+    return response_json
+
+
+# Ranked ids of cached recipes matching a search, or None when the local index isn't confident enough
+# The ranking is cached per query so paging through results stays stable
+def search_recipes_locally(query: str) -> Optional[list]:
+    cache_key = (normalize_search_query(query), "local")
+    local_ids = read_cache(RECIPE_SEARCH_CACHE, "recipe_search", cache_key)
+    if local_ids is None:
+        # Diet / dish type words and "under N minutes" become flag filters, the rest is scored as text
+        text_query, require, max_ready_minutes = parse_recipe_filter(cache_key[0])
+        # Filter words alone ("soup", "vegan salad") leave nothing to rank by - those go to Spoonacular
+        local_ids = []
+        if text_query:
+            allowed_ids = None
+            if require or max_ready_minutes is not None:
+                allowed_ids = set(RECIPE_FLAG_INDEX.filter(require, max_ready_minutes=max_ready_minutes))
+            local_ids = [recipe_id for recipe_id, confidence in
+                         RECIPE_TEXT_INDEX.search(text_query, RECIPE_SEARCH_LOCAL_MAX_RESULTS)
+                         if confidence >= RECIPE_SEARCH_LOCAL_MIN_SCORE
+                         and get_cached_recipe(recipe_id, ("card", "ingredients")) is not None
+                         and (allowed_ids is None or recipe_id in allowed_ids)]
+        if len(local_ids) < RECIPE_SEARCH_LOCAL_MIN_RESULTS:
+            local_ids = []
+        write_cache(RECIPE_SEARCH_CACHE, cache_key, local_ids)
+
+    APP_METRICS.incr("recipe_search.local_answers" if local_ids else "recipe_search.remote_fallbacks")
+    return local_ids or None
+
+
+# Get the result at an absolute index of a search - answered locally when possible, otherwise
+# Spoonacular pages are fetched only when first needed
+def get_recipe_search_result(query: str, index: int) -> tuple:
+    local_ids = search_recipes_locally(query)
+    if local_ids is not None:
+        recipe = get_recipe_by_id(local_ids[index], ("card", "ingredients")) if index < len(local_ids) else None
+        return recipe, len(local_ids)
+
+    page_offset = index - index % RECIPE_SEARCH_PAGE_SIZE
+    search_response = search_all_recipes(query, page_offset)
+    results = search_response.get("results") or []
+    position = index - page_offset
+    recipe = results[position] if position < len(results) else None
+    return recipe, search_response.get("totalResults", 0)
 
 
 # Search all recipes by ingredients list
-def search_all_recipes_by_ingredients(ingredients: list) -> dict:
+def search_all_recipes_by_ingredients(ingredients: list, number: int = INGREDIENT_SEARCH_NUMBER) -> list:
     # Change list to comma separated string for params
     comma_sep_ingredients = ",".join(ingredients)
 
@@ -529,39 +3064,97 @@ def search_all_recipes_by_ingredients(ingredients: list) -> dict:
     params = {
         'apiKey': SPOONACULAR_API_KEY,
         'ingredients': comma_sep_ingredients,
-        'number': 5,
+        'number': number,
         'ignorePantry': True
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, stale_fallback=True, headers=SPOONACULAR_HEADERS, params=params)
 
     g_logger.debug(f"Response from GET recipes by ingredients search: {json.loads(response.content)}")
 
     return json.loads(response.content)
 
 
-# Get random recipe
-def get_random_recipe() -> dict:
+# Find recipes for a list of ingredients from the local index - Spoonacular only fills gaps in local coverage
+# Local matches have to use at least INGREDIENT_INDEX_MIN_COVERAGE of the selected ingredients, so a recipe
+# sharing one of five ingredients never stands in for Spoonacular's better matches
+# Items in the user's pantry count as on hand, so they are never reported as missing
+def find_recipes_by_ingredients(user_id: str, ingredients: list, number: int = INGREDIENT_SEARCH_NUMBER) -> list:
+    pantry_bits = PANTRY.bits(user_id)
+    selected = set(filter(None, (normalize_ingredient_name(name) for name in ingredients)))
+    min_used = max(1, math.ceil(len(selected) * INGREDIENT_INDEX_MIN_COVERAGE))
+    results = INGREDIENT_INDEX.find(ingredients, number, pantry_bits, min_used)
+    if len(results) >= min(number, INGREDIENT_INDEX_MIN_LOCAL_RESULTS):
+        APP_METRICS.incr("ingredient_index.local_answers")
+        return results
+
+    APP_METRICS.incr("ingredient_index.remote_fills")
+    remote_results = search_all_recipes_by_ingredients(ingredients, number)
+    if isinstance(remote_results, list):
+        local_ids = set(result.get("id") for result in results)
+        for result in remote_results:
+            if result.get("id") in local_ids or len(results) >= number:
+                continue
+            missed = [ingred for ingred in result.get("missedIngredients")
+                      if not pantry_bits & INGREDIENT_INDEX.ingredient_bits([ingred.get("name") or ""])]
+            result["usedIngredients"] = result.get("usedIngredients") + [
+                ingred for ingred in result.get("missedIngredients") if ingred not in missed]
+            result["missedIngredients"] = missed
+            results.append(result)
+    return results
+
+
+# Get random recipes (tags filter by diet, ex: "vegan")
+def get_random_recipe(number: int = 1, tags: str = "", timeout: float = SPOONACULAR_TIMEOUT) -> dict:
     url_path = "/recipes/random"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
-        'apiKey': SPOONACULAR_API_KEY
+        'apiKey': SPOONACULAR_API_KEY,
+        'number': number,
+        'tags': tags,
+        'includeNutrition': True
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, timeout=timeout, headers=SPOONACULAR_HEADERS, params=params)
 
     g_logger.debug(f"Response from GET random recipe: {json.loads(response.content)}")
 
     return json.loads(response.content)
 
 
+# Pull a batch of random recipes for the pool and cache each one so follow-up buttons never refetch it
+def fetch_random_recipe_batch(diet: str, timeout: float = SPOONACULAR_TIMEOUT) -> list:
+    recipes = get_random_recipe(RANDOM_RECIPE_BATCH_SIZE, diet, timeout).get("recipes") or []
+    for recipe in recipes:
+        cache_recipe(recipe)
+    return recipes
+
+
+# Random cached recipe matching a diet for when the pool can't be refilled, or None when the diet is unknown or
+# nothing matches
+def pick_cached_random_recipe(diet: str) -> Optional[dict]:
+    _, require, _ = parse_recipe_filter(diet)
+    if diet and not require:
+        return None
+    recipes = [recipe for recipe in (get_cached_recipe(recipe_id, RANDOM_RECIPE_FIELDS)
+                                     for recipe_id in RECIPE_FLAG_INDEX.filter(require)) if recipe is not None]
+    return random.choice(recipes) if recipes else None
+
+
+RANDOM_RECIPE_POOL = RandomRecipePool(fetch_random_recipe_batch, RANDOM_RECIPE_LOW_WATER, SPOONACULAR_TIMEOUT,
+                                      pick_cached_random_recipe)
+
+
 # GET user's existing meal plan for a specific WEEK
 # Start date must be in the format yyyy-mm-dd
-def get_meal_plan_for_week(start_date: str) -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def get_meal_plan_for_week(user_id: str, start_date: str) -> dict:
+    cached_week = read_cache(MEAL_PLAN_WEEK_CACHE, "meal_plan_week", (user_id, start_date))
+    if cached_week is not None:
+        return cached_week
+
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/week/{start_date}"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -569,20 +3162,29 @@ def get_meal_plan_for_week(start_date: str) -> dict:
         'hash': user_hash
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = select_json_paths(json.loads(response.content), MEAL_PLAN_WEEK_RESPONSE_PATHS)
+    if response.status_code >= 500:
+        response_json = read_stale_cache(MEAL_PLAN_WEEK_CACHE, "meal_plan_week", (user_id, start_date)) or \
+            response_json
+    response_json.setdefault("days", [])  # error payloads render as an empty week
 
-    g_logger.debug(f"Response from GET meal plan for the week: {json.loads(response.content)}")
+    g_logger.debug(f"Response from GET meal plan for the week: {response_json}")
 
-    return json.loads(response.content)
+    write_cache(MEAL_PLAN_WEEK_CACHE, (user_id, start_date), response_json)
+    return response_json
 
 
 # GET user's existing meal plan for a specific DAY
 # Start date must be in the format yyyy-mm-dd
-def get_meal_plan_for_day(date: str) -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def get_meal_plan_for_day(user_id: str, date: str) -> dict:
+    cached_day = read_cache(MEAL_PLAN_DAY_CACHE, "meal_plan_day", (user_id, date))
+    if cached_day is not None:
+        return cached_day
+
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/day/{date}"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -590,15 +3192,35 @@ def get_meal_plan_for_day(date: str) -> dict:
         'hash': user_hash
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
+    if response.status_code >= 500:
+        response_json = read_stale_cache(MEAL_PLAN_DAY_CACHE, "meal_plan_day", (user_id, date)) or response_json
 
-    g_logger.debug(f"Response from GET meal plan for the day: {json.loads(response.content)}")
+    g_logger.debug(f"Response from GET meal plan for the day: {response_json}")
 
-    return json.loads(response.content)
+    write_cache(MEAL_PLAN_DAY_CACHE, (user_id, date), response_json)
+    return response_json
 
 
-# Generate meal plan
-def generate_meal_plan(time_frame: str, target_calories: int, diet: str, exclude: str) -> dict:
+# Generate meal plan (served from MEAL_PLAN_CACHE unless force_refresh is set)
+def generate_meal_plan(time_frame: str, target_calories: int, diet: str, exclude: str,
+                       force_refresh: bool = False) -> dict:
+    cache_key = (time_frame, int(target_calories), diet or "", exclude or "")
+    if not force_refresh:
+        cached_plan = MEAL_PLAN_CACHE.get(cache_key)
+        g_logger.debug(f"Meal plan cache stats: {MEAL_PLAN_CACHE.stats()}")
+        if cached_plan is not None:
+            return cached_plan
+
+    if MEAL_PLAN_LOCAL_GENERATOR:
+        local_plan = generate_local_meal_plan(time_frame, target_calories, diet, exclude)
+        if local_plan is not None:
+            APP_METRICS.incr("meal_plan.local_plans")
+            write_cache(MEAL_PLAN_CACHE, cache_key, local_plan)
+            return local_plan
+    APP_METRICS.incr("meal_plan.remote_plans")
+
     url_path = "/mealplanner/generate"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -609,19 +3231,149 @@ def generate_meal_plan(time_frame: str, target_calories: int, diet: str, exclude
         'exclude': exclude
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
 
-    g_logger.debug(f"Response from Generate meal plan: {json.loads(response.content)}")
+    g_logger.debug(f"Response from Generate meal plan: {response_json}")
 
-    return json.loads(response.content)
+    # Only cache real plans, never error payloads
+    if response_json.get("meals") or response_json.get("week"):
+        write_cache(MEAL_PLAN_CACHE, cache_key, response_json)
+
+    return response_json
+
+
+MEAL_PLAN_WEEK_DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# Dish types that can fill breakfast, lunch and dinner - recipes flagged with none of them can fill any slot
+MEAL_PLAN_SLOT_FLAGS = [["breakfast"], ["lunch", "main course", "salad", "soup"], ["dinner", "main course"]]
+MEAL_PLAN_NON_MEAL_FLAGS = ["dessert", "beverage", "sauce"]
+
+
+# Weighted squared relative error of a day's (calories, protein, fat, carbs) against the targets
+# Targets of 0 or less have no relative error and are left out
+def score_meal_plan_day(totals: list, targets: list) -> float:
+    return sum(weight * ((total - target) / target) ** 2
+               for weight, total, target in zip((1.0, 0.5, 0.5, 0.5), totals, targets) if target > 0)
+
+
+# Meal plan shaped like /mealplanner/generate, picked from cached recipes - None when the cache can't cover it or
+# there is no calorie target to aim for
+# Each slot keeps the recipes closest to its share of the calories, a greedy pick seeds every day and a couple of
+# local search passes swap single meals while that lowers the day's calorie / macro error. No recipe repeats.
+def generate_local_meal_plan(time_frame: str, target_calories: int, diet: str, exclude: str,
+                             rng: random.Random = random) -> Optional[dict]:
+    started = time.perf_counter()
+    total_days = 7 if time_frame.lower() == "week" else 1
+    _, require, _ = parse_recipe_filter(diet or "")
+    if (diet and not require) or float(target_calories) <= 0:
+        return None
+
+    non_meal_mask = sum(RECIPE_FLAG_BITS[flag] for flag in MEAL_PLAN_NON_MEAL_FLAGS)
+    candidate_ids = [recipe_id for recipe_id in RECIPE_FLAG_INDEX.filter(require, non_meal_mask)
+                     if get_cached_recipe(recipe_id, ("card", "nutrition")) is not None]
+    if exclude:
+        excluded_ids = INGREDIENT_INDEX.recipe_ids_with([name.strip() for name in exclude.split(",")])
+        candidate_ids = [recipe_id for recipe_id in candidate_ids if recipe_id not in excluded_ids]
+    candidates = RECIPE_NUTRIENT_TABLE.rows(candidate_ids)
+    if len(candidates) < 3 * total_days:
+        return None
+
+    target_calories = float(target_calories)
+    targets = [target_calories] + [target_calories * share / 100 / kcal_per_gram
+                                   for share, kcal_per_gram in zip(MEAL_PLAN_MACRO_SPLIT, (4, 9, 4))]
+    any_slot_mask = sum(RECIPE_FLAG_BITS[flag] for flags in MEAL_PLAN_SLOT_FLAGS for flag in flags)
+    slot_pools = []
+    for flags, share in zip(MEAL_PLAN_SLOT_FLAGS, MEAL_PLAN_SLOT_SPLIT):
+        slot_mask = sum(RECIPE_FLAG_BITS[flag] for flag in flags)
+        slot_calories = target_calories * share / 100
+        pool = [row for row in candidates if (RECIPE_FLAG_INDEX.mask(row[0]) or 0) & slot_mask or
+                not (RECIPE_FLAG_INDEX.mask(row[0]) or 0) & any_slot_mask]
+        if len(pool) < total_days:
+            pool = candidates
+        # Jitter keeps regenerated plans from always landing on the same recipes
+        slot_pools.append(heapq.nsmallest(MEAL_PLAN_LOCAL_POOL_SIZE, pool,
+                                          key=lambda row: abs(row[1] - slot_calories) * rng.uniform(1, 1.5)))
+
+    used_ids = set()
+    week = {}
+    for day in MEAL_PLAN_WEEK_DAYS[:total_days]:
+        picks = []
+        for pool in slot_pools:
+            pick = next((row for row in pool if row[0] not in used_ids and row not in picks), None)
+            if pick is None:
+                return None
+            picks.append(pick)
+
+        for _ in range(2):
+            improved = False
+            for slot, pool in enumerate(slot_pools):
+                others = [row for position, row in enumerate(picks) if position != slot]
+                other_totals = [sum(row[macro] for row in others) for macro in range(1, 5)]
+                best_score = score_meal_plan_day([total + picks[slot][macro + 1]
+                                                  for macro, total in enumerate(other_totals)], targets)
+                for row in pool:
+                    if row[0] in used_ids or row in others:
+                        continue
+                    row_score = score_meal_plan_day([total + row[macro + 1]
+                                                     for macro, total in enumerate(other_totals)], targets)
+                    if row_score < best_score:
+                        best_score, picks[slot], improved = row_score, row, True
+            if not improved:
+                break
+
+        used_ids.update(row[0] for row in picks)
+        meals = []
+        for row in picks:
+            recipe = get_cached_recipe(row[0], ("card",)) or {}
+            meals.append({
+                "id": row[0],
+                "imageType": recipe.get("imageType"),
+                "title": recipe.get("title"),
+                "readyInMinutes": recipe.get("readyInMinutes"),
+                "servings": recipe.get("servings"),
+                "sourceUrl": recipe.get("sourceUrl")
+            })
+        week[day] = {
+            "meals": meals,
+            "nutrients": {name: round(sum(row[macro] for row in picks), 2) for macro, name in
+                          enumerate(["calories", "protein", "fat", "carbohydrates"], start=1)}
+        }
+
+    APP_METRICS.observe("meal_plan.local_generate_seconds", time.perf_counter() - started)
+    return {"week": week} if total_days > 1 else week["monday"]
+
+
+# Generate and cache any preset meal plan that is not already cached, stopping once max_seconds have passed
+# With local_only, presets the local generator can't cover are skipped rather than generated by Spoonacular
+def prewarm_meal_plan_cache(presets: str = MEAL_PLAN_PRESETS, max_seconds: Optional[float] = None,
+                            local_only: bool = False) -> int:
+    started = time.monotonic()
+    total_warmed = 0
+    for preset in filter(None, presets.split(";")):
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+        time_frame, target_calories, diet = preset.split(":")
+        cache_key = (time_frame, int(target_calories), diet, "")
+        if cache_key in MEAL_PLAN_CACHE:
+            continue
+        if local_only:
+            local_plan = generate_local_meal_plan(time_frame, int(target_calories), diet, "") \
+                if MEAL_PLAN_LOCAL_GENERATOR else None
+            if local_plan is None:
+                continue
+            write_cache(MEAL_PLAN_CACHE, cache_key, local_plan)
+        else:
+            generate_meal_plan(time_frame, int(target_calories), diet, "", force_refresh=True)
+        total_warmed += 1
+    g_logger.debug(f"Pre-warmed {total_warmed} meal plans. Cache stats: {MEAL_PLAN_CACHE.stats()}")
+    return total_warmed
 
 
 # Add a single item to the user's meal plan
-def add_item_to_meal_plan(item_type: str, date: int, slot: int, position: int) -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def add_item_to_meal_plan(user_id: str, item_type: str, date: int, slot: int, position: int) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/items"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -641,7 +3393,8 @@ def add_item_to_meal_plan(item_type: str, date: int, slot: int, position: int) -
         }
     }
 
-    response = requests.post(url=url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("POST", url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    invalidate_meal_plan_caches(user_id)
 
     g_logger.debug(f"Response from POST item to meal plan: {json.loads(response.content)}")
 
@@ -649,11 +3402,10 @@ def add_item_to_meal_plan(item_type: str, date: int, slot: int, position: int) -
 
 
 # Add multiple meals/recipes to the user's meal plan on a single day
-def add_daily_meal_plan_to_calendar_day(selected_date: str, item_type: str, meals_list: list) -> dict:
-    global USER_INFO
-    # load_user_info("nick_test")
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def add_daily_meal_plan_to_calendar_day(user_id: str, selected_date: str, item_type: str, meals_list: list) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/items"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -681,18 +3433,80 @@ def add_daily_meal_plan_to_calendar_day(selected_date: str, item_type: str, meal
         slot += 1
 
     g_logger.debug(f"Attempting to POST payload {payload} to meal planner...")
-    response = requests.post(url=url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("POST", url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    invalidate_meal_plan_caches(user_id)
 
     g_logger.debug(f"Response from POST items to meal plan for date {selected_date}: {json.loads(response.content)}")
 
     return json.loads(response.content)
 
 
+# Add a generated week (one list of meals per day, monday first) to the calendar from selected_date onwards
+# All items go up in a single POST, then land in the cached week views instead of invalidating them
+def add_weekly_meal_plan_to_calendar(user_id: str, selected_date: str, item_type: str, week_meals: list) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
+    url_path = f"/mealplanner/{username}/items"
+    url = f"{SPOONACULAR_BASE_URL}{url_path}"
+    params = {
+        'apiKey': SPOONACULAR_API_KEY,
+        'hash': user_hash
+    }
+    payload = []
+
+    start_date = datetime.datetime.strptime(selected_date, "%Y-%m-%d")
+    for day_offset, meals_list in enumerate(week_meals):
+        timestamp = datetime.datetime.timestamp(start_date + datetime.timedelta(days=day_offset))
+        for slot, meal in enumerate(meals_list, start=1):
+            payload.append(
+                {
+                    "type": item_type,
+                    "date": timestamp,
+                    "slot": slot,
+                    "position": 1,
+                    "value": meal
+                }
+            )
+
+    g_logger.debug(f"Attempting to POST {len(payload)} items to meal planner starting {selected_date}...")
+    response = spoonacular_request("POST", url, json=payload, headers=SPOONACULAR_HEADERS, params=params)
+    response_json = json.loads(response.content)
+    if response_json.get("status") == "success":
+        add_items_to_cached_meal_plan_weeks(user_id, payload)
+    else:
+        invalidate_meal_plan_caches(user_id)
+
+    g_logger.debug(f"Response from POST week of items to meal plan from {selected_date}: {response_json}")
+
+    return response_json
+
+
+# Write newly added items into whichever cached week views they fall in, so the calendar renders without a refetch
+# The POST response has no item ids, so the cached day views (whose delete buttons need them) are dropped instead
+def add_items_to_cached_meal_plan_weeks(user_id: str, items: list):
+    for item in items:
+        day = datetime.datetime.fromtimestamp(item.get("date"))
+        MEAL_PLAN_DAY_CACHE.pop((user_id, day.strftime("%Y-%m-%d")))
+        meal_plan_week = MEAL_PLAN_WEEK_CACHE.get((user_id, get_start_of_week(day).strftime("%Y-%m-%d")))
+        if meal_plan_week is None:
+            continue
+
+        days = meal_plan_week.setdefault("days", [])
+        day_name = day.strftime("%A")
+        week_day = next((week_day for week_day in days if week_day.get("day") == day_name), None)
+        if week_day is None:
+            week_day = {"day": day_name, "date": item.get("date"), "items": []}
+            days.append(week_day)
+            days.sort(key=lambda week_day: week_day.get("date") or 0)
+        week_day.setdefault("items", []).append(dict(item, id=None))
+
+
 # DELETE item from user's meal plan
-def delete_item_from_meal_plan(item_id: int) -> dict:
-    global USER_INFO
-    username = USER_INFO["username"]
-    user_hash = USER_INFO["hash"]
+def delete_item_from_meal_plan(user_id: str, item_id: int) -> dict:
+    account = ACCOUNT_STORE.get(user_id)
+    username = account["username"]
+    user_hash = account["hash"]
     url_path = f"/mealplanner/{username}/items/{item_id}"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
@@ -700,8 +3514,9 @@ def delete_item_from_meal_plan(item_id: int) -> dict:
         'hash': user_hash
     }
 
-    response = requests.delete(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("DELETE", url, headers=SPOONACULAR_HEADERS, params=params)
     response_json = json.loads(response.content)
+    invalidate_meal_plan_caches(user_id)
 
     g_logger.debug(f"Response from DEL remove item from meal plan: {response_json}")
 
@@ -719,7 +3534,7 @@ def search_all_ingredients(query: str) -> dict:
         'number': 20
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, stale_fallback=True, headers=SPOONACULAR_HEADERS, params=params)
 
     g_logger.debug(f"Response from Search all ingredients: {json.loads(response.content)}")
 
@@ -736,58 +3551,163 @@ def talk_to_spoon_bot(text: str) -> dict:
         "contextId": SPOON_BOT_CONVO_CONTEXT_ID
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
 
     g_logger.debug(f"Response from Talk to Spoonacular bot: {json.loads(response.content)}")
 
     return json.loads(response.content)
 
 
-# GET ingredient details by id
-def get_ingredient_info_by_id(ingred_id: str) -> dict:
+# GET ingredient details by id for an amount / unit straight from Spoonacular
+def fetch_ingredient_info(ingred_id: int, amount: float, unit: str) -> dict:
     url_path = f"/food/ingredients/{ingred_id}/information"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
         'apiKey': SPOONACULAR_API_KEY,
-        'amount': 1
+        'amount': amount
     }
+    if unit:
+        params['unit'] = unit
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
 
-    g_logger.debug(f"Response from GET ingredient details: {json.loads(response.content)}")
+    response_json = json.loads(response.content)
 
-    return json.loads(response.content)
+    g_logger.debug(f"Response from GET ingredient details: {response_json}")
+
+    return response_json
+
+
+INGREDIENT_INFO_STORE = IngredientInfoStore(INGREDIENT_INFO_DB_PATH, INGREDIENT_INFO_CACHE, fetch_ingredient_info,
+                                            INGREDIENT_INFO_MAX_AGE)
+
+
+# GET ingredient details by id (amount=1) - persisted, with nutrition in compact form
+def get_ingredient_info_by_id(ingred_id: str) -> dict:
+    return INGREDIENT_INFO_STORE.get(ingred_id)
 
 
-# GET recipe details by id
-def get_recipe_by_id(recipe_id: str) -> dict:
+# Ingredient details for any amount / unit, ex: (9266, 3, "cups") or (9266, 200, "g")
+# Nutrients are the cached amount=1 values scaled locally by weight
+def get_ingredient_info_for_amount(ingred_id: str, amount: float, unit: str = "") -> dict:
+    ingredient = get_ingredient_info_by_id(ingred_id)
+    nutrition = ingredient.get("nutrition")
+    if not nutrition:
+        return ingredient
+
+    base_unit = ingredient.get("unit") or ""
+    if normalize_ingredient_name(unit) == normalize_ingredient_name(base_unit):
+        factor = float(amount)
+    else:
+        base_weight = nutrition.get("weightPerServing") or {}
+        unit_grams = INGREDIENT_INFO_STORE.unit_grams(ingred_id, unit)
+        if unit_grams is None or base_weight.get("unit") != "g" or not base_weight.get("amount"):
+            g_logger.error(f"Can't scale ingredient {ingred_id} to unit '{unit}'")
+            return ingredient
+        factor = float(amount) * unit_grams / float(base_weight.get("amount"))
+
+    scaled_nutrition = dict(nutrition)
+    # Properties (glycemic index...) don't scale with amount
+    for key in ("nutrients", "flavonoids"):
+        if key in scaled_nutrition:
+            scaled_nutrition[key] = CompactNutrients.of(scaled_nutrition[key]).scaled(factor)
+    if nutrition.get("weightPerServing"):
+        scaled_nutrition["weightPerServing"] = dict(nutrition.get("weightPerServing"),
+                                                    amount=round(nutrition["weightPerServing"]["amount"] * factor, 2))
+    return dict(ingredient, amount=amount, unit=unit, nutrition=scaled_nutrition)
+
+
+RECIPE_IMAGE_TYPES = {"jpg", "jpeg", "png", "gif"}
+RECIPE_IMAGE_SIZES = {"90x90", "240x150", "312x150", "312x231", "480x360", "556x370", "636x393"}
+# Resolved image urls for recipes whose image type wasn't known - (recipe id, size) -> url
+RECIPE_IMAGE_URL_CACHE = TTLCache(int(os.environ.get("RECIPE_IMAGE_URL_CACHE_MAX_SIZE", 5000)), RECIPE_CACHE_TTL)
+
+
+# Image url for a recipe from its id and image type, without a recipe lookup
+# Unknown types are resolved once (cached recipe, then a HEAD on the guessed jpg url, then a full fetch) and cached
+def get_recipe_image_url(recipe_id, image_type: Optional[str] = None, size: str = RECIPE_IMAGE_SIZE) -> str:
+    size = size if size in RECIPE_IMAGE_SIZES else RECIPE_IMAGE_SIZE
+    if image_type and image_type.lower() in RECIPE_IMAGE_TYPES:
+        return f"{RECIPE_IMAGE_BASE_URL}/{recipe_id}-{size}.{image_type.lower()}"
+
+    cached_url = RECIPE_IMAGE_URL_CACHE.get((int(recipe_id), size))
+    if cached_url is not None:
+        return cached_url
+
+    recipe = get_cached_recipe(recipe_id, ("card",))
+    if recipe and recipe.get("imageType"):
+        image_url = f"{RECIPE_IMAGE_BASE_URL}/{recipe_id}-{size}.{recipe.get('imageType')}"
+    else:
+        image_url = f"{RECIPE_IMAGE_BASE_URL}/{recipe_id}-{size}.jpg"
+        # Image hosts may redirect to a CDN, any 2xx at the end of the chain means the guess was right
+        found = 200 <= spoonacular_request("HEAD", image_url, allow_redirects=True).status_code < 300
+        if not found:
+            APP_METRICS.incr("recipe_image.fetch_fallbacks")
+            image_url = get_recipe_by_id(str(recipe_id), ("card",)).get("image") or EMPTY_DINNER_PLATE_IMG
+    RECIPE_IMAGE_URL_CACHE.set((int(recipe_id), size), image_url)
+    return image_url
+
+
+# GET recipe details by id - `fields` lists the RECIPE_FIELD_GROUPS the caller reads
+# Without "nutrition" the light payload is fetched, and a cached full recipe serves light requests as well
+def get_recipe_by_id(recipe_id: str, fields: tuple = RECIPE_ALL_FIELD_GROUPS) -> dict:
+    full = "nutrition" in fields
+    cached_recipe = read_cache(RECIPE_CACHE, "recipe", int(recipe_id))
+    if cached_recipe is not None:
+        return cached_recipe
+    if not full:
+        cached_recipe = read_cache(RECIPE_LIGHT_CACHE, "recipe_light", int(recipe_id))
+        if cached_recipe is not None:
+            return cached_recipe
+
     url_path = f"/recipes/{recipe_id}/information"
     url = f"{SPOONACULAR_BASE_URL}{url_path}"
     params = {
         'apiKey': SPOONACULAR_API_KEY,
         "id": recipe_id,
-        "includeNutrition": True
+        "includeNutrition": full
     }
 
-    response = requests.get(url=url, headers=SPOONACULAR_HEADERS, params=params)
+    tier = "full" if full else "light"
+    response = spoonacular_request("GET", url, headers=SPOONACULAR_HEADERS, params=params)
+    APP_METRICS.incr(f"recipe_fetch.{tier}.bytes", len(response.content))
+    started = time.perf_counter()
+    response_json = json.loads(response.content)
+    APP_METRICS.observe(f"recipe_fetch.{tier}.decode_seconds", time.perf_counter() - started)
+
+    g_logger.debug(f"Response from GET recipe details by id ({tier}): {response_json}")
 
-    g_logger.debug(f"Response from GET recipe details by id: {json.loads(response.content)}")
+    if response_json.get("status") != "failure":
+        if full:
+            cache_recipe(response_json)
+        else:
+            response_json = cache_light_recipe(response_json)
+    return response_json
 
-    return json.loads(response.content)
+
+# Ingredient lines of a recipe the user doesn't have - neither among the ingredients they searched with nor in
+# their pantry
+def get_missing_recipe_ingredients(user_id: str, recipe_id, have: list) -> list:
+    recipe = get_recipe_by_id(str(recipe_id), ("ingredients",))
+    have_bits = PANTRY.bits(user_id) | INGREDIENT_INDEX.ingredient_bits(have)
+    missing = []
+    for ingred in recipe.get("extendedIngredients") or []:
+        name = ingred.get("nameClean") or ingred.get("name") or ""
+        if not have_bits & INGREDIENT_INDEX.ingredient_bits([name]):
+            missing.append(ingred.get("original") or name)
+    return missing
 
 
 # Add all ingredients from a recipe to the shopping list
-def add_recipe_ingredients_to_shop_list(recipe_id: str) -> dict:
-    recipe_response = get_recipe_by_id(recipe_id)
-    items_added = []
-    total_added = 0
-    extended_ingredients = recipe_response.get("extendedIngredients")
+def add_recipe_ingredients_to_shop_list(user_id: str, recipe_id: str) -> dict:
+    recipe_response = get_recipe_by_id(recipe_id, ("ingredients",))
+    items_to_add = []
+    extended_ingredients = recipe_response.get("extendedIngredients") or []
     for ingred in extended_ingredients:
         name = ingred.get("nameClean") if ingred.get("nameClean") else ingred.get("name")
-        item_to_add = f"{ingred.get('amount')} {ingred.get('unit')} {name}"
-        add_item_to_shopping_list(item_to_add, True)
-        items_added.append(item_to_add)
-        total_added = total_added + 1
+        items_to_add.append(f"{ingred.get('amount')} {ingred.get('unit')} {name}")
+    items_added = add_items_to_shopping_list(user_id, items_to_add)
+    total_added = len(items_added)
 
     return {
         "recipe_id": recipe_id,
@@ -796,6 +3716,100 @@ def add_recipe_ingredients_to_shop_list(recipe_id: str) -> dict:
     }
 
 
+# Nutrient totals for meal plan items - each recipe's per-serving vector scaled by the planned servings
+# Only recipes already in the nutrient table count, items without one are reported as missing
+def sum_meal_plan_item_nutrients(items: list) -> tuple:
+    totals = [0.0] * len(NUTRIENT_VECTOR_NAMES)
+    missing = 0
+    for item in items:
+        value = item.get("value") or {}
+        vector = RECIPE_NUTRIENT_TABLE.vector(value.get("id")) if value.get("id") is not None else None
+        if vector is None:
+            missing += 1
+            continue
+        servings = float(value.get("servings") or 1)
+        totals = [total + amount * servings for total, amount in zip(totals, vector)]
+    return totals, missing
+
+
+def get_percent_daily_values(totals: list, days: int = 1) -> list:
+    return [total / (daily_value * days) * 100 for total, daily_value in zip(totals, NUTRIENT_DAILY_VALUES)]
+
+
+# Daily, weekly and daily-average nutrient totals with %DV for a GET meal plan week response
+def compute_meal_plan_week_rollup(meal_plan_week: dict) -> dict:
+    rollup = {"days": {}}
+    week_totals = [0.0] * len(NUTRIENT_VECTOR_NAMES)
+    planned_days = 0
+    for day in meal_plan_week.get("days") or []:
+        totals, missing = sum_meal_plan_item_nutrients(day.get("items") or [])
+        rollup["days"][day.get("day")] = {
+            "totals": totals,
+            "percent_dv": get_percent_daily_values(totals),
+            "meals": len(day.get("items") or []),
+            "missing": missing
+        }
+        if day.get("items"):
+            planned_days += 1
+            week_totals = [week_total + total for week_total, total in zip(week_totals, totals)]
+
+    daily_average = [total / planned_days for total in week_totals] if planned_days else week_totals
+    rollup["week"] = {
+        "totals": week_totals,
+        "daily_average": daily_average,
+        "percent_dv": get_percent_daily_values(daily_average),
+        "planned_days": planned_days
+    }
+    return rollup
+
+
+# One line nutrient summary, ex: "*1982 kcal* (99%) | Protein 98g (196%) | Fat 60g (77%) | Carbs 230g (84%)"
+def format_nutrient_rollup(totals: list, percent_dv: list, nutrient_count: int = 4) -> str:
+    parts = [f"*{totals[0]:.0f} kcal* ({percent_dv[0]:.0f}%)"]
+    for position in range(1, nutrient_count):
+        name = "Carbs" if NUTRIENT_VECTOR_NAMES[position] == "Carbohydrates" else NUTRIENT_VECTOR_NAMES[position]
+        parts.append(f"{name} {totals[position]:.0f}{NUTRIENT_VECTOR_UNITS[position]} ({percent_dv[position]:.0f}%)")
+    return " | ".join(parts)
+
+
+# Context block with a day's nutrition rollup for the meal plan calendar
+def create_meal_plan_day_rollup_block(week_rollup: dict, day_name: str) -> dict:
+    day_rollup = week_rollup.get("days").get(day_name)
+    if not day_rollup or not day_rollup.get("meals"):
+        text = "_No meals planned_"
+    elif day_rollup.get("missing") == day_rollup.get("meals"):
+        text = "_Nutrition info not loaded yet_"
+    else:
+        text = format_nutrient_rollup(day_rollup.get("totals"), day_rollup.get("percent_dv"))
+        if day_rollup.get("missing"):
+            text += f" _({day_rollup.get('missing')} meals without nutrition info)_"
+    return {
+        "type": "context",
+        "elements": [
+            {
+                "type": "mrkdwn",
+                "text": text
+            }
+        ]
+    }
+
+
+# Section with the week's nutrient totals and daily average (%DV) for the meal plan calendar
+def create_meal_plan_week_rollup_block(week_rollup: dict) -> dict:
+    week = week_rollup.get("week")
+    nutrient_count = len(NUTRIENT_VECTOR_NAMES)
+    week_totals = ", ".join(f"{name} {total:.0f}{unit}" for name, total, unit in
+                            zip(NUTRIENT_VECTOR_NAMES, week.get("totals"), NUTRIENT_VECTOR_UNITS))
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"*Week Totals*: {week_totals}\n*Daily Average* ({week.get('planned_days')} planned days): "
+                    f"{format_nutrient_rollup(week.get('daily_average'), week.get('percent_dv'), nutrient_count)}"
+        }
+    }
+
+
 # Take response from GET meal plan week and restructure / simplify and enrich with img details
 def convert_meal_plan_week_to_detailed_week(meal_plan_week: dict) -> dict:
     response = {}
@@ -825,7 +3839,7 @@ def convert_meal_plan_week_to_detailed_week(meal_plan_week: dict) -> dict:
             recipe_id = item.get("value").get("id")
             servings = item.get("value").get("servings")
             title = item.get("value").get("title")
-            img_url = get_recipe_by_id(str(recipe_id)).get("image")
+            img_url = get_recipe_image_url(recipe_id, item.get("value").get("imageType"))
 
             if slot == 1:
                 day_detail['breakfast']['title'] = title
@@ -844,6 +3858,149 @@ def convert_meal_plan_week_to_detailed_week(meal_plan_week: dict) -> dict:
     return response
 
 
+# -- Prefetch targets --
+# Each warms one cache and spends one budget call per Spoonacular request it makes
+
+
+def prefetch_shopping_list(user_id: str):
+    if user_id not in SHOPPING_LIST_CACHE and PREFETCHER.spend(user_id):
+        list_items_in_shopping_list(user_id)
+        PREFETCHER.mark("shopping_list", user_id, user_id)
+
+
+def prefetch_meal_plan_week(user_id: str):
+    start_date = get_start_of_week(get_adjusted_now()).strftime("%Y-%m-%d")
+    if (user_id, start_date) not in MEAL_PLAN_WEEK_CACHE and PREFETCHER.spend(user_id):
+        get_meal_plan_for_week(user_id, start_date)
+        PREFETCHER.mark("meal_plan_week", (user_id, start_date), user_id)
+
+
+# Recipes shown on the calendar (and on any day opened via mp_view_day)
+def prefetch_meal_plan_recipes(user_id: str):
+    start_date = get_start_of_week(get_adjusted_now()).strftime("%Y-%m-%d")
+    meal_plan_week = MEAL_PLAN_WEEK_CACHE.get((user_id, start_date)) or {}
+    for day in meal_plan_week.get("days", []):
+        for item in day.get("items", []):
+            recipe_id = int(item.get("value").get("id"))
+            if get_cached_recipe(recipe_id, MEAL_PLAN_DETAIL_RECIPE_FIELDS) is not None:
+                continue
+            if not PREFETCHER.spend(user_id):
+                return
+            get_recipe_by_id(str(recipe_id), MEAL_PLAN_DETAIL_RECIPE_FIELDS)
+            PREFETCHER.mark("recipe", recipe_id, user_id)
+
+
+def prefetch_meal_plan_today(user_id: str):
+    date = get_adjusted_now().strftime("%Y-%m-%d")
+    if (user_id, date) not in MEAL_PLAN_DAY_CACHE and PREFETCHER.spend(user_id):
+        get_meal_plan_for_day(user_id, date)
+        PREFETCHER.mark("meal_plan_day", (user_id, date), user_id)
+
+
+PREFETCHER.register("shopping_list", prefetch_shopping_list)
+PREFETCHER.register("meal_plan_week", prefetch_meal_plan_week)
+PREFETCHER.register("meal_plan_recipes", prefetch_meal_plan_recipes)
+PREFETCHER.register("meal_plan_today", prefetch_meal_plan_today)
+
+
+# # # # # # # # # # # # # # # # # #
+# #         MIDDLEWARE          # #
+# # # # # # # # # # # # # # # # # #
+
+
+# Events are keyed by event_id, commands / interactions by trigger_id
+def get_idempotency_key(body: dict) -> Optional[str]:
+    if body.get("event_id"):
+        return f"event:{body.get('event_id')}"
+    if body.get("trigger_id"):
+        return f"trigger:{body.get('trigger_id')}"
+    return None
+
+
+# Suppress Slack retries (and any other duplicate delivery) of requests already in flight or completed
+@app.middleware
+def suppress_duplicate_requests(req, body, next):
+    IDEMPOTENCY_CURRENT.key = None
+    key = get_idempotency_key(body)
+
+    # Lazy listener invocations re-send the original request on purpose
+    if key is None or req.lazy_only:
+        return next()
+
+    retry_num = req.headers.get("x-slack-retry-num", [None])[0]
+    retry_reason = req.headers.get("x-slack-retry-reason", [None])[0]
+    if retry_num:
+        APP_METRICS.incr("idempotency.retries_received")
+        APP_METRICS.incr(f"idempotency.retry_reason.{retry_reason}")
+
+    # A timed out request is still running somewhere - on Lambda usually in another container, whose claim this
+    # container's store can't see - so its retries are acked and dropped outright
+    if retry_reason == "http_timeout":
+        APP_METRICS.incr("idempotency.duplicates_suppressed")
+        APP_METRICS.incr("idempotency.duplicates_suppressed.http_timeout")
+        g_logger.debug(f"Dropped retry #{retry_num} of timed out request {key}")
+        return BoltResponse(status=200, body="")
+
+    existing_state = IDEMPOTENCY_STORE.claim(key, IDEMPOTENCY_IN_FLIGHT_TTL)
+    if existing_state is not None:
+        APP_METRICS.incr("idempotency.duplicates_suppressed")
+        APP_METRICS.incr(f"idempotency.duplicates_suppressed.{existing_state}")
+        g_logger.debug(f"Suppressed duplicate request {key} ({existing_state}, retry #{retry_num} {retry_reason})")
+        return BoltResponse(status=200, body="")
+
+    IDEMPOTENCY_CURRENT.key = key
+    return next()
+
+
+# Mark the claimed request as completed, or release it on failure so Slack's retry can run it again
+def finish_idempotent_request(status: int):
+    key = getattr(IDEMPOTENCY_CURRENT, "key", None)
+    if key is None:
+        return
+    IDEMPOTENCY_CURRENT.key = None
+    if status >= 500:
+        IDEMPOTENCY_STORE.release(key)
+    else:
+        IDEMPOTENCY_STORE.complete(key, IDEMPOTENCY_COMPLETED_TTL)
+
+
+# Slack user id of an interaction body, slash command or event payload
+def get_request_user_id(payload: dict) -> Optional[str]:
+    user = payload.get("user") or (payload.get("event") or {}).get("user")
+    if isinstance(user, dict):
+        return user.get("id")
+    return user or payload.get("user_id")
+
+
+# Tell the user in their DM with the app that their Spoonacular account isn't available
+def notify_account_error(client, user_id: Optional[str]):
+    if user_id:
+        client.chat_postMessage(channel=user_id, text=SAY_ACCOUNT_UNAVAILABLE)
+
+
+# Unhandled listener errors - account errors are reported to the user, anything else is logged as Bolt would
+@app.error
+def handle_listener_error(error, body, client, logger):
+    if isinstance(error, SpoonacularAccountError):
+        g_logger.error(f"{error}")
+        notify_account_error(client, get_request_user_id(body))
+        return
+    logger.exception(f"Failed to run listener function (error: {error})")
+
+
+# Lazy listeners run outside the error handler above, so they report account errors themselves
+def report_account_errors(func):
+    @functools.wraps(func)
+    def lazy_wrapper(**kwargs):
+        try:
+            return func(**kwargs)
+        except SpoonacularAccountError as e:
+            g_logger.error(f"{e}")
+            notify_account_error(app.client, get_request_user_id(
+                kwargs.get("body") or kwargs.get("command") or kwargs.get("event") or {}))
+    return lazy_wrapper
+
+
 # # # # # # # # # # # # # # # # # #
 # #    LISTENING TO EVENTS      # #
 # # # # # # # # # # # # # # # # # #
@@ -853,13 +4010,11 @@ def convert_meal_plan_week_to_detailed_week(meal_plan_week: dict) -> dict:
 def publish_main_home_view(client, user):
     try:
         # Get shopping list
-        list_response = list_items_in_shopping_list()
+        list_response = list_items_in_shopping_list(user)
         items = []
         if len(list_response.get("aisles")) > 0:
-            for aisle in list_response.get("aisles"):
-                for item in aisle.get("items"):
-                    items.append(f"{item.get('name')} ({item.get('measures').get('original').get('amount')}"
-                                 f" {item.get('measures').get('original').get('unit')})")
+            items = format_shopping_list_items(
+                [item for aisle in list_response.get("aisles") for item in aisle.get("items")])
 
             spaced_list = '\n'.join(items)
         else:
@@ -883,6 +4038,7 @@ def publish_main_home_view(client, user):
                             "text": f"Shopping List ({len(items)} items)"
                         }
                     },
+                    *create_stale_notice_blocks(list_response),
                     {
                         "type": "section",
                         "text": {
@@ -965,6 +4121,9 @@ def publish_main_home_view(client, user):
             }
         )
 
+    except SpoonacularAccountError as e:
+        g_logger.error(f"Error publishing home tab: {e}")
+        notify_account_error(client, user)
     except Exception as e:
         g_logger.error(f"Error publishing home tab: {e}")
 
@@ -973,7 +4132,7 @@ def publish_main_home_view(client, user):
 def publish_main_home_view_sorted(client, user):
     try:
         # Get shopping list
-        list_response = list_items_in_shopping_list()
+        list_response = list_items_in_shopping_list(user)
         total_items = 0
         for aisle in list_response.get("aisles"):
             total_items += len(aisle.get("items"))
@@ -990,16 +4149,13 @@ def publish_main_home_view_sorted(client, user):
                     "type": "plain_text",
                     "text": f"Sorted Shopping List ({total_items} items)"
                 }
-            }
+            },
+            *create_stale_notice_blocks(list_response)
         ]
 
         # creating category list
         for aisle in list_response.get("aisles"):
-            items_list = []
-            for item in aisle.get("items"):
-                items_list.append(f"{item.get('name')} ({item.get('measures').get('original').get('amount')}"
-                                  f" {item.get('measures').get('original').get('unit')})")
-            items_joined = ", ".join(items_list)
+            items_joined = ", ".join(format_shopping_list_items(aisle.get("items")))
             blocks_list.append(
                 {
                     "type": "section",
@@ -1094,6 +4250,9 @@ def publish_main_home_view_sorted(client, user):
             }
         )
 
+    except SpoonacularAccountError as e:
+        g_logger.error(f"Error publishing home tab: {e}")
+        notify_account_error(client, user)
     except Exception as e:
         g_logger.error(f"Error publishing home tab: {e}")
 
@@ -1124,30 +4283,23 @@ def publish_meal_plan_home_view(client, user):
         )
 
         # Get current time / date info
-        today = datetime.datetime.now()
-        today_adjusted_tz = today - datetime.timedelta(hours=7)
+        today_adjusted_tz = get_adjusted_now()
         current_month = today_adjusted_tz.strftime("%B")
         current_year = today_adjusted_tz.strftime("%Y")
         # 0 is sunday, 6 is saturday
         current_weekday = today_adjusted_tz.strftime("%w")
-        g_logger.debug(
-            f"Current time: {str(today)}. Adjusted time: {today_adjusted_tz}  Current week day: {current_weekday}")
+        g_logger.debug(f"Adjusted time: {today_adjusted_tz}  Current week day: {current_weekday}")
 
         # Get start of current week
-        if current_weekday == '1':
-            start_of_current_week = today_adjusted_tz
-            start_of_current_week_formatted = today_adjusted_tz.strftime("%Y-%m-%d")
-            g_logger.debug(f"Start date of current week: {start_of_current_week_formatted}")
-        else:
-            day_offset = int(current_weekday) - 1 if current_weekday != '0' else 6
-            start_of_current_week = today_adjusted_tz - datetime.timedelta(days=day_offset)
-            start_of_current_week_formatted = start_of_current_week.strftime("%Y-%m-%d")
-            g_logger.debug(f"Start date of current week: {start_of_current_week_formatted}")
+        start_of_current_week = get_start_of_week(today_adjusted_tz)
+        start_of_current_week_formatted = start_of_current_week.strftime("%Y-%m-%d")
+        g_logger.debug(f"Start date of current week: {start_of_current_week_formatted}")
 
         # Get user's existing meal plan for the current week
         # Start date must be in the format yyyy-mm-dd
-        meal_plan_week_response = get_meal_plan_for_week(start_of_current_week_formatted)
+        meal_plan_week_response = get_meal_plan_for_week(user, start_of_current_week_formatted)
         mp_week_converted = convert_meal_plan_week_to_detailed_week(meal_plan_week_response)
+        week_rollup = compute_meal_plan_week_rollup(meal_plan_week_response)
         g_logger.debug(f"Meal plan week converted json: {mp_week_converted}")
         g_logger.debug(f"Get meal plan for week {start_of_current_week_formatted} response: {meal_plan_week_response}")
 
@@ -1173,6 +4325,7 @@ def publish_meal_plan_home_view(client, user):
                             "text": f"Meal Plan Calendar - Current Week: {current_month} {current_year}"
                         }
                     },
+                    *create_stale_notice_blocks(meal_plan_week_response),
                     block_divider,
                     {
                         "type": "section",
@@ -1247,6 +4400,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Monday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1322,6 +4476,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Tuesday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1397,6 +4552,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Wednesday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1472,6 +4628,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Thursday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1546,6 +4703,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Friday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1621,6 +4779,7 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Saturday'),
                     block_divider,
                     {
                         "type": "section",
@@ -1695,11 +4854,31 @@ def publish_meal_plan_home_view(client, user):
                             }
                         ]
                     },
+                    create_meal_plan_day_rollup_block(week_rollup, 'Sunday'),
+                    block_divider,
+                    create_meal_plan_week_rollup_block(week_rollup),
+                    {
+                        "type": "actions",
+                        "elements": [
+                            {
+                                "type": "button",
+                                "text": {
+                                    "type": "plain_text",
+                                    "text": "Build shopping list for this week"
+                                },
+                                "value": start_of_current_week_formatted,
+                                "action_id": "mp_week_build_shop_list"
+                            }
+                        ]
+                    },
                     block_divider
                 ]
             }
         )
 
+    except SpoonacularAccountError as e:
+        g_logger.error(f"Error publishing meal plan pane on home tab: {e}")
+        notify_account_error(client, user)
     except Exception as e:
         g_logger.error(f"Error publishing meal plan pane on home tab: {e}")
 
@@ -1728,7 +4907,7 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
             }
         )
 
-        meal_plan_day_response = get_meal_plan_for_day(date)
+        meal_plan_day_response = get_meal_plan_for_day(user, date)
         date_formatted = datetime.datetime.strptime(date, "%Y-%m-%d").strftime("%A %B %d, %Y")
 
         blocks_json = [
@@ -1742,6 +4921,7 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
                     "text": f"{date_formatted}"
                 }
             },
+            *create_stale_notice_blocks(meal_plan_day_response),
             block_divider
         ]
 
@@ -1751,7 +4931,7 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
             for meal in meal_plan_day_response.get("items"):
                 item_id = meal.get("id")
                 meal_id = meal.get("value").get("id")
-                full_recipe = get_recipe_by_id(meal_id)
+                full_recipe = get_recipe_by_id(meal_id, MEAL_PLAN_DETAIL_RECIPE_FIELDS)
 
                 if meal.get("slot") == 1:
                     meal_time = "Breakfast"
@@ -1764,19 +4944,8 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
 
                 meal_img = full_recipe.get('image')
 
-                if full_recipe.get("summary"):
-                    summary = full_recipe.get("summary").replace('<b>', '*').replace('</b>', '*')
-                    summary = re.sub(r'<.*?', '', summary)
-                    summary = f"{summary[:180]}..."
-                else:
-                    summary = "No summary found..."
-
-                vegan = "*V*" if full_recipe.get('vegan') else ""
-                vegetarian = "*Veg*" if full_recipe.get('vegetarian') else ""
-                gluten_free = "*GF*" if full_recipe.get('glutenFree') else ""
-                dairy_free = "*DF*" if full_recipe.get('dairyFree') else ""
-
-                category_str = "None Found" if not vegan and not vegetarian and not gluten_free and not dairy_free else f"{vegan} {vegetarian} {gluten_free} {dairy_free}"
+                summary = get_recipe_summary(full_recipe, 180)
+                category_str = get_recipe_card_parts(full_recipe).get("diet_badges")
 
                 blocks_json.append(
                     {
@@ -1863,6 +5032,19 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
                     }
                 }
             )
+            day_totals, missing = sum_meal_plan_item_nutrients(meal_plan_day_response.get("items"))
+            if missing < len(meal_plan_day_response.get("items")):
+                blocks_json.append(
+                    {
+                        "type": "context",
+                        "elements": [
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*% Daily Value*: {format_nutrient_rollup(day_totals, get_percent_daily_values(day_totals), len(NUTRIENT_VECTOR_NAMES))}"
+                            }
+                        ]
+                    }
+                )
 
         else:
             blocks_json.append(
@@ -1886,6 +5068,9 @@ def publish_meal_plan_detail_home_view(client, user, date: str):
         )
 
 
+    except SpoonacularAccountError as e:
+        g_logger.error(f"Error publishing meal plan detail on home tab: {e}")
+        notify_account_error(client, user)
     except Exception as e:
         g_logger.error(f"Error publishing meal plan detail on home tab: {e}")
 
@@ -1933,9 +5118,12 @@ def publish_recipe_home_view(client, user):
         g_logger.error(f"Error publishing recipe pane on home tab: {e}")
 
 
+# Publish the home tab first, then warm the caches for the views the user is likely to open next
+# Both run in this invocation so the warmed caches are the ones in this container
 @app.event("app_home_opened")
 def update_home_tab(client, event, logger):
     publish_main_home_view(client, event['user'])
+    PREFETCHER.run(event['user'], "home")
 
 
 @app.event("message")
@@ -1988,7 +5176,7 @@ def show_guide(ack, say, command):
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": "`/recipe random` Get a random recipe\n`/recipe ingredients` Search recipes using the "
+                    "text": "`/recipe random [diet]` Get a random recipe\n`/recipe ingredients` Search recipes using the "
                             "ingredients you have\n`/recipe search` Search for recipes with any phrase"
                 }
             },
@@ -2000,7 +5188,8 @@ def show_guide(ack, say, command):
                     "text": "`/shoplist list` List all items in shopping list\n`/shoplist sort`"
                             " Attempt to analyze items and sort by aisle\n`/shoplist add` Add an item to your "
                             "shopping list\n`/shoplist delete` Remove a specific item from your shopping list\n"
-                            "`/shoplist empty` Remove all items from your shopping list"
+                            "`/shoplist empty` Remove all items from your shopping list\n`/shoplist pantry "
+                            "[add|remove] ITEM, ITEM` List or update the ingredients you have on hand"
                 }
             },
             block_divider,
@@ -2022,246 +5211,73 @@ def show_guide(ack, say, command):
         ]
     })
 
-
-@app.command("/recipe")
-def recipe_process(ack, say, command, logger):
-    # Acknowledge command request
-    ack()
-
-    recipe_cmd = command['text'].split(' ', 1)[0]
-    g_logger.debug(f"\nReceived cmd /recipe {command['text']}.\n")
-
-    # RANDOM
-    if recipe_cmd.startswith("random"):
-        random_response = get_random_recipe()
-        recipe = random_response.get("recipes")[0]
-        title = recipe.get("title")
-        img_url = recipe.get("image", "No image found")
-
-        if recipe.get("summary"):
-            summary = recipe.get("summary").replace('<b>', '*').replace('</b>', '*')
-            summary = re.sub(r'<.*?', '', summary)
-            summary = f"{summary[:350]}..."
-        else:
-            summary = "No summary found..."
-
-        source_url = recipe.get("sourceUrl")
-        extended_ingred_list = []
-        for ingred in recipe.get("extendedIngredients"):
-            extended_ingred_list.append(ingred.get("original"))
-        ingreds_joined = ", ".join(extended_ingred_list)
-        ready_in_mins = recipe.get("readyInMinutes")
-        recipe_id = recipe.get("id")
-
-        say({
-            "text": "Random recipe",
-            "blocks": [
-                block_divider,
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": f"{title}"
-                    }
-                },
-                block_divider,
-                {
-                    "type": "image",
-                    "title": {
-                        "type": "plain_text",
-                        "text": f"Image of {title}"
-                    },
-                    "image_url": img_url,
-                    "alt_text": f"Image of {title}"
-                },
-                block_divider,
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"    {summary}"
-                    }
-                },
-                block_divider,
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Ingredients*: \n{ingreds_joined}\n\n*Ready in*: {ready_in_mins} mins"
-                    }
-                },
-                {
-                    "type": "actions",
-                    "block_id": "random_recipe_action",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Add all to shopping list"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "random_recipe_add_all_to_shop_list"
-                        },
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Show instructions"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "recipe_show_instructions"
-                        },
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "View Source"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "random_recipe_view_source",
-                            "url": source_url
-                        }
-                    ]
-                },
-                block_divider
-            ]
-        })
-
-    # INGREDIENTS
-    elif recipe_cmd.startswith("ingredients"):
-        say({
-            "text": "Ingredient Multi Select",
-            "blocks": [
-                block_divider,
-                {
-                    "type": "section",
-                    "block_id": "ingred_multi_select",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "Select your ingredients:"
-                    },
-                    "accessory": {
-                        "action_id": "ingred_multi_select",
-                        "type": "multi_external_select",
-                        "placeholder": {
-                            "type": "plain_text",
-                            "text": "What's in your fridge?"
-                        },
-                        "min_query_length": 1
-                    }
-                }
-            ]
-        })
-
-    # SEARCH
-    elif recipe_cmd.startswith("search"):
-        search_response = search_all_recipes(command['text'][6:])
-        total_results = search_response.get("totalResults")
-
-        if total_results < 1:
-            say("Sorry, no results were found!  You're too creative for me!")
-        else:
-            first_result = search_response.get("results")[0]
-            recipe_id = first_result.get("id")
-            recipe = get_recipe_by_id(recipe_id)
-            title = recipe.get("title")
-            img_url = recipe.get("image", "No image found")
-
-            if recipe.get("summary"):
-                summary = recipe.get("summary").replace('<b>', '*').replace('</b>', '*')
-                summary = re.sub(r'<.*?', '', summary)
-                summary = f"{summary[:350]}..."
-            else:
-                summary = "No summary found..."
-
-            source_url = recipe.get("sourceUrl")
-            extended_ingred_list = []
-            for ingred in recipe.get("extendedIngredients"):
-                extended_ingred_list.append(ingred.get("original"))
-            ingreds_joined = ", ".join(extended_ingred_list)
-            ready_in_mins = recipe.get("readyInMinutes")
-            recipe_id = recipe.get("id")
-
-            say({
-                "text": "Top Recipe Found",
-                "blocks": [
-                    block_divider,
-                    {
-                        "type": "header",
-                        "text": {
-                            "type": "plain_text",
-                            "text": f"{title}"
-                        }
-                    },
-                    block_divider,
-                    {
-                        "type": "image",
-                        "title": {
-                            "type": "plain_text",
-                            "text": f"Image of {title}"
-                        },
-                        "image_url": img_url,
-                        "alt_text": f"Image of {title}"
-                    },
-                    block_divider,
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Summary*: {summary}"
-                        }
-                    },
-                    block_divider,
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Ingredients*: {ingreds_joined}\n\n*Ready in*: {ready_in_mins} mins"
-                        }
-                    },
-                    {
-                        "type": "actions",
-                        "block_id": "random_recipe_action",
-                        "elements": [
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Add all to shopping list"
-                                },
-                                "value": str(recipe_id),
-                                "action_id": "random_recipe_add_all_to_shop_list"
-                            },
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "Show instructions"
-                                },
-                                "value": str(recipe_id),
-                                "action_id": "recipe_show_instructions"
-                            },
-                            {
-                                "type": "button",
-                                "text": {
-                                    "type": "plain_text",
-                                    "text": "View Source"
-                                },
-                                "value": str(recipe_id),
-                                "action_id": "random_recipe_view_source",
-                                "url": source_url
-                            }
-                        ]
+
+@app.command("/recipe")
+def recipe_process(ack, say, command, logger):
+    # Acknowledge command request
+    ack()
+
+    recipe_cmd = command['text'].split(' ', 1)[0]
+    g_logger.debug(f"\nReceived cmd /recipe {command['text']}.\n")
+
+    # RANDOM
+    if recipe_cmd.startswith("random"):
+        # Optional diet filter, ex: /recipe random vegetarian
+        diet = command['text'][7:].strip().lower()
+        recipe = RANDOM_RECIPE_POOL.pop(diet)
+        if recipe:
+            say(render_recipe_card(recipe, "random"))
+        else:
+            say("Uh oh!  Couldn't find a random recipe right now...")
+        # Top the pool up here, in the container that serves this user's next /recipe random - a lazy listener's
+        # separate invocation would usually fill another container's pool
+        if RANDOM_RECIPE_POOL.needs_refill(diet):
+            RANDOM_RECIPE_POOL.refill(diet, RANDOM_RECIPE_REFILL_TIMEOUT)
+
+    # INGREDIENTS
+    elif recipe_cmd.startswith("ingredients"):
+        say({
+            "text": "Ingredient Multi Select",
+            "blocks": [
+                block_divider,
+                {
+                    "type": "section",
+                    "block_id": "ingred_multi_select",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": "Select your ingredients:"
                     },
-                    block_divider
-                ]
-            })
+                    "accessory": {
+                        "action_id": "ingred_multi_select",
+                        "type": "multi_external_select",
+                        "max_selected_items": INGREDIENT_SEARCH_MAX_SELECTED,
+                        "placeholder": {
+                            "type": "plain_text",
+                            "text": "What's in your fridge?"
+                        },
+                        "min_query_length": 1
+                    }
+                }
+            ]
+        })
+
+    # SEARCH
+    elif recipe_cmd.startswith("search"):
+        query = normalize_search_query(command['text'][6:])
+        recipe, total_results = get_recipe_search_result(query, 0)
+
+        if recipe is None:
+            say("Sorry, no results were found!  You're too creative for me!")
+        else:
+            say(render_recipe_card(recipe, "search", create_recipe_search_buttons(query, 0, total_results)))
 
     else:
         say(SAY_INVALID_CMD)
 
 
+# Top the random recipe pool back up once a random recipe has been served
+
+
 # @app.command("/shoplist")
 def shoplist_process(ack, say, command, logger):
     # Acknowledge command request
@@ -2271,13 +5287,10 @@ def shoplist_process(ack, say, command, logger):
     g_logger.debug(f"\nReceived cmd /shoplist {command['text']}.\n")
 
     if shoplist_cmd.startswith("list"):
-        list_response = list_items_in_shopping_list()
-        items = []
+        list_response = list_items_in_shopping_list(command['user_id'])
         if len(list_response.get("aisles")) > 0:
-            for aisle in list_response.get("aisles"):
-                for item in aisle.get("items"):
-                    items.append(f"{item.get('name')} ({item.get('measures').get('original').get('amount')}"
-                                 f" {item.get('measures').get('original').get('unit')})")
+            items = format_shopping_list_items(
+                [item for aisle in list_response.get("aisles") for item in aisle.get("items")])
 
             spaced_list = '\n'.join(items)
             g_logger.debug(f"Current shopping list: {spaced_list}")
@@ -2292,6 +5305,7 @@ def shoplist_process(ack, say, command, logger):
                             "text": f"Your Shopping List ({len(items)} items)"
                         }
                     },
+                    *create_stale_notice_blocks(list_response),
                     {
                         "type": "section",
                         "text": {
@@ -2310,15 +5324,17 @@ def shoplist_process(ack, say, command, logger):
             say(SAY_SHOP_LIST_EMPTY)
 
     elif shoplist_cmd.startswith("sort"):
-        list_response = list_items_in_shopping_list()
+        list_response = list_items_in_shopping_list(command['user_id'])
         if len(list_response.get("aisles")) > 0:
-            say(create_sorted_aisles_display_block(list_response.get("aisles")))
+            sorted_block = create_sorted_aisles_display_block(list_response.get("aisles"))
+            sorted_block.get("blocks")[2:2] = create_stale_notice_blocks(list_response)
+            say(sorted_block)
         else:
             say(SAY_SHOP_LIST_EMPTY)
 
     elif shoplist_cmd.startswith("add"):
         item = command['text'][4:]
-        add_response = add_item_to_shopping_list(item, True)
+        add_response = add_item_to_shopping_list(command['user_id'], item, True)
         if len(add_response) > 0:
             say({
                 "blocks": [
@@ -2340,17 +5356,35 @@ def shoplist_process(ack, say, command, logger):
             say("You didn't specify an item to delete... try `/shoplist delete ITEM_HERE`")
         else:
             item_del = command['text'][7:]
-            del_response = delete_item_from_shopping_list(item_del)
+            del_response = delete_item_from_shopping_list(command['user_id'], item_del)
             if del_response.get("not_found"):
                 say(f"Uh oh!  Could not find or delete {item_del} from your shopping list")
             else:
+                # Crossed off the list = bought, so it's in the pantry now
+                PANTRY.add(command['user_id'], [item_del])
                 say(f"Deleted {item_del} from your shopping list")
 
     elif shoplist_cmd.startswith("empty"):
         say("Emptying shopping list...")
-        empty_shopping_list()
+        empty_shopping_list(command['user_id'])
         say("Shopping list is now empty")
 
+    elif shoplist_cmd.startswith("pantry"):
+        pantry_args = command['text'][7:].split(' ', 1)
+        pantry_items = [item.strip() for item in pantry_args[-1].split(",") if item.strip()]
+        if pantry_args[0] == "add" and len(pantry_args) > 1:
+            PANTRY.add(command['user_id'], pantry_items)
+            say(f"Added *{len(pantry_items)} items* to your pantry")
+        elif pantry_args[0] == "remove" and len(pantry_args) > 1:
+            PANTRY.remove(command['user_id'], pantry_items)
+            say(f"Removed *{len(pantry_items)} items* from your pantry")
+        else:
+            pantry_names = PANTRY.names(command['user_id'])
+            if len(pantry_names) > 0:
+                say(f"*Your Pantry ({len(pantry_names)} items)*\n{', '.join(pantry_names)}")
+            else:
+                say("Your pantry is empty... try `/shoplist pantry add ITEM, ITEM`")
+
     else:
         say(SAY_INVALID_CMD)
 
@@ -2358,7 +5392,7 @@ def shoplist_process(ack, say, command, logger):
 # Lazy listener for /shoplist command
 app.command("/shoplist")(
     ack=lazy_listener_ack,
-    lazy=[shoplist_process]
+    lazy=[report_account_errors(shoplist_process)]
 )
 
 
@@ -2709,16 +5743,33 @@ def mealplan_process(ack, say, command):
                             "value": "click_me_generate_plan",
                             "action_id": "actionId-generate_plan",
                             "style": "primary"
+                        },
+                        {
+                            "type": "button",
+                            "text": {
+                                "type": "plain_text",
+                                "text": "Generate Fresh Plan",
+                                "emoji": True
+                            },
+                            "value": "click_me_generate_fresh_plan",
+                            "action_id": "actionId-generate_plan_fresh"
                         }
                     ]
                 }
             ]
         })
         # generate_response = generate_meal_plan(time_frame, target_calories, diet, exclude)
+
+        # Warm the preset meal plans while the user is still picking options - done here rather than in a lazy
+        # listener, whose separate invocation may warm another container's MEAL_PLAN_CACHE. Slack's ack waits on
+        # this, so only the local generator is used: one remote generate can take SPOONACULAR_TIMEOUT on its own
+        prewarm_meal_plan_cache(max_seconds=PREFETCH_MAX_SECONDS, local_only=True)
     else:
         say(SAY_INVALID_CMD)
 
 
+
+
 @app.command("/nutrients")
 def nutrients_process(ack, say, body, command, client):
     # Acknowledge command request
@@ -2728,32 +5779,7 @@ def nutrients_process(ack, say, body, command, client):
         # Pass a valid trigger_id within 3 seconds of receiving it
         trigger_id=body["trigger_id"],
         # View payload
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "modal_nutrients",
-            "title": {"type": "plain_text", "text": "Search Nutrient Info"},
-            "blocks": [
-                block_divider,
-                {
-                    "type": "section",
-                    "block_id": "ingred_nutrient_select",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "Find an ingredient to get nutrient info:"
-                    },
-                    "accessory": {
-                        "action_id": "ingred_nutrient_select",
-                        "type": "external_select",
-                        "placeholder": {
-                            "type": "plain_text",
-                            "text": "Search ingredients"
-                        },
-                        "min_query_length": 1
-                    }
-                }
-            ]
-        }
+        view=create_nutrients_modal_view([])
     )
 
 
@@ -2788,13 +5814,43 @@ def meal_plan_date_picker(ack, say, body, logger):
                 }
             )
 
-    response = add_daily_meal_plan_to_calendar_day(selected_date, "RECIPE", meals_list)
+    response = add_daily_meal_plan_to_calendar_day(body.get("user").get("id"), selected_date, "RECIPE", meals_list)
     if response.get("status") == "success":
         say(f"Meal plan successfully added on *{selected_date}*!")
     else:
         say(f"Uh oh!  There was a problem adding your meal plan...")
 
 
+@app.action("week_meal_plan_date_picker")
+def week_meal_plan_date_picker(ack, say, body, logger):
+    ack()
+    g_logger.debug(f"Week meal plan date picker - body: {body}")
+
+    # Selected start date in format yyyy-mm-dd
+    selected_date = body.get("actions")[0].get("selected_date")
+    week_meals = {}
+
+    for block in body.get("message").get("blocks"):
+        if (block.get("block_id") or "").startswith("week_meal_plan_day_"):
+            day_index, meals = block.get("block_id")[len("week_meal_plan_day_"):].split("_", 1)
+            week_meals[int(day_index)] = [
+                {
+                    "id": int(meal_id),
+                    "servings": int(meal_servings or 1),
+                    "title": meal_title,
+                    "imageType": meal_image_type
+                }
+                for meal_id, meal_servings, meal_image_type, meal_title in json.loads(meals)
+            ]
+
+    response = add_weekly_meal_plan_to_calendar(body.get("user").get("id"), selected_date, "RECIPE",
+                                                [week_meals[day_index] for day_index in sorted(week_meals)])
+    if response.get("status") == "success":
+        say(f"Week meal plan successfully added starting *{selected_date}*!")
+    else:
+        say(f"Uh oh!  There was a problem adding your meal plan...")
+
+
 @app.action("random_recipe_view_source")
 def random_recipe_view_source(ack, body, logger):
     ack()
@@ -2813,7 +5869,7 @@ def open_instructions_modal(ack, body, client, logger):
     g_logger.debug(f"Recipe show instructions modal body: {body}")
 
     recipe_id = body.get("actions")[0].get("value")
-    recipe = get_recipe_by_id(recipe_id)
+    recipe = get_recipe_by_id(recipe_id, ("card", "instructions"))
     # instructions = re.sub(r'<.*?>', '', recipe.get("instructions", ""))
     analyzed_instructions = recipe.get("analyzedInstructions", "")
     numbered_instructions = ''
@@ -2846,6 +5902,16 @@ def open_instructions_modal(ack, body, client, logger):
     )
 
 
+# Ingredients currently compared in a /nutrients modal and the basis they're compared on
+def get_nutrient_compare_selection(body: dict) -> tuple:
+    try:
+        metadata = json.loads(body.get("view").get("private_metadata") or "{}")
+    except ValueError:
+        metadata = {}
+    basis = metadata.get("basis")
+    return metadata.get("selected") or [], basis if basis in NUTRIENT_COMPARE_BASES else "serving"
+
+
 @app.action("ingred_nutrient_select")
 def ingred_nutrient_select(ack, say, body, logger, client):
     ack()
@@ -2854,45 +5920,51 @@ def ingred_nutrient_select(ack, say, body, logger, client):
 
     ingred_id = body.get("actions")[0].get("selected_option").get("value")
     ingred_name = body.get("actions")[0].get("selected_option").get("text").get("text")
+    if ingred_id == INGREDIENT_SEARCH_UNAVAILABLE_OPTION["value"]:
+        return
 
     g_logger.debug(f"\nSelected {ingred_name} with id {ingred_id}.")
 
-    ingredient_response = get_ingredient_info_by_id(ingred_id)
-    # say(display_nutrition_details_for_ingredient(ingredient_response))
+    # Re-adding an ingredient keeps its column, a new one past the limit pushes out the oldest
+    selected, basis = get_nutrient_compare_selection(body)
+    if ingred_id not in [selected_id for selected_id, _ in selected]:
+        selected = (selected + [[ingred_id, ingred_name]])[-NUTRIENT_COMPARE_MAX_INGREDIENTS:]
 
-    blocks = [
-        block_divider,
-        {
-            "type": "section",
-            "block_id": "ingred_nutrient_select",
-            "text": {
-                "type": "mrkdwn",
-                "text": "Find an ingredient to get nutrient info:"
-            },
-            "accessory": {
-                "action_id": "ingred_nutrient_select",
-                "type": "external_select",
-                "placeholder": {
-                    "type": "plain_text",
-                    "text": "Search ingredients"
-                },
-                "min_query_length": 1
-            }
-        }
-    ]
+    client.views_update(
+        view_id=body["view"]["id"],
+        hash=body["view"]["hash"],
+        view=create_nutrients_modal_view(selected, basis)
+    )
 
-    blocks = append_nutrient_info_to_block_list(blocks, ingredient_response)
+
+# Remove one ingredient from the /nutrients comparison
+@app.action(re.compile("^nutrient_compare_remove_"))
+def nutrient_compare_remove(ack, body, logger, client):
+    ack()
+
+    ingred_id = body.get("actions")[0].get("value")
+    selected, basis = get_nutrient_compare_selection(body)
+    selected = [pair for pair in selected if pair[0] != ingred_id]
 
     client.views_update(
         view_id=body["view"]["id"],
         hash=body["view"]["hash"],
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "view_show_nutrient_info",
-            "title": {"type": "plain_text", "text": "Search Nutrition Info"},
-            "blocks": blocks
-        }
+        view=create_nutrients_modal_view(selected, basis)
+    )
+
+
+# Switch the /nutrients comparison between per serving and per 100 g - scaled locally, no new requests
+@app.action("nutrient_compare_basis")
+def nutrient_compare_basis(ack, body, logger, client):
+    ack()
+
+    selected, _ = get_nutrient_compare_selection(body)
+    basis = body.get("actions")[0].get("selected_option").get("value")
+
+    client.views_update(
+        view_id=body["view"]["id"],
+        hash=body["view"]["hash"],
+        view=create_nutrients_modal_view(selected, basis if basis in NUTRIENT_COMPARE_BASES else "serving")
     )
 
 
@@ -2906,10 +5978,10 @@ def home_shop_list_add_item_action(ack, say, body, logger, client, event):
     selected_opt = state_vals.get("home_shop_list_actions_block").get("home_shop_list_search_ingred_action").get(
         "selected_option")
 
-    if selected_opt:
+    if selected_opt and selected_opt.get("value") != INGREDIENT_SEARCH_UNAVAILABLE_OPTION["value"]:
         selected_ingred_name = selected_opt.get("text").get("text")
 
-        add_item_to_shopping_list(selected_ingred_name, True)
+        add_item_to_shopping_list(body.get("user").get("id"), selected_ingred_name, True)
 
         # Refresh home view with shopping list
         g_logger.debug(f"Client: {client}")  # not null
@@ -2943,10 +6015,11 @@ def home_shop_list_delete_item_action(ack, say, body, logger, client, event):
     selected_opt = state_vals.get("home_shop_list_actions_block").get("home_shop_list_search_ingred_action").get(
         "selected_option")
 
-    if selected_opt:
+    if selected_opt and selected_opt.get("value") != INGREDIENT_SEARCH_UNAVAILABLE_OPTION["value"]:
         selected_ingred_name = selected_opt.get("text").get("text")
 
-        delete_item_from_shopping_list(selected_ingred_name)
+        delete_item_from_shopping_list(body.get("user").get("id"), selected_ingred_name)
+        PANTRY.add(body.get("user").get("id"), [selected_ingred_name])
 
         # Refresh home view with shopping list
         g_logger.debug(f"Client: {client}")  # not null
@@ -2964,12 +6037,15 @@ def ingredients_selected_action(ack, say, body, logger):
     g_logger.debug(f"Ingredient multi-select body: {body}")
     search_list = []
 
-    say("Searching for recipes with your ingredients...")
-
     for option in body.get("actions")[0].get("selected_options"):
-        search_list.append(option.get("value"))
+        if option.get("value") != INGREDIENT_SEARCH_UNAVAILABLE_OPTION["value"]:
+            search_list.append(option.get("value"))
+    if not search_list:
+        return
+
+    say("Searching for recipes with your ingredients...")
 
-    search_response = search_all_recipes_by_ingredients(search_list)
+    search_response = find_recipes_by_ingredients(body.get("user").get("id"), search_list)
     g_logger.debug(f"Search recipes by ingredients response: {search_response}")
 
     if len(search_response) < 1:
@@ -3029,7 +6105,8 @@ def ingredients_selected_action(ack, say, body, logger):
                                 "type": "plain_text",
                                 "text": "Add missing to shopping list"
                             },
-                            "value": missing_ingreds_joined,
+                            # The missing lines are worked out again on click - they can outgrow the value limit
+                            "value": json.dumps({"id": recipe_id, "have": search_list}),
                             "action_id": "ingred_recipe_add_missing_to_shop_list"
                         }
                     ]
@@ -3040,17 +6117,51 @@ def ingredients_selected_action(ack, say, body, logger):
         say(blocks)
 
 
+# Interaction state key - one entry per user per message
+def get_interaction_key(body: dict) -> tuple:
+    container = body.get("container") or {}
+    message_ts = container.get("message_ts") or (body.get("message") or {}).get("ts")
+    return body.get("user").get("id"), message_ts
+
+
+# Normalize a selected meal plan option value
+def parse_meal_plan_option(option_name: str, value: str):
+    if option_name == "diet":
+        return value if value != "None" else ""
+    return value
+
+
+# Resolve generate options: defaults < remembered selections < current message state
+def get_meal_plan_options(body: dict) -> dict:
+    options = dict(DEFAULT_MEAL_PLAN_OPTIONS)
+    options.update(INTERACTION_STATE.get(get_interaction_key(body)))
+
+    state_values = (body.get("state") or {}).get("values") or {}
+    for block_values in state_values.values():
+        for action_id, element in block_values.items():
+            option_name = MEAL_PLAN_OPTION_ACTIONS.get(action_id)
+            if option_name and element.get("selected_option"):
+                options[option_name] = parse_meal_plan_option(option_name,
+                                                              element.get("selected_option").get("value"))
+    return options
+
+
+# Remember a meal plan select choice for this user and message
+def save_meal_plan_option(body: dict):
+    action = body.get("actions")[0]
+    option_name = MEAL_PLAN_OPTION_ACTIONS.get(action.get("action_id"))
+    value = parse_meal_plan_option(option_name, action.get("selected_option").get("value"))
+    g_logger.debug(f"Meal plan {option_name} picker: {value}")
+
+    INTERACTION_STATE.update(get_interaction_key(body), **{option_name: value})
+
+
 @app.action("static_select_day_week-action")
 def static_select_day_week(ack, body, logger):
     ack()
     g_logger.debug(f"Meal plan day picker body: {body}")
 
-    # Get timeFrame from body
-    time_frame = body.get("actions")[0].get("selected_option").get("value")
-    g_logger.debug(f"Meal plan day picker: {time_frame}")
-
-    global GENERATE_MEAL_PLAN_OPTIONS
-    GENERATE_MEAL_PLAN_OPTIONS['timeFrame'] = time_frame
+    save_meal_plan_option(body)
 
 
 @app.action("static_select_diet-action")
@@ -3058,12 +6169,7 @@ def static_select_diet(ack, body, logger):
     ack()
     g_logger.debug(f"Meal plan diet picker body: {body}")
 
-    # Get diet from body
-    diet = body.get("actions")[0].get("selected_option").get("value")
-    g_logger.debug(f"Meal plan diet picker: {diet}")
-
-    global GENERATE_MEAL_PLAN_OPTIONS
-    GENERATE_MEAL_PLAN_OPTIONS['diet'] = diet if diet != "None" else ""
+    save_meal_plan_option(body)
 
 
 @app.action("static_select_calorie-action")
@@ -3071,12 +6177,7 @@ def static_select_calorie(ack, body, logger):
     ack()
     g_logger.debug(f"Meal plan calorie picker body: {body}")
 
-    # Get calories from body
-    calories = body.get("actions")[0].get("selected_option").get("value")
-    g_logger.debug(f"Meal plan calorie picker: {calories}")
-
-    global GENERATE_MEAL_PLAN_OPTIONS
-    GENERATE_MEAL_PLAN_OPTIONS['targetCalories'] = calories
+    save_meal_plan_option(body)
 
 
 @app.action("actionId-generate_plan")
@@ -3085,11 +6186,39 @@ def generate_meal_plan_action(ack, say, body, logger):
 
     g_logger.debug(f"Generate meal plan body: {body}")
 
-    global GENERATE_MEAL_PLAN_OPTIONS
+    say_generated_meal_plan(say, body, False)
+
+
+# Same as generate, but skips the meal plan cache
+@app.action("actionId-generate_plan_fresh")
+def generate_fresh_meal_plan_action(ack, say, body, logger):
+    ack()
+
+    g_logger.debug(f"Generate fresh meal plan body: {body}")
+
+    say_generated_meal_plan(say, body, True)
+
 
-    generate_meal_plan_response = generate_meal_plan(GENERATE_MEAL_PLAN_OPTIONS['timeFrame'],
-                                                     GENERATE_MEAL_PLAN_OPTIONS['targetCalories'],
-                                                     GENERATE_MEAL_PLAN_OPTIONS['diet'], "")
+# Block id carrying one day of a generated week plan: [[id, servings, image type, title], ...] as JSON
+# Slack caps block ids at 255 characters, so long titles are shortened until it fits
+def create_week_plan_day_block_id(day_index: int, meals: list) -> str:
+    title_length = 80
+    while True:
+        block_id = f"week_meal_plan_day_{day_index}_" + json.dumps(
+            [[meal.get("id"), meal.get("servings"), meal.get("imageType") or "jpg", (meal.get("title") or "")[:title_length]]
+             for meal in meals],
+            separators=(",", ":"))
+        if len(block_id) <= 255 or title_length == 0:
+            return block_id
+        title_length -= 10
+
+
+# Generate a meal plan from the user's selections and post it
+def say_generated_meal_plan(say, body: dict, force_refresh: bool):
+    options = get_meal_plan_options(body)
+
+    generate_meal_plan_response = generate_meal_plan(options['timeFrame'], options['targetCalories'],
+                                                     options['diet'], "", force_refresh)
 
     if generate_meal_plan_response.get("week"):
         mon_plan = generate_meal_plan_response.get("week").get("monday")
@@ -3113,6 +6242,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(0, mon_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Monday:*\n {mon_plan.get('meals')[0].get('title')}, {mon_plan.get('meals')[1].get('title')},"
@@ -3124,6 +6254,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(1, tues_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Tuesday:*\n {tues_plan.get('meals')[0].get('title')}, {tues_plan.get('meals')[1].get('title')},"
@@ -3135,6 +6266,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(2, wed_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Wednesday:*\n {wed_plan.get('meals')[0].get('title')}, {wed_plan.get('meals')[1].get('title')},"
@@ -3146,6 +6278,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(3, thurs_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Thursday:*\n {thurs_plan.get('meals')[0].get('title')}, {thurs_plan.get('meals')[1].get('title')},"
@@ -3157,6 +6290,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(4, fri_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Friday:*\n {fri_plan.get('meals')[0].get('title')}, {fri_plan.get('meals')[1].get('title')},"
@@ -3168,6 +6302,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(5, sat_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Saturday:*\n {sat_plan.get('meals')[0].get('title')}, {sat_plan.get('meals')[1].get('title')},"
@@ -3179,6 +6314,7 @@ def generate_meal_plan_action(ack, say, body, logger):
                 block_divider,
                 {
                     "type": "section",
+                    "block_id": create_week_plan_day_block_id(6, sun_plan.get('meals')),
                     "text": {
                         "type": "mrkdwn",
                         "text": f"*Sunday:*\n {sun_plan.get('meals')[0].get('title')}, {sun_plan.get('meals')[1].get('title')},"
@@ -3186,6 +6322,25 @@ def generate_meal_plan_action(ack, say, body, logger):
                                 f" *Protein*: {sun_plan.get('nutrients').get('protein')} *Fat*: {sun_plan.get('nutrients').get('fat')}"
                                 f" *Carbs*: {sun_plan.get('nutrients').get('carbohydrates')}"
                     }
+                },
+                block_divider,
+                {
+                    "type": "section",
+                    "block_id": "week_meal_plan_date_picker_section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": "Save this week starting on (all 21 meals will be added):"
+                    },
+                    "accessory": {
+                        "type": "datepicker",
+                        "action_id": "week_meal_plan_date_picker",
+                        "initial_date": (get_start_of_week(get_adjusted_now()) + datetime.timedelta(days=7)).strftime(
+                            "%Y-%m-%d"),
+                        "placeholder": {
+                            "type": "plain_text",
+                            "text": "Select a start date"
+                        }
+                    }
                 }
             ]
         })
@@ -3204,7 +6359,7 @@ def random_recipe_add_all_to_shop_list(ack, say, body, logger):
     recipe_id = body.get("actions")[0].get("value")
 
     say("Yay!  Someone is hungry today.  Adding items now...")
-    add_response = add_recipe_ingredients_to_shop_list(recipe_id)
+    add_response = add_recipe_ingredients_to_shop_list(body.get("user").get("id"), recipe_id)
     total_added = add_response.get("total_added")
 
     if add_response:
@@ -3223,6 +6378,24 @@ def random_recipe_add_all_to_shop_list(ack, say, body, logger):
         say("Uh oh!  Something went wrong...")
 
 
+# Next result / next page buttons on a '/recipe search' card - served from the cached result page
+@app.action("recipe_search_next_result")
+@app.action("recipe_search_next_page")
+def recipe_search_next(ack, say, body, logger):
+    ack()
+    g_logger.debug(f"Recipe search next body: {body}")
+
+    search_position = json.loads(body.get("actions")[0].get("value"))
+    query = search_position.get("query")
+    index = search_position.get("index")
+    recipe, total_results = get_recipe_search_result(query, index)
+
+    if recipe is None:
+        say("That's all the recipes I could find!")
+    else:
+        say(render_recipe_card(recipe, "search", create_recipe_search_buttons(query, index, total_results)))
+
+
 # View full recipe details from button press in '/recipe ingredients' results
 @app.action("ingred_recipe_show_full_recipe")
 def show_full_recipe_from_results_list(ack, say, body, logger):
@@ -3231,103 +6404,9 @@ def show_full_recipe_from_results_list(ack, say, body, logger):
     g_logger.debug(f"Show full recipe body: {body}")
 
     recipe_id = body.get("actions")[0].get("value")
-    recipe = get_recipe_by_id(recipe_id)
-
-    # recipe = recipe_response.get("recipes")[0]
-    title = recipe.get("title")
-    img_url = recipe.get("image", "No image found")
-
-    if recipe.get("summary"):
-        summary = recipe.get("summary").replace('<b>', '*').replace('</b>', '*')
-        summary = re.sub(r'<.*?', '', summary)
-        summary = f"{summary[:350]}..."
-    else:
-        summary = "No summary found..."
-
-    source_url = recipe.get("sourceUrl")
-    extended_ingred_list = []
-    for ingred in recipe.get("extendedIngredients"):
-        extended_ingred_list.append(ingred.get("original"))
-    ingreds_joined = ", ".join(extended_ingred_list)
-    ready_in_mins = recipe.get("readyInMinutes")
-    recipe_id = recipe.get("id")
+    recipe = get_recipe_by_id(recipe_id, ("card", "ingredients"))
 
-    say(
-        say({
-            "text": "Random recipe",
-            "blocks": [
-                block_divider,
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": f"{title}"
-                    }
-                },
-                block_divider,
-                {
-                    "type": "image",
-                    "title": {
-                        "type": "plain_text",
-                        "text": f"Image of {title}"
-                    },
-                    "image_url": img_url,
-                    "alt_text": f"Image of {title}"
-                },
-                block_divider,
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"    {summary}"
-                    }
-                },
-                block_divider,
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Ingredients*: \n{ingreds_joined}\n\n*Ready in*: {ready_in_mins} mins"
-                    }
-                },
-                {
-                    "type": "actions",
-                    "block_id": "ingred_recipe_action",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Add all to shopping list"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "random_recipe_add_all_to_shop_list"
-                        },
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Show instructions"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "recipe_show_instructions"
-                        },
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "View Source"
-                            },
-                            "value": str(recipe_id),
-                            "action_id": "random_recipe_view_source",
-                            "url": source_url
-                        }
-                    ]
-                },
-                block_divider
-            ]
-        })
-    )
+    say(render_recipe_card(recipe, "ingredients"))
 
 
 @app.action("ingred_recipe_add_missing_to_shop_list")
@@ -3335,16 +6414,27 @@ def add_missing_ingredients_to_shop_list(ack, say, body, logger):
     ack()
     g_logger.debug(f"Add missing ingredients to shopping list body: {body}")
 
-    missing_ingredients = body.get("actions")[0].get("value").split(", ")
-    for ingred in missing_ingredients:
-        add_item_to_shopping_list(ingred, True)
-    say(f"Added *{len(missing_ingredients)} items* to your shopping list")
+    user_id = body.get("user").get("id")
+    value = body.get("actions")[0].get("value")
+    try:
+        selection = json.loads(value)
+    except ValueError:
+        # Results posted before pantry support carried the joined original lines
+        selection = [[ingred, ingred] for ingred in value.split(", ")]
+
+    if isinstance(selection, dict):
+        missing_ingredients = get_missing_recipe_ingredients(user_id, selection.get("id"), selection.get("have") or [])
+    else:
+        # Older results carried [name, original] pairs - skip anything that has landed in the pantry since
+        missing_ingredients = [original for name, original in selection if not PANTRY.contains(user_id, name)]
+    items_added = add_items_to_shopping_list(user_id, missing_ingredients)
+    say(f"Added *{len(items_added)} items* to your shopping list")
 
 
 # Empty shopping list from Home screen button press and publish view
 def home_shop_list_empty_action(ack, say, body, logger, client):
     g_logger.debug("Got to Lazy empty shopping list!")
-    empty_shopping_list()
+    empty_shopping_list(body.get("user").get("id"))
 
     publish_main_home_view(client, body.get("user").get("id"))
 
@@ -3353,7 +6443,7 @@ def home_shop_list_empty_action(ack, say, body, logger, client):
 # Empty shopping list from Home screen button press
 app.action('home_shop_list_empty_action')(
     ack=lazy_listener_ack,
-    lazy=[home_shop_list_empty_action]
+    lazy=[report_account_errors(home_shop_list_empty_action)]
 )
 
 
@@ -3363,15 +6453,38 @@ def home_shop_list_search_ingred_action(ack, say, body, logger):
     ack()
 
 
-# Button press on home view to show Meal Plans
+# Button press on home view to show Meal Plans - prefetching follows the publish in the same (lazy) invocation
 def home_view_meal_plans_action(ack, say, body, logger, client):
     publish_meal_plan_home_view(client, body.get("user").get("id"))
+    PREFETCHER.run(body.get("user").get("id"), "meal_plan_week")
 
 
 # Lazy listener for Meal Plans Calendar button press
 app.action('home_view_meal_plans_action')(
     ack=lazy_listener_ack,
-    lazy=[home_view_meal_plans_action]
+    lazy=[report_account_errors(home_view_meal_plans_action)]
+)
+
+
+# Button press on the meal plan calendar to turn the whole week into a shopping list, then show the list
+def mp_week_build_shop_list(ack, say, body, logger, client):
+    user_id = body.get("user").get("id")
+    start_date = body.get("actions")[0].get("value")
+    end_date = (datetime.datetime.strptime(start_date, "%Y-%m-%d") + datetime.timedelta(days=6)).strftime("%Y-%m-%d")
+
+    build_response = build_shopping_list_for_dates(user_id, start_date, end_date)
+    g_logger.debug(f"Build shopping list for week {start_date} response: {build_response}")
+    if build_response.get("error"):
+        client.chat_postMessage(channel=user_id, text=f"{SAY_SHOP_LIST_BUILD_FAILED}  _({build_response['error']})_")
+        return
+
+    publish_main_home_view(client, user_id)
+
+
+# Lazy listener for the build week shopping list button
+app.action('mp_week_build_shop_list')(
+    ack=lazy_listener_ack,
+    lazy=[report_account_errors(mp_week_build_shop_list)]
 )
 
 
@@ -3425,7 +6538,7 @@ def delete_item_from_mp(ack, say, body, logger, client):
 
     item_id = (body.get("actions")[0].get("value")).split("_")[0]
     date = (body.get("actions")[0].get("value")).split("_")[1]
-    delete_response = delete_item_from_meal_plan(item_id)
+    delete_response = delete_item_from_meal_plan(body.get("user").get("id"), item_id)
 
     g_logger.debug(f"Delete meal plan item response: {delete_response}")
 
@@ -3441,9 +6554,12 @@ def delete_item_from_mp(ack, say, body, logger, client):
 def home_shop_list_ingredient_search(ack, payload):
     search_response = search_all_ingredients(payload.get("value"))
     g_logger.debug(f"Home shop list search results for {payload.get('value')}: {search_response.get('results')}")
+    if search_response.get("status") == "failure":
+        ack(options=[INGREDIENT_SEARCH_UNAVAILABLE_OPTION])
+        return
     options = []
 
-    for result in search_response.get("results"):
+    for result in search_response.get("results") or []:
         options.append({
             "text": {
                 "type": "plain_text",
@@ -3459,9 +6575,12 @@ def home_shop_list_ingredient_search(ack, payload):
 def multi_select_ingredient_search(ack, payload):
     search_response = search_all_ingredients(payload.get("value"))
     g_logger.debug(f"Multi-select search results for {payload.get('value')}: {search_response.get('results')}")
+    if search_response.get("status") == "failure":
+        ack(options=[INGREDIENT_SEARCH_UNAVAILABLE_OPTION])
+        return
     options = []
 
-    for result in search_response.get("results"):
+    for result in search_response.get("results") or []:
         options.append({
             "text": {
                 "type": "plain_text",
@@ -3477,9 +6596,12 @@ def multi_select_ingredient_search(ack, payload):
 def handle_some_options(ack, payload):
     search_response = search_all_ingredients(payload.get("value"))
     g_logger.debug(f"Select search results for {payload.get('value')}: {search_response.get('results')}")
+    if search_response.get("status") == "failure":
+        ack(options=[INGREDIENT_SEARCH_UNAVAILABLE_OPTION])
+        return
     options = []
 
-    for result in search_response.get("results"):
+    for result in search_response.get("results") or []:
         options.append({
             "text": {
                 "type": "plain_text",
@@ -3502,7 +6624,9 @@ logging.basicConfig(format="%(asctime)s %(message)s", level=logging.DEBUG)
 
 def handler(event, context):
     slack_handler = SlackRequestHandler(app=app)
-    return slack_handler.handle(event, context)
+    response = slack_handler.handle(event, context)
+    finish_idempotent_request(response.get("statusCode", 200))
+    return response
 
 # Start the app - for local dev
 # if __name__ == "__main__":
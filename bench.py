@@ -0,0 +1,282 @@
+# Micro benchmarks for the app's local hot paths
+# Needs the same environment as local dev (importing app creates the Bolt app), ex:
+#   SLACK_BOT_TOKEN=... SLACK_SIGNING_SECRET=... python bench.py
+import json
+import random
+import time
+import tracemalloc
+
+import app
+
+FIXTURE_WORDS = ["garlic", "chicken", "basil", "tomato", "olive", "oil", "lemon", "pasta", "rice", "onion",
+                 "pepper", "cumin", "yogurt", "spinach", "butter", "flour", "milk", "egg", "honey", "ginger"]
+
+
+# Spoonacular-shaped recipe fixtures with HTML summaries and ~12 ingredients each
+def create_fixture_recipes(total: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    recipes = []
+    for recipe_id in range(1, total + 1):
+        words = [rng.choice(FIXTURE_WORDS) for _ in range(120)]
+        summary = " ".join(f"<b>{word}</b>" if i % 9 == 0 else f"<a href=\"https://x/{word}\">{word}</a>"
+                           if i % 13 == 0 else word for i, word in enumerate(words))
+        recipes.append({
+            "id": recipe_id,
+            "title": f"{rng.choice(FIXTURE_WORDS).capitalize()} {rng.choice(FIXTURE_WORDS)} bowl",
+            "image": f"https://spoonacular.com/recipeImages/{recipe_id}-556x370.jpg",
+            "imageType": "jpg",
+            "summary": summary,
+            "sourceUrl": f"https://example.com/recipes/{recipe_id}",
+            "readyInMinutes": rng.randint(10, 90),
+            "servings": rng.randint(1, 6),
+            "vegan": rng.random() < 0.2,
+            "vegetarian": rng.random() < 0.4,
+            "glutenFree": rng.random() < 0.3,
+            "dairyFree": rng.random() < 0.3,
+            "dishTypes": rng.sample(["breakfast", "lunch", "dinner", "main course", "side dish", "snack"], 2),
+            "nutrition": {"nutrients": [
+                {"name": "Calories", "amount": rng.uniform(150, 900), "unit": "kcal"},
+                {"name": "Protein", "amount": rng.uniform(5, 60), "unit": "g"},
+                {"name": "Fat", "amount": rng.uniform(3, 50), "unit": "g"},
+                {"name": "Carbohydrates", "amount": rng.uniform(10, 120), "unit": "g"}
+            ]},
+            "extendedIngredients": [
+                {"id": rng.randint(1000, 9999), "name": word, "nameClean": word, "amount": rng.randint(1, 4),
+                 "unit": rng.choice(["cup", "tbsp", "g", ""]), "original": f"{rng.randint(1, 4)} cups {word}"}
+                for word in rng.sample(FIXTURE_WORDS, 12)
+            ]
+        })
+    return recipes
+
+
+FIXTURE_NUTRIENTS = [("Calories", "kcal"), ("Fat", "g"), ("Saturated Fat", "g"), ("Carbohydrates", "g"),
+                     ("Net Carbohydrates", "g"), ("Sugar", "g"), ("Cholesterol", "mg"), ("Sodium", "mg"),
+                     ("Protein", "g"), ("Vitamin C", "mg"), ("Manganese", "mg"), ("Folate", "µg"), ("Potassium", "mg"),
+                     ("Vitamin B6", "mg"), ("Fiber", "g"), ("Vitamin B1", "mg"), ("Copper", "mg"), ("Magnesium", "mg"),
+                     ("Vitamin A", "IU"), ("Iron", "mg"), ("Vitamin E", "mg"), ("Phosphorus", "mg"), ("Zinc", "mg"),
+                     ("Vitamin B2", "mg"), ("Vitamin B3", "mg"), ("Calcium", "mg"), ("Vitamin K", "µg"),
+                     ("Vitamin B5", "mg"), ("Selenium", "µg"), ("Choline", "mg")]
+
+
+# GET /food/ingredients/{id}/information shaped payloads, as raw JSON bytes
+def create_fixture_ingredient_payloads(total: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    payloads = []
+    for ingred_id in range(1, total + 1):
+        name = rng.choice(FIXTURE_WORDS)
+        payloads.append(json.dumps({
+            "id": ingred_id,
+            "original": name,
+            "originalName": name,
+            "name": name,
+            "amount": 1,
+            "unit": "",
+            "unitShort": "",
+            "unitLong": "",
+            "possibleUnits": ["small", "large", "piece", "slice", "g", "extra small", "medium", "oz", "cup", "serving"],
+            "estimatedCost": {"value": round(rng.uniform(5, 200), 2), "unit": "US Cents"},
+            "consistency": "solid",
+            "shoppingListUnits": ["pieces"],
+            "aisle": "Produce",
+            "image": f"{name}.jpg",
+            "meta": [],
+            "categoryPath": ["fruit", "produce"],
+            "nutrition": {
+                "nutrients": [{"name": name, "amount": round(rng.uniform(0, 300), 2), "unit": unit,
+                               "percentOfDailyNeeds": round(rng.uniform(0, 80), 2)} for name, unit in FIXTURE_NUTRIENTS],
+                "properties": [{"name": "Glycemic Index", "amount": 10, "unit": ""},
+                               {"name": "Glycemic Load", "amount": 1.2, "unit": ""}],
+                "flavonoids": [{"name": f"Flavonoid {position}", "amount": 0, "unit": "mg"} for position in range(26)],
+                "caloricBreakdown": {"percentProtein": 17.4, "percentFat": 9.3, "percentCarbs": 73.3},
+                "weightPerServing": {"amount": 100, "unit": "g"}
+            }
+        }).encode())
+    return payloads
+
+
+# Large raw JSON responses: recipe information with nutrition, a planned week and a long shopping list
+def create_fixture_large_responses(seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    recipe = create_fixture_recipes(1, seed)[0]
+    nutrients = [{"name": name, "amount": round(rng.uniform(0, 300), 2), "unit": unit,
+                  "percentOfDailyNeeds": round(rng.uniform(0, 80), 2)} for name, unit in FIXTURE_NUTRIENTS]
+    recipe["extendedIngredients"] = recipe["extendedIngredients"] * 3
+    recipe["nutrition"] = {
+        "nutrients": nutrients,
+        "ingredients": [{"id": ingred["id"], "name": ingred["name"], "amount": 1, "unit": "cup",
+                         "nutrients": nutrients} for ingred in recipe["extendedIngredients"]],
+        "caloricBreakdown": {"percentProtein": 17.4, "percentFat": 9.3, "percentCarbs": 73.3}
+    }
+    recipe["analyzedInstructions"] = [{"name": "", "steps": [
+        {"number": number, "step": " ".join(rng.choice(FIXTURE_WORDS) for _ in range(40)),
+         "ingredients": [{"id": 1, "name": word, "image": f"{word}.png"} for word in rng.sample(FIXTURE_WORDS, 6)],
+         "equipment": []} for number in range(1, 16)]}]
+
+    week = {"days": [{
+        "day": day,
+        "date": 1666569600 + position * 86400,
+        "items": [{"id": position * 10 + slot, "slot": slot, "position": 1, "type": "RECIPE",
+                   "value": {"id": rng.randint(1, 99999), "servings": 2, "title": f"Recipe {slot}", "imageType": "jpg"}}
+                  for slot in (1, 2, 3)],
+        "nutritionSummary": {"nutrients": nutrients},
+        "nutritionSummaryBreakfast": {"nutrients": nutrients},
+        "nutritionSummaryLunch": {"nutrients": nutrients},
+        "nutritionSummaryDinner": {"nutrients": nutrients}
+    } for position, day in enumerate(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])]}
+
+    shopping_list = {"aisles": [{"aisle": aisle, "items": [{
+        "id": rng.randint(1, 99999), "name": word, "aisle": aisle, "pantryItem": False, "cost": 0.5,
+        "ingredientId": rng.randint(1000, 9999), "usages": [{"recipeId": 1, "recipeTitle": "Recipe"}] * 3,
+        "usageRecipeIds": [1, 2, 3],
+        "measures": {"original": {"amount": 1.0, "unit": "cup"}, "metric": {"amount": 236.6, "unit": "ml"},
+                     "us": {"amount": 1.0, "unit": "cup"}}
+    } for word in FIXTURE_WORDS]} for aisle in ["Produce", "Baking", "Dairy", "Spices", "Pasta and Rice"]],
+        "cost": 1234.5, "startDate": 1666569600, "endDate": 1667174400}
+
+    return {name: json.dumps(payload).encode() for name, payload in
+            (("recipe", recipe), ("week", week), ("shopping_list", shopping_list))}
+
+
+def timed(label: str, func, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<48} {elapsed / rounds * 1000:10.3f} ms/round")
+    return elapsed
+
+
+def bench_recipe_cards(recipes: list, rounds: int = 20):
+    def render_cold():
+        for recipe in recipes:
+            app.RECIPE_CARD_CACHE.clear()
+            app.render_recipe_card(recipe, "random")
+
+    def render_warm():
+        for recipe in recipes:
+            app.render_recipe_card(recipe, "random")
+
+    print(f"Recipe cards ({len(recipes)} recipes per round)")
+    cold = timed("  render, cache cleared per recipe", render_cold, rounds)
+    render_warm()
+    warm = timed("  render, cached", render_warm, rounds)
+    print(f"  speedup: {cold / warm:.1f}x")
+
+
+def bench_ingredient_index(recipes: list, rounds: int = 200):
+    index = app.IngredientIndex("/tmp/bench_ingredient_index.bin", save_interval=float("inf"))
+    for recipe in recipes:
+        index.add_recipe(recipe)
+    query = ["tomatoes", "garlic", "basil", "olive"]
+
+    print(f"Ingredient index ({len(index)} recipes)")
+    timed("  find 5 recipes for 4 ingredients", lambda: index.find(query, 5), rounds)
+    pantry_bits = index.ingredient_bits(["egg", "milk", "flour", "butter", "onion", "oil"])
+    timed("  rank every recipe by missing vs pantry", lambda: index.rank_by_missing(pantry_bits, 5), rounds)
+
+
+def bench_recipe_text_index(recipes: list, rounds: int = 50):
+    index = app.RecipeTextIndex("/tmp/bench_recipe_text_index.bin", save_interval=float("inf"))
+    start = time.perf_counter()
+    for recipe in recipes:
+        index.add_recipe(recipe)
+    elapsed = time.perf_counter() - start
+
+    print(f"Recipe text index ({len(index)} recipes)")
+    print(f"  {'index every recipe':<46} {elapsed * 1000:10.3f} ms")
+    timed("  BM25 search for 'garlic basil pasta'", lambda: index.search("garlic basil pasta", 50), rounds)
+
+
+def bench_recipe_flag_index(recipes: list, rounds: int = 200):
+    index = app.RecipeFlagIndex()
+    for recipe in recipes:
+        index.add_recipe(recipe)
+    _, require, max_ready_minutes = app.parse_recipe_filter("vegan AND gluten-free dinners under 30 minutes")
+
+    print(f"Recipe flag index ({len(index)} recipes)")
+    timed("  vegan AND gluten-free dinners under 30 minutes",
+          lambda: index.filter(require, max_ready_minutes=max_ready_minutes), rounds)
+    timed("  vegetarian, not dessert", lambda: index.filter(
+        app.RECIPE_FLAG_BITS["vegetarian"], app.RECIPE_FLAG_BITS["dessert"]), rounds)
+
+
+def bench_meal_plan_generator(recipes: list, rounds: int = 20):
+    for recipe in recipes:
+        app.cache_recipe(recipe)
+
+    print(f"Local meal plan generator ({len(app.RECIPE_NUTRIENT_TABLE)} recipes with nutrition)")
+    timed("  7 day plan, 2000 kcal", lambda: app.generate_local_meal_plan("week", 2000, "", ""), rounds)
+    timed("  7 day vegetarian plan, 1800 kcal, no egg",
+          lambda: app.generate_local_meal_plan("week", 1800, "vegetarian", "egg"), rounds)
+
+
+FIXTURE_INGREDIENT_LINES = ["2 cups flour", "1 1/2 cups chopped tomatoes, drained", "½ tsp salt", "2-3 cloves garlic",
+                            "a pinch of salt", "1 (14 oz) can diced tomatoes", "3 onions", "250 ml milk",
+                            "1½ Tbsp. olive oil", "2 to 3 large eggs", "salt and pepper", ".5 lb ground beef"]
+
+
+def bench_ingredient_parser(recipes: list, total: int = 120000):
+    for recipe in recipes:
+        app.INGREDIENT_INDEX.add_recipe(recipe)
+    lines = (FIXTURE_INGREDIENT_LINES * (total // len(FIXTURE_INGREDIENT_LINES) + 1))[:total]
+
+    start = time.perf_counter()
+    for line in lines:
+        app.parse_ingredient_line(line)
+    elapsed = time.perf_counter() - start
+    print(f"Ingredient line parser ({len(app.INGREDIENT_INDEX)} recipes indexed)")
+    print(f"  {'parse ' + str(total) + ' lines':<46} {elapsed * 1000:10.3f} ms")
+    print(f"  throughput: {total / elapsed:,.0f} lines/sec")
+
+
+def bench_nutrient_storage(payloads: list):
+    def measure(build) -> int:
+        tracemalloc.start()
+        kept = [build(json.loads(payload)) for payload in payloads]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return size
+
+    raw = measure(lambda ingredient: ingredient)
+    compact = measure(app.compact_ingredient_info)
+    print(f"Ingredient nutrition storage ({len(payloads)} ingredients, {len(FIXTURE_NUTRIENTS)} nutrients each)")
+    print(f"  {'raw JSON dicts':<46} {raw / len(payloads):10.0f} bytes/item")
+    print(f"  {'compact arrays':<46} {compact / len(payloads):10.0f} bytes/item")
+    print(f"  reduction: {raw / compact:.1f}x")
+
+
+def bench_selected_json_paths(responses: dict, rounds: int = 200):
+    cases = [("week", app.MEAL_PLAN_WEEK_RESPONSE_PATHS), ("shopping_list", app.SHOPPING_LIST_RESPONSE_PATHS)]
+
+    def retained(func) -> int:
+        tracemalloc.start()
+        value = func()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del value
+        return size
+
+    print("Cached response size, whole document vs selected paths")
+    for name, tree in cases:
+        payload = responses[name]
+        print(f"  {name} ({len(payload) / 1024:.0f} KB)")
+        full = timed("    json.loads", lambda: json.loads(payload), rounds)
+        selected = timed("    json.loads + select_json_paths",
+                         lambda: app.select_json_paths(json.loads(payload), tree), rounds)
+        full_size = retained(lambda: json.loads(payload))
+        selected_size = retained(lambda: app.select_json_paths(json.loads(payload), tree))
+        print(f"    {'retained whole / selected':<44} {full_size / 1024:8.0f} KB / {selected_size / 1024:.0f} KB")
+        print(f"    overhead: {selected / full:.2f}x time, {full_size / selected_size:.1f}x less cached")
+
+
+if __name__ == "__main__":
+    fixture_recipes = create_fixture_recipes(300)
+    bench_recipe_cards(fixture_recipes)
+    bench_ingredient_index(create_fixture_recipes(5000))
+    bench_recipe_text_index(create_fixture_recipes(5000))
+    bench_recipe_flag_index(create_fixture_recipes(5000))
+    bench_meal_plan_generator(create_fixture_recipes(2000))
+    bench_nutrient_storage(create_fixture_ingredient_payloads(1000))
+    bench_ingredient_parser(create_fixture_recipes(2000))
+    bench_selected_json_paths(create_fixture_large_responses())
@@ -0,0 +1,38 @@
+# Importing app builds the Bolt app and opens every local store, so the environment is set up first:
+# placeholder Slack credentials, no token check against Slack, store files in a throwaway directory and a
+# Spoonacular url that never resolves
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="meal-planning-tests-")
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-test")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "test-secret")
+os.environ.setdefault("SPOONACULAR_BASE_URL", "https://spoonacular.invalid")
+os.environ.pop("ACCOUNT_TABLE_NAME", None)
+os.environ.pop("PANTRY_TABLE_NAME", None)
+for name, file_name in [("ACCOUNT_DB_PATH", "accounts.db"), ("INGREDIENT_INFO_DB_PATH", "ingredient_info.db"),
+                        ("RECIPE_TEXT_INDEX_PATH", "recipe_text_index.bin"),
+                        ("INGREDIENT_INDEX_PATH", "ingredient_index.bin"), ("PANTRY_DB_PATH", "pantry.db"),
+                        ("IDEMPOTENCY_DB_PATH", "idempotency.db")]:
+    os.environ[name] = os.path.join(DATA_DIR, file_name)
+
+mock.patch("slack_sdk.web.client.WebClient.auth_test", return_value=None).start()
+
+import app  # noqa: E402
+import bench  # noqa: E402
+
+
+# The bench fixture recipes, cached like Spoonacular responses (full recipes with nutrition)
+@pytest.fixture(scope="session")
+def cached_recipes():
+    recipes = bench.create_fixture_recipes(200)
+    for recipe in recipes:
+        app.cache_recipe(recipe)
+    return recipes
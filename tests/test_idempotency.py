@@ -0,0 +1,39 @@
+import app
+
+
+class FakeRequest:
+    def __init__(self, headers: dict):
+        self.headers = {name: [value] for name, value in headers.items()}
+        self.lazy_only = False
+
+
+def run_middleware(body: dict, headers: dict):
+    calls = []
+    response = app.suppress_duplicate_requests(FakeRequest(headers), body, lambda: calls.append(body) or "ran")
+    app.finish_idempotent_request(200)
+    return response, calls
+
+
+def test_timeout_retry_for_an_in_flight_event_is_dropped():
+    # The first attempt claimed the event in another container, this container has never seen it
+    response, calls = run_middleware({"event_id": "Ev-in-flight"},
+                                     {"x-slack-retry-num": "1", "x-slack-retry-reason": "http_timeout"})
+
+    assert calls == []
+    assert response.status == 200
+
+
+def test_retry_of_an_in_flight_event_in_this_container_is_dropped():
+    app.IDEMPOTENCY_STORE.claim("event:Ev-local", app.IDEMPOTENCY_IN_FLIGHT_TTL)
+
+    response, calls = run_middleware({"event_id": "Ev-local"},
+                                     {"x-slack-retry-num": "1", "x-slack-retry-reason": "http_error"})
+
+    assert calls == []
+    assert response.status == 200
+
+
+def test_first_delivery_runs():
+    response, calls = run_middleware({"event_id": "Ev-new"}, {})
+
+    assert (response, calls) == ("ran", [{"event_id": "Ev-new"}])
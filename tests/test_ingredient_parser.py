@@ -0,0 +1,86 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("line, amount, unit, name, key", [
+    ("2 tomatoes", 2, "", "tomatoes", "tomato"),
+    ("3 cups cherries", 3, "cup", "cherries", "cherry"),
+    ("4 peaches", 4, "", "peaches", "peach"),
+    ("2 Cups Carrots", 2, "cup", "Carrots", "carrot"),
+])
+def test_plurals_keep_the_name_and_match_on_the_singular(line, amount, unit, name, key):
+    parsed = app.parse_ingredient_line(line)
+
+    assert (parsed["amount"], parsed["unit"], parsed["name"], parsed["key"]) == (amount, unit, name, key)
+
+
+@pytest.mark.parametrize("line, amount, unit", [
+    ("2-3 cloves garlic", 3, "clove"),
+    ("1 to 2 tbsp olive oil", 2, "tbsp"),
+    ("1 1/2 cups flour", 1.5, "cup"),
+    ("½ tsp salt", 0.5, "tsp"),
+])
+def test_ranges_and_fractions(line, amount, unit):
+    parsed = app.parse_ingredient_line(line)
+
+    assert (parsed["amount"], parsed["unit"]) == (amount, unit)
+
+
+def test_a_and_an_count_as_one():
+    assert app.format_ingredient_line(app.parse_ingredient_line("a pinch of salt")) == "1 pinch salt"
+    assert app.format_ingredient_line(app.parse_ingredient_line("an onion")) == "1 onion"
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("1 onion, diced", "1 onion"),
+    ("1 (14 oz) can tomatoes", "1 can tomatoes"),
+    ("2 cups spinach (packed)", "2 cup spinach"),
+])
+def test_notes_are_dropped(line, expected):
+    assert app.format_ingredient_line(app.parse_ingredient_line(line)) == expected
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("hummus", "hummus"),
+    ("2 cups asparagus", "2 cup asparagus"),
+    ("1 lb couscous", "1 lb couscous"),
+    ("molasses", "molasses"),
+])
+def test_words_ending_in_s_are_sent_as_written(line, expected):
+    assert app.format_ingredient_line(app.parse_ingredient_line(line)) == expected
+
+
+def test_prep_words_are_dropped_from_the_name():
+    app.INGREDIENT_INDEX.add_recipe({"id": 999999999, "extendedIngredients": [{"name": "red onion", "aisle": "Produce"}]})
+
+    parsed = app.parse_ingredient_line("2 finely chopped Red Onions")
+
+    assert (parsed["name"], parsed["key"], parsed["aisle"]) == ("Red Onions", "red onion", "Produce")
+
+
+@pytest.mark.parametrize("line, key", [
+    ("1 cup coconut milk", "coconut milk"),
+    ("1 cup almond milk", "almond milk"),
+    ("2 cups chicken broth", "chicken broth"),
+    ("1 cup packed brown sugar", "brown sugar"),
+])
+def test_qualified_ingredients_keep_their_whole_name(line, key):
+    app.INGREDIENT_INDEX.add_recipe({"id": 999999998, "extendedIngredients": [
+        {"name": name} for name in ("milk", "broth", "sugar")]})
+
+    assert app.parse_ingredient_line(line)["key"] == key
+
+
+def test_merge_groups_on_the_key_and_keeps_the_first_name():
+    merged = app.merge_ingredient_lines([app.parse_ingredient_line(line) for line in
+                                         ["2 tomatoes", "1 tomato", "1 cup milk", "250 ml milk"]])
+
+    assert [app.format_ingredient_line(parsed) for parsed in merged] == ["3 tomatoes", "2.06 cup milk"]
+
+
+def test_merge_keeps_coconut_milk_apart_from_milk():
+    merged = app.merge_ingredient_lines([app.parse_ingredient_line(line) for line in
+                                         ["1 cup milk", "1 cup coconut milk", "1 cup milk"]])
+
+    assert [app.format_ingredient_line(parsed) for parsed in merged] == ["2 cup milk", "1 cup coconut milk"]
@@ -0,0 +1,33 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("handler", [app.home_shop_list_ingredient_search, app.multi_select_ingredient_search,
+                                     app.handle_some_options])
+def test_failing_search_offers_the_unavailable_option(monkeypatch, handler):
+    monkeypatch.setattr(app, "search_all_ingredients",
+                        lambda query: {"status": "failure", "code": 503, "message": "unavailable"})
+    acked = []
+
+    handler(lambda **kwargs: acked.append(kwargs), {"value": "tom"})
+
+    assert acked == [{"options": [app.INGREDIENT_SEARCH_UNAVAILABLE_OPTION]}]
+
+
+def test_search_without_results_offers_nothing(monkeypatch):
+    monkeypatch.setattr(app, "search_all_ingredients", lambda query: {"totalResults": 0})
+    acked = []
+
+    app.multi_select_ingredient_search(lambda **kwargs: acked.append(kwargs), {"value": "zzz"})
+
+    assert acked == [{"options": []}]
+
+
+def test_unavailable_option_is_not_searched_for():
+    said = []
+
+    app.ingredients_selected_action(lambda: None, said.append, {
+        "user": {"id": "U1"}, "actions": [{"selected_options": [app.INGREDIENT_SEARCH_UNAVAILABLE_OPTION]}]}, None)
+
+    assert said == []
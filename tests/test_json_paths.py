@@ -0,0 +1,43 @@
+import json
+
+import app
+
+
+def test_compile_json_paths():
+    assert app.compile_json_paths(["days[*].items[*].value", "days[*].day/date", "status"]) == \
+        {"days": {"*": {"items": {"*": {"value": True}}, "day": True, "date": True}}, "status": True}
+
+
+def test_select_keeps_only_requested_paths():
+    document = {
+        "days": [{"day": "Monday", "date": 1, "items": [{"id": 1, "value": {"id": 5, "title": "[Soup]"}}],
+                  "nutritionSummary": {"nutrients": [1, 2, 3]}},
+                 {"day": "Tuesday", "items": []}],
+        "startDate": 1
+    }
+
+    assert app.select_json_paths(document, ["days[*].day", "days[*].items[*].value"]) == {
+        "days": [{"day": "Monday", "items": [{"value": {"id": 5, "title": "[Soup]"}}]},
+                 {"day": "Tuesday", "items": []}]
+    }
+
+
+def test_select_matches_the_cached_shopping_list_shape():
+    document = {"aisles": [{"aisle": "Produce", "items": [
+        {"id": 1, "name": "kale", "aisle": "Produce", "cost": 1.2, "ingredientId": 9,
+         "measures": {"original": {"amount": 1.0, "unit": "bunch"}}, "usages": [], "pantryItem": False}]}],
+        "cost": 1.2, "startDate": 1, "endDate": 2}
+
+    assert app.select_json_paths(json.loads(json.dumps(document)), app.SHOPPING_LIST_RESPONSE_PATHS) == {
+        "aisles": [{"aisle": "Produce", "items": [
+            {"id": 1, "name": "kale", "aisle": "Produce",
+             "measures": {"original": {"amount": 1.0, "unit": "bunch"}}}]}]
+    }
+
+
+def test_select_leaves_error_payloads_readable():
+    failure = {"status": "failure", "code": 401, "message": "Unauthorized", "aisles": "n/a"}
+
+    assert app.select_json_paths(failure, app.SHOPPING_LIST_RESPONSE_PATHS) == failure
+    assert app.select_json_paths({"days": None}, app.MEAL_PLAN_WEEK_RESPONSE_PATHS) == {"days": None}
+    assert app.select_json_paths([1, 2], app.MEAL_PLAN_WEEK_RESPONSE_PATHS) == [1, 2]
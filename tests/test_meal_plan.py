@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+import app
+
+
+def test_local_meal_plan_covers_the_day(cached_recipes):
+    plan = app.generate_local_meal_plan("Day", 2000, "", "", random.Random(1))
+
+    assert len(plan["meals"]) == 3
+    assert len(set(meal["id"] for meal in plan["meals"])) == 3
+
+
+def test_local_meal_plan_skips_zero_calorie_target(cached_recipes):
+    assert app.generate_local_meal_plan("Day", 0, "", "") is None
+    assert app.generate_local_meal_plan("Week", 0, "", "") is None
+
+
+def test_score_meal_plan_day_ignores_zero_targets():
+    assert app.score_meal_plan_day([500, 20, 10, 60], [0, 0, 0, 0]) == 0
+    assert app.score_meal_plan_day([1000, 50, 0, 0], [2000, 100, 0, 0]) == 1.0 * 0.25 + 0.5 * 0.25
+
+
+def test_local_only_prewarm_never_calls_spoonacular(monkeypatch, cached_recipes):
+    monkeypatch.setattr(app, "spoonacular_request", lambda *args, **kwargs: pytest.fail("remote generate"))
+    app.MEAL_PLAN_CACHE.clear()
+
+    warmed = app.prewarm_meal_plan_cache("Day:2000:;Day:2000:paleo;Day:0:", local_only=True)
+
+    assert warmed == 1
+    assert ("Day", 2000, "", "") in app.MEAL_PLAN_CACHE
@@ -0,0 +1,33 @@
+import app
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.calls = []
+
+    def names(self, user_id):
+        return []
+
+    def add(self, user_id, names):
+        self.calls.append(("add", names))
+
+    def remove(self, user_id, names):
+        self.calls.append(("remove", names))
+
+
+def test_blank_names_never_reach_the_backend():
+    backend = RecordingBackend()
+    pantry = app.PantryStore(backend, 10, 60, app.INGREDIENT_INDEX)
+
+    pantry.add("U1", ["Tomatoes", " ", ""])
+    pantry.remove("U1", ["", "  ", "Eggs"])
+
+    assert backend.calls == [("add", ["tomato"]), ("remove", ["egg"])]
+
+
+def test_milk_in_the_pantry_does_not_cover_coconut_milk():
+    app.INGREDIENT_INDEX.add_recipe({"id": 999999997, "extendedIngredients": [{"name": "milk"}, {"name": "coconut milk"}]})
+    app.PANTRY.add("U-milk", ["milk"])
+
+    assert app.PANTRY.contains("U-milk", app.parse_ingredient_line("2 cups milk")["key"])
+    assert not app.PANTRY.contains("U-milk", app.parse_ingredient_line("1 can coconut milk")["key"])
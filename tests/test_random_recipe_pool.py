@@ -0,0 +1,21 @@
+import app
+
+
+def test_random_recipe_tops_up_the_pool_before_acking(monkeypatch):
+    fetches = []
+
+    def fetch(diet, timeout):
+        fetches.append((diet, timeout))
+        return [{"id": number, "title": f"Recipe {number}"} for number in range(5)]
+    pool = app.RandomRecipePool(fetch, 3, app.SPOONACULAR_TIMEOUT)
+    monkeypatch.setattr(app, "RANDOM_RECIPE_POOL", pool)
+    monkeypatch.setattr(app, "render_recipe_card", lambda recipe, variant: recipe["title"])
+    said = []
+
+    for _ in range(3):
+        app.recipe_process(lambda: None, said.append, {"text": "random vegan"}, None)
+
+    assert said == ["Recipe 0", "Recipe 1", "Recipe 2"]
+    # Cold pool filled on the miss, then topped up once it dropped below the low-water mark
+    assert fetches == [("vegan", app.SPOONACULAR_TIMEOUT), ("vegan", app.RANDOM_RECIPE_REFILL_TIMEOUT)]
+    assert not pool.needs_refill("vegan")
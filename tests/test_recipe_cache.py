@@ -0,0 +1,20 @@
+import app
+
+LIGHT_RECIPE = {
+    "id": 880001, "title": "Smoky Tamarind Lentil Stew", "servings": 2, "image": "stew.jpg", "imageType": "jpg",
+    "extendedIngredients": [{"name": "red lentils", "amount": 1, "unit": "cup"},
+                            {"name": "tamarind paste", "amount": 2, "unit": "tbsp"}],
+    "nutrition": {"nutrients": []}
+}
+
+
+def test_light_recipes_are_visible_to_local_lookups():
+    recipe = app.cache_light_recipe(dict(LIGHT_RECIPE))
+
+    assert "nutrition" not in recipe
+    assert app.get_cached_recipe(880001, ("card", "ingredients")) is recipe
+    assert app.get_cached_recipe(880001, app.MEAL_PLAN_DETAIL_RECIPE_FIELDS) is None
+    assert 880001 in [recipe_id for recipe_id, _ in app.RECIPE_TEXT_INDEX.search("tamarind lentil stew", 5)]
+
+    week = {"days": [{"items": [{"value": {"id": 880001, "servings": 4}}]}]}
+    assert app.aggregate_meal_plan_week_ingredients(week) == (["2 cup red lentils", "4 tbsp tamarind paste"], 0)
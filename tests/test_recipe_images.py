@@ -0,0 +1,22 @@
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = b""
+
+
+def test_guessed_image_url_follows_redirects(monkeypatch):
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append((method, url, kwargs))
+        return FakeResponse(204)
+    monkeypatch.setattr(app.requests, "request", fake_request)
+
+    image_url = app.get_recipe_image_url(424242, size="312x231")
+
+    assert image_url == f"{app.RECIPE_IMAGE_BASE_URL}/424242-312x231.jpg"
+    assert calls == [("HEAD", image_url, {"timeout": app.SPOONACULAR_TIMEOUT, "allow_redirects": True})]
+    assert f"HEAD {app.RECIPE_IMAGE_BASE_URL}/{{id}}-{{size}}.{{type}}" in app.SPOONACULAR_BREAKERS
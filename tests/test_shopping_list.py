@@ -0,0 +1,44 @@
+import app
+
+
+def test_merged_line_matches_every_stored_item(monkeypatch):
+    stored = {"aisles": [
+        {"aisle": "Produce", "items": [{"id": 1, "name": "2 tomatoes"}, {"id": 2, "name": "onion"}]},
+        {"aisle": "Canned", "items": [{"id": 3, "name": "1 can tomatoes"}, {"id": 4, "name": "tomato"}]}
+    ]}
+    monkeypatch.setattr(app, "list_items_in_shopping_list", lambda user_id: stored)
+
+    assert app.get_list_item_ids_by_name("U1", "tomatoes (3 can)") == [1, 3, 4]
+    assert app.get_list_item_ids_by_name("U1", "onion") == [2]
+    assert app.get_list_item_ids_by_name("U1", "garlic") == []
+
+
+def test_deleting_milk_leaves_other_milks_alone(monkeypatch):
+    stored = {"aisles": [{"aisle": "Milk, Eggs, Other Dairy", "items": [
+        {"id": 1, "name": "coconut milk"}, {"id": 2, "name": "1 cup milk"}, {"id": 3, "name": "almond milk"}]}]}
+    monkeypatch.setattr(app, "list_items_in_shopping_list", lambda user_id: stored)
+
+    assert app.get_list_item_ids_by_name("U1", "milk") == [2]
+    assert app.get_list_item_ids_by_name("U1", "coconut milk") == [1]
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+def test_generated_week_drops_new_pantry_items(monkeypatch):
+    generated = {"aisles": [{"aisle": "Baking", "items": [{"id": 7, "name": "flour"}, {"id": 8, "name": "sugar"}]},
+                            {"aisle": "Spices", "items": [{"id": 9, "name": "salt"}]}]}
+    already_listed = {"aisles": [{"aisle": "Baking", "items": [{"id": 8, "name": "sugar"}]}]}
+    deleted = []
+    monkeypatch.setattr(app.ACCOUNT_STORE, "get", lambda user_id: {"username": "user", "hash": "hash"})
+    monkeypatch.setattr(app, "list_items_in_shopping_list", lambda user_id: already_listed)
+    monkeypatch.setattr(app, "spoonacular_request",
+                        lambda *args, **kwargs: FakeResponse(200, app.json.dumps(generated).encode()))
+    monkeypatch.setattr(app, "delete_shopping_list_items", lambda user_id, item_ids: deleted.extend(item_ids))
+    app.PANTRY.add("U-week", ["salt", "sugar"])
+
+    assert app.build_shopping_list_for_dates("U-week", "2026-10-19", "2026-10-25") == {"items_added": 2}
+    assert deleted == [9]
@@ -0,0 +1,59 @@
+import json
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode()
+
+
+def test_byte_budget_evicts_oldest_entries():
+    cache = app.TTLCache(10, max_bytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    cache.set("a", b"12")
+    cache.set("c", b"12345")
+
+    assert "b" not in cache
+    assert (cache.get("a"), cache.get("c")) == (b"12", b"12345")
+    cache.set("d", b"12345678901")
+    assert len(cache) == 0
+
+
+def test_expired_entries_stay_readable_for_stale_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    cache = app.TTLCache(10, ttl=10, stale_ttl=100)
+    cache.set("list", {"aisles": []})
+
+    now[0] += 50
+    assert cache.get("list") is None
+    assert cache.get_stale("list") == {"aisles": []}
+    now[0] += 100
+    assert cache.get_stale("list") is None
+
+
+def test_shopping_list_falls_back_to_its_expired_copy(monkeypatch):
+    fresh = {"aisles": [{"aisle": "Produce", "items": [{"id": 1, "name": "kale"}]}]}
+    responses = [FakeResponse(200, fresh), FakeResponse(503, {"status": "failure", "code": 503})]
+    monkeypatch.setattr(app.ACCOUNT_STORE, "get", lambda user_id: {"username": "user", "hash": "hash"})
+    monkeypatch.setattr(app, "spoonacular_request", lambda *args, **kwargs: responses.pop(0))
+
+    assert app.list_items_in_shopping_list("U-stale") == fresh
+    app.SHOPPING_LIST_CACHE.set("U-stale", app.SHOPPING_LIST_CACHE.get("U-stale"), ttl=0)
+    stale_list = app.list_items_in_shopping_list("U-stale")
+
+    assert stale_list == dict(fresh, stale=True)
+    assert app.create_stale_notice_blocks(stale_list)[0]["elements"][0]["text"] == app.SAY_STALE_RESPONSE
+    assert app.create_stale_notice_blocks(fresh) == []
+
+
+def test_generated_meal_plans_skip_the_cache_when_stale(monkeypatch):
+    stale_plan = {"meals": [{"id": 1}], "nutrients": {}, "stale": True}
+    monkeypatch.setattr(app, "MEAL_PLAN_LOCAL_GENERATOR", False)
+    monkeypatch.setattr(app, "spoonacular_request", lambda *args, **kwargs: FakeResponse(200, stale_plan))
+
+    assert app.generate_meal_plan("Day", 1234, "", "") == stale_plan
+    assert ("Day", 1234, "", "") not in app.MEAL_PLAN_CACHE